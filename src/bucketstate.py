@@ -0,0 +1,105 @@
+"""Small JSON state documents kept in the build logs bucket.
+
+State documents live under the state/ prefix, so they expire with the bucket's lifecycle rule just like build logs.
+Documents that are written concurrently by several Lambda invocations are updated with S3 conditional writes, see
+update().
+"""
+
+import json
+
+import boto3
+import botocore
+
+import config
+import lambdalogging
+import metrics
+
+LOG = lambdalogging.getLogger(__name__)
+
+STATE_PREFIX = 'state/'
+MAX_UPDATE_ATTEMPTS = 10
+
+# created on first use, see _get_s3(), so modules the GetBuildLogs function imports can use this module
+S3 = None
+
+
+class ConflictError(Exception):
+    """Raised when a conditional write fails because the state document was changed concurrently."""
+
+    pass
+
+
+def get(key, bucket_name=None):
+    """Return the state document stored under key, or None if there is none."""
+    return get_with_etag(key, bucket_name)[0]
+
+
+def get_with_etag(key, bucket_name=None):
+    """Return a (document, etag) tuple for the state document stored under key, or (None, None) if there is none."""
+    try:
+        response = _get_s3().get_object(Bucket=bucket_name or config.BUCKET_NAME, Key=STATE_PREFIX + key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None, None
+        raise
+    return json.loads(response['Body'].read()), response['ETag']
+
+
+def put(key, document, bucket_name=None, if_match=None, if_none_match=False):
+    """Store a state document under key and return its new ETag.
+
+    If if_match is given, the document is only written if its current ETag matches. If if_none_match is True, the
+    document is only written if it doesn't exist yet. ConflictError is raised if the condition isn't met.
+    """
+    LOG.debug('Storing state: key=%s, document=%s', key, document)
+    conditions = {}
+    if if_match:
+        conditions['IfMatch'] = if_match
+    if if_none_match:
+        conditions['IfNoneMatch'] = '*'
+
+    try:
+        response = _get_s3().put_object(
+            Bucket=bucket_name or config.BUCKET_NAME,
+            Key=STATE_PREFIX + key,
+            Body=json.dumps(document).encode('utf-8'),
+            ContentType='application/json',
+            **conditions
+        )
+    except botocore.exceptions.ClientError as e:
+        # S3 returns 412 if the condition isn't met and 409 if a concurrent conditional write is in progress
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            raise ConflictError('State document {} was changed concurrently'.format(key)) from e
+        raise
+    return response['ETag']
+
+
+def delete(key, bucket_name=None):
+    """Delete the state document stored under key, if there is one."""
+    LOG.debug('Deleting state: key=%s', key)
+    _get_s3().delete_object(Bucket=bucket_name or config.BUCKET_NAME, Key=STATE_PREFIX + key)
+
+
+def update(key, update_document, bucket_name=None):
+    """Apply update_document to the state document stored under key and return a (document, etag) tuple.
+
+    update_document is called with the current document, or None if there is none, and returns the new document. The
+    new document is written conditionally on the document not having changed in the meantime, and update_document is
+    retried with the latest document if it has, so concurrent updates are never lost.
+    """
+    for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+        document, etag = get_with_etag(key, bucket_name)
+        document = update_document(document)
+        try:
+            etag = put(key, document, bucket_name, if_match=etag, if_none_match=etag is None)
+            return document, etag
+        except ConflictError:
+            LOG.debug('Concurrent update of state document, retrying: key=%s, attempt=%d', key, attempt)
+    raise ConflictError('Could not update state document {} after {} attempts'.format(key, MAX_UPDATE_ATTEMPTS))
+
+
+def _get_s3():
+    global S3
+    if S3 is None:
+        S3 = metrics.instrument(boto3.client('s3'))
+    return S3
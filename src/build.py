@@ -1,18 +1,39 @@
 """Build log processing."""
 
+import json
 import re
 import boto3
+import botocore
 from botocore.client import Config
 from urllib.parse import quote_plus
 
 import config
+import cwlogs
+import dedup
+import errorindex
+import htmlrender
 import lambdalogging
+import livelogs
+import metrics
+import s3upload
 
 LOG = lambdalogging.getLogger(__name__)
 
-CODEBUILD = boto3.client('codebuild')
-CW_LOGS = boto3.client('logs')
+CODEBUILD = metrics.instrument(boto3.client('codebuild'))
+# builds are processed concurrently, so S3 is only accessed through the bucket's client, which, unlike the resource, is
+# safe to share between threads
 BUCKET = boto3.resource('s3', config=Config(signature_version='s3v4')).Bucket(config.BUCKET_NAME)
+metrics.instrument(BUCKET.meta.client)
+
+# build details read from build events, see Build._get_detail()
+EVENT_DETAIL_PATHS = [('sourceVersion',), ('resolvedSourceVersion',), ('logs', 'groupName'), ('logs', 'streamName')]
+
+# build status of builds that are still running; phase change events don't carry a build status, they are only sent
+# while the build is running
+IN_PROGRESS = 'IN_PROGRESS'
+
+# maximum number of build IDs accepted by a single BatchGetBuilds call
+MAX_BATCH_GET_BUILDS = 100
 
 
 class Build:
@@ -23,59 +44,222 @@ class Build:
         self._build_event = build_event
         self.id = build_event['detail']['build-id']
         self.project_name = build_event['detail']['project-name']
-        self.status = build_event['detail']['build-status']
+        self.status = build_event['detail'].get('build-status', IN_PROGRESS)
+        self.first_failure = None
+        self.logs_copy_failed = False
+        self.log_bytes = 0
+        self.log_pages = 0
+        self.log_bytes_written = None
+
+        # build state change events usually carry the details this app needs, which saves a BatchGetBuilds call
+        additional_information = build_event['detail'].get('additional-information', {})
+        logs = additional_information.get('logs', {})
+        self._event_details = {
+            'sourceVersion': additional_information.get('source-version'),
+            'resolvedSourceVersion': additional_information.get('resolved-source-version'),
+            'logs': {
+                'groupName': logs.get('group-name'),
+                'streamName': logs.get('stream-name'),
+            },
+        }
+
+    @property
+    def event(self):
+        """Return the build event this build was created from."""
+        return self._build_event
 
     def get_pr_id(self):
         """If this build was for a PR branch, returns the PR ID, otherwise returns None."""
-        source_version = self._get_build_details().get('sourceVersion', "")
-        matches = re.match(r'^pr\/(\d+)', source_version)
-        if not matches:
-            # check for refs pattern
-            pattern = r'refs/pull/(\d+)/head'
-            matches = re.search(pattern, source_version)
-            if not matches:
-                return None
-        return int(matches.group(1))
+        return _parse_pr_id(self._get_detail('sourceVersion'))
 
     @property
     def commit_id(self):
         """Return the commit ID for this build."""
-        return self._get_build_details()["resolvedSourceVersion"]
+        return self._get_detail('resolvedSourceVersion')
 
     def is_pr_build(self):
         """Return True if this build is associated with a PR."""
         return self.get_pr_id() is not None
 
     def copy_logs(self):
-        """Copy build logs to app S3 bucket and return a URL."""
-        log_info = self._get_build_details()['logs']
-        log_group = log_info['groupName']
-        log_stream = log_info['streamName']
-        paginator = CW_LOGS.get_paginator('filter_log_events')
-
-        iter = paginator.paginate(
-            logGroupName=log_group,
-            logStreamNames=[log_stream]
-        )
-        logs_content = ''.join([event['message'] for page in iter for event in page['events']])
+        """Copy build logs to app S3 bucket.
+
+        Log events are streamed from CloudWatch Logs into S3 in fixed-size parts, so memory use stays bounded no matter
+        how large the build log is. If log compression is enabled, the log is gzipped on the fly and stored with a gzip
+        Content-Encoding so browsers still render it inline.
 
-        BUCKET.put_object(
-            Key=self._get_logs_key(),
-            Body=logs_content,
-            ContentType='text/plain'
+        While the log is streamed, it is scanned for failure markers, and an index of them is stored next to the log,
+        see errorindex. The first failure found is kept in first_failure. If HTML rendering is enabled, a paginated HTML
+        rendition of the log is stored as well, see htmlrender.
+
+        If live logs are enabled, only the log events logged since the last live log update are copied, see livelogs.
+        Live logs are stored uncompressed, and their HTML rendition is rendered from the copied log.
+
+        Otherwise, if log deduplication is enabled, the log is stored as chunks shared with other builds of the same
+        commit, see dedup, and the number of bytes actually uploaded is kept in log_bytes_written.
+        """
+        if config.LIVE_LOGS:
+            indexer = livelogs.finish(BUCKET, self.id, self._get_logs_key(), self._read_log_after,
+                                      config.ERROR_INDEX_PATTERNS, ContentType='text/plain')
+            if config.RENDER_HTML:
+                renderer = self._get_html_renderer()
+                log = BUCKET.meta.client.get_object(Bucket=BUCKET.name, Key=self._get_logs_key())
+                for data in log['Body'].iter_chunks(s3upload.PART_SIZE):
+                    renderer.feed(data)
+                renderer.finish()
+        else:
+            indexer = errorindex.ErrorIndexer(config.ERROR_INDEX_PATTERNS)
+            data = indexer.tap(self._iter_log_bytes())
+            if config.RENDER_HTML:
+                data = self._get_html_renderer().tap(data)
+            if config.DEDUPLICATE_LOGS:
+                self.log_bytes_written = dedup.upload(BUCKET, self._get_logs_key(), self.commit_id, data,
+                                                      config.COMPRESS_LOGS)
+            else:
+                object_args = {'ContentType': 'text/plain'}
+                if config.COMPRESS_LOGS:
+                    data = s3upload.gzip_stream(data)
+                    object_args['ContentEncoding'] = 'gzip'
+
+                self.log_bytes_written = s3upload.upload_stream(BUCKET, self._get_logs_key(), s3upload.rechunk(data),
+                                                                **object_args)
+
+        self.first_failure = indexer.first_failure()
+        BUCKET.meta.client.put_object(
+            Bucket=BUCKET.name,
+            Key=self._get_logs_key() + '.index.json',
+            Body=json.dumps(indexer.to_dict()).encode('utf-8'),
+            ContentType='application/json'
         )
 
+    def append_live_logs(self):
+        """Copy the log events logged since the last update to the live log while the build is running.
+
+        Returns True if the live log was updated, see livelogs.append().
+        """
+        if not self._get_detail('logs', 'streamName'):
+            LOG.debug('Build log stream does not exist yet: build_id=%s', self.id)
+            return False
+        return livelogs.append(BUCKET, self.id, self._get_logs_key(), self._read_log_after,
+                               config.ERROR_INDEX_PATTERNS)
+
     def get_logs_url(self):
         """Return URL to build logs."""
         return '{}?key={}'.format(config.BUILD_LOGS_API_ENDPOINT, quote_plus(self._get_logs_key()))
 
+    def get_first_failure_url(self):
+        """Return URL to the build logs starting at the first failure, or None if no failure was found."""
+        if not self.first_failure:
+            return None
+        return '{}&range={}-'.format(self.get_logs_url(), self.first_failure['offset'])
+
     def _get_logs_key(self):
-        log_stream = self._get_build_details()['logs']['streamName']
+        log_stream = self._get_detail('logs', 'streamName')
         return '{}/build.log'.format(log_stream)
 
+    def _iter_log_bytes(self):
+        log_group = self._get_detail('logs', 'groupName')
+        log_stream = self._get_detail('logs', 'streamName')
+
+        # the event only carries formatted build times, so fetching time windows in parallel needs the build details
+        build_details = self._get_build_details() if config.LOG_FETCH_CONCURRENCY > 1 else {}
+        if build_details.get('startTime') and build_details.get('endTime'):
+            pages = cwlogs.iter_log_events_parallel(
+                log_group,
+                log_stream,
+                _epoch_millis(build_details['startTime']),
+                _epoch_millis(build_details['endTime']),
+                concurrency=config.LOG_FETCH_CONCURRENCY,
+                window_seconds=config.LOG_FETCH_WINDOW_SECONDS,
+            )
+        else:
+            pages = cwlogs.iter_log_events(log_group, log_stream)
+
+        for events in pages:
+            yield self._encode_events(events)
+
+    def _read_log_after(self, next_token):
+        pages = cwlogs.iter_log_events_after(
+            self._get_detail('logs', 'groupName'), self._get_detail('logs', 'streamName'), next_token)
+        try:
+            for events, next_token in pages:
+                yield self._encode_events(events), next_token
+        except botocore.exceptions.ClientError as e:
+            # the log stream is only created once the build starts logging
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            LOG.debug('Build log stream does not exist yet: build_id=%s', self.id)
+
+    def _encode_events(self, events):
+        data = ''.join(event['message'] for event in events).encode('utf-8')
+        self.log_pages += 1
+        self.log_bytes += len(data)
+        return data
+
+    def _get_html_renderer(self):
+        title = '{} build {}'.format(self.project_name, self.id)
+        return htmlrender.HtmlRenderer(BUCKET, self._get_logs_key(), title)
+
+    def _get_detail(self, *path):
+        """Return a build detail from the build event if it carries it, otherwise from BatchGetBuilds."""
+        value = _lookup(self._event_details, path)
+        if value is None:
+            value = _lookup(self._get_build_details(), path)
+        return value
+
+    def _needs_build_details(self):
+        if hasattr(self, '_build_details'):
+            return False
+        # the event rule filters out non-PR builds where it can, but for those that get through no details are needed
+        source_version = self._event_details['sourceVersion']
+        if source_version is not None and _parse_pr_id(source_version) is None:
+            return False
+        return None in (_lookup(self._event_details, path) for path in EVENT_DETAIL_PATHS)
+
     def _get_build_details(self):
         if not hasattr(self, '_build_details'):
             response = CODEBUILD.batch_get_builds(ids=[self.id])
             self._build_details = response['builds'][0]
             LOG.debug('Build %s details: %s', self.id, self._build_details)
         return self._build_details
+
+
+def load_build_details(builds):
+    """Fetch details for many builds up front, using one BatchGetBuilds call per 100 builds.
+
+    Builds whose events carry all the details needed are skipped. Builds CodeBuild doesn't return details for are left
+    alone and fetch their details on first use.
+    """
+    builds = [build for build in builds if build._needs_build_details()]
+    for i in range(0, len(builds), MAX_BATCH_GET_BUILDS):
+        batch = builds[i:i + MAX_BATCH_GET_BUILDS]
+        response = CODEBUILD.batch_get_builds(ids=list(dict.fromkeys(build.id for build in batch)))
+        build_details = {details['id']: details for details in response['builds']}
+        for build in batch:
+            if build.id in build_details:
+                build._build_details = build_details[build.id]
+        if response.get('buildsNotFound'):
+            LOG.warning('Builds not found: %s', response['buildsNotFound'])
+
+
+def _parse_pr_id(source_version):
+    # keep in sync with the source-version filter of the build event patterns in template.yml
+    source_version = source_version or ""
+    matches = re.match(r'^pr\/(\d+)', source_version)
+    if not matches:
+        # check for refs pattern
+        pattern = r'refs/pull/(\d+)/head'
+        matches = re.search(pattern, source_version)
+        if not matches:
+            return None
+    return int(matches.group(1))
+
+
+def _lookup(details, path):
+    for name in path:
+        details = details.get(name) if details else None
+    return details
+
+
+def _epoch_millis(timestamp):
+    return int(timestamp.timestamp() * 1000)
@@ -1,13 +1,28 @@
 """Environment configuration values used by lambda functions."""
 
+import json
 import os
 
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 BUCKET_NAME = os.getenv('BUILD_LOGS_BUCKET_NAME')
 PROJECT_NAME = os.getenv('CODEBUILD_PROJECT_NAME')
-EXPIRATION_IN_DAYS = int(os.getenv('EXPIRATION_IN_DAYS'))
+EXPIRATION_IN_DAYS = int(os.getenv('EXPIRATION_IN_DAYS', '30'))
 BUILD_LOGS_API_ENDPOINT = os.getenv('BUILD_LOGS_API_ENDPOINT')
 GITHUB_OAUTH_TOKEN_SECRET_ARN = os.getenv('GITHUB_OAUTH_TOKEN_SECRET_ARN')
 REGION = os.getenv('AWS_DEFAULT_REGION')
 DELETE_PREVIOUS_COMMENTS = os.getenv('DELETE_PREVIOUS_COMMENTS') == 'true'
 COMMENT_ON_SUCCESS = os.getenv('COMMENT_ON_SUCCESS') == 'true'
+COMPRESS_LOGS = os.getenv('COMPRESS_LOGS') == 'true'
+DEDUPLICATE_LOGS = os.getenv('DEDUPLICATE_LOGS') == 'true'
+RENDER_HTML = os.getenv('RENDER_HTML') == 'true'
+LIVE_LOGS = os.getenv('LIVE_LOGS') == 'true'
+LOG_FETCH_CONCURRENCY = int(os.getenv('LOG_FETCH_CONCURRENCY', '1'))
+LOG_FETCH_WINDOW_SECONDS = int(os.getenv('LOG_FETCH_WINDOW_SECONDS', '300'))
+GITHUB_API_URL = os.getenv('GITHUB_API_URL') or 'https://api.github.com'
+GITHUB_CACHE_TTL_SECONDS = int(os.getenv('GITHUB_CACHE_TTL_SECONDS', '900'))
+GITHUB_MAX_CONCURRENT_REQUESTS = int(os.getenv('GITHUB_MAX_CONCURRENT_REQUESTS', '8'))
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv('GITHUB_RATE_LIMIT_RESERVE', '0'))
+DEFERRED_WORK_QUEUE_URL = os.getenv('DEFERRED_WORK_QUEUE_URL')
+COMMENT_MODE = os.getenv('COMMENT_MODE', 'new')
+AGGREGATED_COMMENT_BUCKET_NAME = os.getenv('AGGREGATED_COMMENT_BUCKET_NAME') or BUCKET_NAME
+ERROR_INDEX_PATTERNS = json.loads(os.getenv('ERROR_INDEX_PATTERNS') or 'null')
@@ -0,0 +1,112 @@
+"""Read build log events from CloudWatch Logs."""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import random
+import time
+
+import boto3
+import botocore
+
+import lambdalogging
+import metrics
+
+LOG = lambdalogging.getLogger(__name__)
+
+CW_LOGS = metrics.instrument(boto3.client('logs'))
+
+MAX_THROTTLE_RETRIES = 6
+THROTTLE_BASE_DELAY_SECONDS = 0.2
+
+
+def iter_log_events(log_group, log_stream, start_time=None, end_time=None):
+    """Yield pages of log events for a single log stream, oldest first, using GetLogEvents.
+
+    GetLogEvents reads one stream directly and returns full pages, so it is the preferred way to read a build log.
+    Optionally only events with start_time <= timestamp < end_time (epoch milliseconds) are read. Once the end of the
+    stream is reached, GetLogEvents returns the same forward token that was passed in.
+    """
+    args = {
+        'logGroupName': log_group,
+        'logStreamName': log_stream,
+        'startFromHead': True,
+    }
+    if start_time is not None:
+        args['startTime'] = start_time
+    if end_time is not None:
+        args['endTime'] = end_time
+
+    for events, _ in _iter_pages(args):
+        yield events
+
+
+def iter_log_events_after(log_group, log_stream, next_token=None):
+    """Yield (events, next_token) tuples of pages of log events logged after next_token, oldest first.
+
+    Reads the whole stream if next_token is None. Passing the last next_token yielded to a later call resumes reading
+    where this one stopped, so a stream that is still being written can be read incrementally.
+    """
+    args = {
+        'logGroupName': log_group,
+        'logStreamName': log_stream,
+        'startFromHead': True,
+    }
+    if next_token is not None:
+        args['nextToken'] = next_token
+    return _iter_pages(args)
+
+
+def iter_log_events_parallel(log_group, log_stream, start_time, end_time, concurrency, window_seconds):
+    """Yield pages of log events for a single log stream, oldest first, fetching time windows concurrently.
+
+    The time range between start_time and end_time (epoch milliseconds) is split into windows of window_seconds. Up to
+    concurrency windows are fetched at once and their pages are yielded in order, so memory use is bounded by the log
+    output of concurrency windows. The first and last windows are open-ended so events logged just outside the time
+    range are not lost.
+    """
+    boundaries = list(range(start_time, end_time, window_seconds * 1000))[1:]
+    windows = iter(zip([None] + boundaries, boundaries + [None]))
+    LOG.debug('Fetching log stream %s in %d time windows with concurrency %d',
+              log_stream, len(boundaries) + 1, concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def submit(windows):
+            return collections.deque(
+                executor.submit(_fetch_window, log_group, log_stream, window_start, window_end)
+                for window_start, window_end in windows
+            )
+
+        pending = submit(itertools.islice(windows, concurrency))
+        while pending:
+            pages = pending.popleft().result()
+            pending.extend(submit(itertools.islice(windows, 1)))
+            yield from pages
+
+
+def _iter_pages(args):
+    while True:
+        response = _get_log_events(**args)
+        yield response['events'], response['nextForwardToken']
+
+        next_token = response['nextForwardToken']
+        if next_token == args.get('nextToken'):
+            return
+        args['nextToken'] = next_token
+
+
+def _fetch_window(log_group, log_stream, start_time, end_time):
+    return [events for events in iter_log_events(log_group, log_stream, start_time, end_time) if events]
+
+
+def _get_log_events(**args):
+    for attempt in itertools.count(1):
+        try:
+            return CW_LOGS.get_log_events(**args)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ThrottlingException' or attempt > MAX_THROTTLE_RETRIES:
+                raise
+            # exponential backoff with full jitter so concurrent window fetches don't retry in lockstep
+            delay = random.uniform(0, THROTTLE_BASE_DELAY_SECONDS * 2 ** attempt)
+            LOG.debug('GetLogEvents throttled, retrying in %.2fs: attempt=%d', delay, attempt)
+            time.sleep(delay)
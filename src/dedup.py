@@ -0,0 +1,153 @@
+"""Deduplication of build logs with content-defined chunking.
+
+Retried builds of the same commit usually log nearly the same lines. Instead of storing a full copy of every log, the
+log is split into chunks at content-defined boundaries, and each chunk is stored under the SHA-256 hash of its content,
+so chunks shared with another build of the same commit are only stored once. A manifest stored next to the log lists
+its chunks in order, see get_manifest_key(). The build logs API reassembles the log from them, see s3read.
+
+Chunk boundaries are found with a gear hash rolled over the lines of the log: each line shifts the hash left by one bit
+and adds the CRC-32 of the line, so the lowest BOUNDARY_BITS bits of the hash only depend on the last BOUNDARY_BITS
+lines. A chunk ends after a line that leaves them all zero. A line that differs between two logs, e.g., because it holds
+a timestamp, only moves the boundaries right after it, and the chunks following those are identical again. Hashing
+lines instead of bytes keeps chunking fast, and only lines longer than MAX_CHUNK_SIZE are ever split across chunks.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import json
+import zlib
+
+import botocore.exceptions
+
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+CHUNK_PREFIX = 'chunks/'
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+# with lines of about 100 bytes, chunks are about 128 KiB on average: a changed line costs that much storage, while a
+# 100 MB log takes under 1000 chunks, each needing a HEAD request and, unless it already exists, a PUT request
+MIN_CHUNK_SIZE = 32 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+BOUNDARY_BITS = 10
+BOUNDARY_MASK = (1 << BOUNDARY_BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+# stays below the 10 connections botocore pools per client by default
+MAX_CONCURRENT_CHUNK_UPLOADS = 8
+
+
+def get_manifest_key(log_key):
+    """Return the key of the manifest of the log stored as chunks under log_key."""
+    return log_key + MANIFEST_SUFFIX
+
+
+def iter_chunks(byte_iter):
+    """Split an iterable of byte strings into content-defined chunks of whole lines, see module docstring."""
+    chunk = bytearray()
+    partial_line = b''
+    rolling_hash = 0
+    for data in byte_iter:
+        lines = (partial_line + data).split(b'\n')
+        partial_line = lines.pop()
+        for line in lines:
+            if len(chunk) + len(line) >= MAX_CHUNK_SIZE:
+                yield from _split(chunk)
+                chunk = bytearray()
+            chunk += line
+            chunk += b'\n'
+            rolling_hash = ((rolling_hash << 1) + zlib.crc32(line)) & HASH_MASK
+            if len(chunk) >= MIN_CHUNK_SIZE and not rolling_hash & BOUNDARY_MASK:
+                yield bytes(chunk)
+                chunk = bytearray()
+
+        # a line longer than a chunk is split, so memory use stays bounded
+        if len(partial_line) >= MAX_CHUNK_SIZE:
+            yield from _split(chunk)
+            chunk = bytearray(partial_line)
+            partial_line = b''
+            while len(chunk) >= MAX_CHUNK_SIZE:
+                yield bytes(chunk[:MAX_CHUNK_SIZE])
+                del chunk[:MAX_CHUNK_SIZE]
+
+    chunk += partial_line
+    if chunk:
+        yield bytes(chunk)
+
+
+def _split(chunk):
+    # the rest of a split line follows a chunk ending mid-line, so it can be longer than a chunk, see iter_chunks()
+    for start in range(0, len(chunk), MAX_CHUNK_SIZE):
+        yield bytes(chunk[start:start + MAX_CHUNK_SIZE])
+
+
+def upload(bucket, log_key, scope, byte_iter, compress=False):
+    """Store the log read from byte_iter as chunks and store its manifest; return the number of bytes uploaded.
+
+    Chunks are stored under chunks/<scope>/<SHA-256 hash>, e.g., with the build's commit ID as scope, so only the logs
+    of builds of the same commit share chunks. Chunks that already exist aren't uploaded again. If compress is True,
+    each chunk is gzipped on its own. Concatenated gzip members form a valid gzip stream, so the chunks still make up
+    the compressed log.
+    """
+    object_args = {'ContentType': 'text/plain'}
+    if compress:
+        object_args['ContentEncoding'] = 'gzip'
+
+    chunks = []
+    size = 0
+    bytes_written = 0
+    # chunks are stored concurrently, but only a few are held in memory at a time
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHUNK_UPLOADS) as executor:
+        pending = collections.deque()
+        for data in iter_chunks(byte_iter):
+            key = '{}{}/{}{}'.format(CHUNK_PREFIX, scope, hashlib.sha256(data).hexdigest(), '.gz' if compress else '')
+            chunks.append({'key': key, 'size': len(data)})
+            size += len(data)
+            if compress:
+                data = _gzip(data)
+            pending.append(executor.submit(_store_chunk, bucket, key, data, object_args))
+            if len(pending) >= MAX_CONCURRENT_CHUNK_UPLOADS:
+                bytes_written += pending.popleft().result()
+        for future in pending:
+            bytes_written += future.result()
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'size': size,
+        'content_encoding': object_args.get('ContentEncoding'),
+        'chunks': chunks,
+    }
+    bucket.meta.client.put_object(Bucket=bucket.name, Key=get_manifest_key(log_key),
+                                  Body=json.dumps(manifest).encode('utf-8'), ContentType='application/json')
+    LOG.debug('Stored deduplicated log: key=%s, size=%d, chunks=%d, bytes_written=%d',
+              log_key, size, len(chunks), bytes_written)
+    return bytes_written
+
+
+def _store_chunk(bucket, key, data, object_args):
+    """Store a chunk unless it already exists, and return the number of bytes uploaded."""
+    client = bucket.meta.client
+    try:
+        head = client.head_object(Bucket=bucket.name, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != '404':
+            raise
+        client.put_object(Bucket=bucket.name, Key=key, Body=data, **object_args)
+        return len(data)
+
+    # objects expire a number of days after the day they were created, so a chunk created on an earlier day is copied
+    # onto itself, server-side, to not expire before the log that now uses it
+    if head['LastModified'].date() < datetime.datetime.now(datetime.timezone.utc).date():
+        LOG.debug('Renewing chunk: key=%s', key)
+        client.copy_object(Bucket=bucket.name, Key=key, CopySource={'Bucket': bucket.name, 'Key': key},
+                           MetadataDirective='REPLACE', **object_args)
+    return 0
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # +16 selects the gzip container format
+    return compressor.compress(data) + compressor.flush()
@@ -0,0 +1,74 @@
+"""Deferral of GitHub work while the GitHub rate limit budget is low.
+
+Instead of failing a build event, or waiting for the rate limit to reset for longer than the Lambda function may run,
+GitHub work that can't be done right now is sent to the deferred work SQS queue along with the build event. The queue
+delivers it to the ProcessBuildEvents function again once the rate limit budget is expected to be reset.
+"""
+
+import json
+
+import boto3
+
+from build import Build
+import config
+import lambdalogging
+import metrics
+
+LOG = lambdalogging.getLogger(__name__)
+
+# deferred tasks, in the order they are done
+PUBLISH_COMMENT = 'publish_comment'
+UPDATE_COMMENT = 'update_comment'
+DELETE_PREVIOUS_COMMENTS = 'delete_previous_comments'
+DELETE_LIVE_COMMENT = 'delete_live_comment'
+TASKS = [PUBLISH_COMMENT, UPDATE_COMMENT, DELETE_PREVIOUS_COMMENTS, DELETE_LIVE_COMMENT]
+
+# SQS delays messages by at most 15 minutes; work that still can't be done by then is deferred again
+MIN_DELAY_SECONDS = 60
+MAX_DELAY_SECONDS = 900
+
+# created on first use, see _get_sqs()
+SQS = None
+
+
+def is_enabled():
+    """Return True if GitHub work can be deferred."""
+    return bool(config.DEFERRED_WORK_QUEUE_URL)
+
+
+def defer(build, tasks, comment_id=None, delay_seconds=0):
+    """Send the given tasks for a build to the deferred work queue, to be delivered after delay_seconds.
+
+    comment_id is the ID of the comment already published for the build, if there is one. The build's first failure is
+    sent along, so a deferred comment links to it. The tasks are sorted into the order they are done in, so previous
+    comments are only deleted once the build's own comment is published and can be kept.
+    """
+    tasks = sorted(tasks, key=TASKS.index)
+    delay_seconds = int(min(MAX_DELAY_SECONDS, max(MIN_DELAY_SECONDS, delay_seconds)))
+    LOG.info('Deferring GitHub work: build_id=%s, tasks=%s, delay_seconds=%d', build.id, tasks, delay_seconds)
+    message = {
+        'deferred': {'tasks': tasks, 'comment_id': comment_id, 'first_failure': build.first_failure},
+        'build_event': build.event,
+    }
+    _get_sqs().send_message(QueueUrl=config.DEFERRED_WORK_QUEUE_URL, MessageBody=json.dumps(message),
+                            DelaySeconds=delay_seconds)
+
+
+def is_deferred(message):
+    """Return True if an SQS message body holds deferred work rather than a build event."""
+    return 'deferred' in message
+
+
+def load(message):
+    """Return a (build, tasks, comment_id) tuple for the deferred work held by an SQS message body."""
+    deferred = message['deferred']
+    build = Build(message['build_event'])
+    build.first_failure = deferred['first_failure']
+    return build, deferred['tasks'], deferred['comment_id']
+
+
+def _get_sqs():
+    global SQS
+    if SQS is None:
+        SQS = metrics.instrument(boto3.client('sqs'))
+    return SQS
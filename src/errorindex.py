@@ -0,0 +1,124 @@
+"""Index of failure markers in a build log, built while the log is streamed."""
+
+import base64
+import re
+
+# a line is indexed under the class of its leftmost match, and classes are tried in order for matches at the same
+# position
+DEFAULT_PATTERNS = {
+    'traceback': r'^Traceback \(most recent call last\):',
+    'error': r'\bERROR\b',
+    'failed': r'\bFAILED\b',
+    # CodeBuild's own failure lines also start with [Container], so this class must come before phase
+    'command_failed': (r'^\[Container\] .*(?:Command did not exit successfully'
+                       r'|Phase complete: \w+ State: FAILED|Phase context status code: \w+_ERROR)'),
+    'phase': r'^\[Container\] .*(?:Entering phase|Phase complete:)',
+}
+
+# classes that only mark the structure of a build log rather than a failure
+NON_FAILURE_CLASSES = {'phase'}
+
+MAX_ENTRIES = 10000
+
+
+class ErrorIndexer:
+    """Scan a build log for lines matching failure patterns and record where they are.
+
+    Each entry records the line number (starting at 1), the byte offset of the start of the line and the class of the
+    pattern it matched. All patterns are combined into a single regex that runs once over each chunk of complete
+    lines, so scanning is linear in the size of the log and memory is bounded by the chunk size.
+    """
+
+    def __init__(self, patterns=None):
+        """Create indexer for the given mapping of class names to regexes, or DEFAULT_PATTERNS."""
+        patterns = patterns or DEFAULT_PATTERNS
+        self.classes = list(patterns)
+        self._regex = re.compile(
+            '|'.join('(?P<c{}>{})'.format(i, pattern) for i, pattern in enumerate(patterns.values())).encode('utf-8'),
+            re.MULTILINE
+        )
+        self.entries = []
+        self.truncated = False
+        self._line = 1
+        self._offset = 0
+        self._partial_line = b''
+
+    def tap(self, byte_iter):
+        """Scan an iterable of byte strings while passing it through unchanged."""
+        for data in byte_iter:
+            self.scan(data)
+            yield data
+        self.finish()
+
+    def scan(self, data):
+        """Scan the next chunk of the log."""
+        data = self._partial_line + data
+        end = data.rfind(b'\n') + 1
+        self._partial_line = data[end:]
+        self._scan_lines(data[:end])
+
+    def finish(self):
+        """Scan the last line of the log, if the log doesn't end with a newline."""
+        self._scan_lines(self._partial_line)
+        self._partial_line = b''
+
+    def first_failure(self):
+        """Return the first entry of a failure class, or None if there is none."""
+        return next((entry for entry in self.entries if entry['class'] not in NON_FAILURE_CLASSES), None)
+
+    def to_dict(self):
+        """Return the index in a compact form suitable for storing as JSON."""
+        return {
+            'classes': self.classes,
+            'entries': [[entry['line'], entry['offset'], entry['class']] for entry in self.entries],
+            'truncated': self.truncated,
+        }
+
+    def get_state(self):
+        """Return the scanning state as a JSON serializable dict, so scanning can be resumed later, see from_state()."""
+        return {
+            'entries': self.to_dict()['entries'],
+            'truncated': self.truncated,
+            'line': self._line,
+            'offset': self._offset,
+            'partialLine': base64.b64encode(self._partial_line).decode('ascii'),
+        }
+
+    @classmethod
+    def from_state(cls, state, patterns=None):
+        """Create indexer resuming from a state returned by get_state(), or a new one if state is None."""
+        indexer = cls(patterns)
+        if state:
+            indexer.entries = [{'line': line, 'offset': offset, 'class': match_class}
+                               for line, offset, match_class in state['entries']]
+            indexer.truncated = state['truncated']
+            indexer._line = state['line']
+            indexer._offset = state['offset']
+            indexer._partial_line = base64.b64decode(state['partialLine'])
+        return indexer
+
+    def _scan_lines(self, data):
+        counted_until = 0
+        previous_line_start = -1
+        for match in self._regex.finditer(data) if not self.truncated else []:
+            line_start = data.rfind(b'\n', 0, match.start()) + 1
+            if line_start == previous_line_start:
+                continue  # only index the first match in each line
+            previous_line_start = line_start
+
+            self._line += data.count(b'\n', counted_until, line_start)
+            counted_until = line_start
+            if len(self.entries) >= MAX_ENTRIES:
+                self.truncated = True
+                break
+            self.entries.append({
+                'line': self._line,
+                'offset': self._offset + line_start,
+                'class': self._match_class(match),
+            })
+
+        self._line += data.count(b'\n', counted_until)
+        self._offset += len(data)
+
+    def _match_class(self, match):
+        return next(self.classes[i] for i in range(len(self.classes)) if match.group('c{}'.format(i)) is not None)
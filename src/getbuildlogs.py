@@ -4,26 +4,71 @@
 import lambdainit  # noqa: F401
 
 import json
+import re
 from urllib.parse import unquote_plus
 
+import config
+import htmlrender
 import lambdalogging
+import livelogs
+import metrics
 import s3link
+import s3read
 
 LOG = lambdalogging.getLogger(__name__)
 
+MAX_TAIL_LINES = 10000
+_NOT_CACHED = object()
+
 
 def handler(api_event, context):
     """Handle GET /buildlogs request.
 
-    Redirects to pre-signed URL to build logs.
+    Redirects to pre-signed URL to build logs. If the tail query parameter is given, returns only the last tail lines
+    of the build logs instead. If the range query parameter is given, e.g., range=1000-1999, returns only that byte
+    range of the build logs.
+
+    If an HTML rendition of the build logs exists, redirects to its table of contents page instead, unless the raw
+    query parameter is given. While the build is still running, the logs copied so far are served, see livelogs.
+
+    Build logs stored as chunks, see dedup, are reassembled. If they are too large to be returned at once, a page that
+    loads their chunks in the browser is returned instead of a redirect.
+
+    Presigned URL cache hits and misses are emitted as a CloudWatch Embedded Metric Format line, see metrics.
     """
     LOG.debug('Received event: %s', api_event)
-    log_key = api_event.get('queryStringParameters', {}).get('key')
+    invocation_metrics = metrics.start()
+    cache_stats = s3link.URL_CACHE.stats()
+    try:
+        return _handle(api_event)
+    finally:
+        invocation_metrics.increment_cache_stats('PresignedUrlCache', cache_stats, s3link.URL_CACHE.stats())
+        invocation_metrics.emit()
+
+
+def _handle(api_event):
+    query_parameters = api_event.get('queryStringParameters') or {}
+    log_key = query_parameters.get('key')
 
     if not log_key:
         return _bad_request('missing expected query parameter: key')
-
-    redirect_link = s3link.get_presigned_url(unquote_plus(log_key))
+    log_key = unquote_plus(log_key)
+
+    if 'tail' in query_parameters:
+        return _tail(log_key, query_parameters['tail'])
+    if 'range' in query_parameters:
+        return _range(log_key, query_parameters['range'])
+
+    redirect_link = None
+    if config.RENDER_HTML and log_key.endswith('/build.log') and 'raw' not in query_parameters:
+        redirect_link = s3link.get_presigned_url(htmlrender.get_index_key(log_key))
+    redirect_link = redirect_link or s3link.get_presigned_url(log_key)
+    if not redirect_link:
+        manifest = _read_manifest(log_key)
+        if manifest:
+            return _chunked(log_key, manifest)
+    if not redirect_link and _may_be_live(log_key):
+        redirect_link = s3link.get_presigned_url(livelogs.get_live_key(log_key))
     LOG.debug('redirect_link: %s', redirect_link)
 
     if redirect_link:
@@ -32,6 +77,74 @@ def handler(api_event, context):
         return _not_found()
 
 
+def _tail(log_key, tail):
+    if not tail.isdigit() or not 1 <= int(tail) <= MAX_TAIL_LINES:
+        return _bad_request('query parameter tail must be a number of lines between 1 and {}'.format(MAX_TAIL_LINES))
+
+    content = s3read.read_tail(log_key, int(tail))
+    if content is None:
+        manifest = _read_manifest(log_key)
+        if manifest:
+            content = s3read.read_chunked_tail(manifest, int(tail))
+    if content is None and _may_be_live(log_key):
+        content = s3read.read_tail(livelogs.get_live_key(log_key), int(tail))
+    if content is None:
+        return _not_found()
+    return _text(content)
+
+
+def _range(log_key, byte_range):
+    matches = re.match(r'^(\d+)-(\d*)$', byte_range)
+    if not matches or (matches.group(2) and int(matches.group(2)) < int(matches.group(1))):
+        return _bad_request('query parameter range must be a byte range like 1000-1999 or 1000-')
+
+    start, end = int(matches.group(1)), int(matches.group(2)) if matches.group(2) else None
+    result = s3read.read_range(log_key, start, end)
+    if result is None:
+        manifest = _read_manifest(log_key)
+        if manifest:
+            result = s3read.read_chunked_range(manifest, start, end)
+    if result is None and _may_be_live(log_key):
+        result = s3read.read_range(livelogs.get_live_key(log_key), start, end)
+    if result is None:
+        return _not_found()
+
+    content, start, end, size = result
+    total = '*' if size is None else size
+    if end < start:
+        return _response(status_code=416, headers={'Content-Range': 'bytes */{}'.format(total)})
+    return _text(content, status_code=206, headers={'Content-Range': 'bytes {}-{}/{}'.format(start, end, total)})
+
+
+# only the keys that the enabled features store are looked up, so a missing log costs as few S3 requests as possible
+def _may_be_live(log_key):
+    return config.LIVE_LOGS and log_key.endswith('/build.log')
+
+
+def _read_manifest(log_key):
+    # only build logs are ever stored as chunks
+    if not (config.DEDUPLICATE_LOGS and log_key.endswith('/build.log')):
+        return None
+    # manifests don't change once they're stored, so they're cached along with the presigned URLs, like logs that
+    # aren't stored as chunks; the key can't collide with those of the presigned URLs, which are strings
+    cache_key = ('manifest', log_key)
+    manifest = s3link.URL_CACHE.get(cache_key, _NOT_CACHED)
+    if manifest is _NOT_CACHED:
+        manifest = s3read.read_manifest(log_key)
+        s3link.URL_CACHE.put(cache_key, manifest, ttl=s3link.NOT_FOUND_CACHE_TTL_SECONDS if manifest is None else None)
+    return manifest
+
+
+def _chunked(log_key, manifest):
+    if manifest['size'] <= s3read.MAX_READ_BYTES:
+        return _text(s3read.read_chunked_range(manifest, 0)[0])
+    chunk_urls = s3link.get_presigned_urls([chunk['key'] for chunk in manifest['chunks']])
+    return _response(
+        headers={'Content-Type': 'text/html; charset=utf-8'},
+        body=htmlrender.render_chunk_viewer(log_key, log_key.split('/')[-2] + ' build log', chunk_urls)
+    )
+
+
 def _bad_request(message):
     return _response(
         status_code=400,
@@ -43,6 +156,14 @@ def _not_found():
     return _response(status_code=404)
 
 
+def _text(content, status_code=200, headers={}):
+    return _response(
+        status_code=status_code,
+        headers=dict(headers, **{'Content-Type': 'text/plain; charset=utf-8'}),
+        body=content
+    )
+
+
 def _redirect(redirect_link):
     return _response(
         status_code=307,
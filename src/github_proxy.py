@@ -1,12 +1,23 @@
 """Proxy for interacting with Github."""
 
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 import re
+import threading
+from urllib.parse import quote
 
 import boto3
-from github import Github, GithubException
+from github import (BadCredentialsException, Github, GithubException, GithubRetry, RateLimitExceededException,
+                    UnknownObjectException)
 
+from build import IN_PROGRESS
+import bucketstate
 import config
 import lambdalogging
+import metrics
+from ratelimit import RateLimitTracker
+from ttlcache import TTLCache
 
 LOG = lambdalogging.getLogger(__name__)
 
@@ -25,7 +36,7 @@ PR_COMMENT_TEMPLATE = f"""
 
 * CodeBuild project: {{project_name}}
 * Commit ID: {{commit_id}}
-* Result: {{build_status}}
+* Result: {{build_status}}{{first_failure}}
 * [Build Logs]({{logs_url}}) (available for {config.EXPIRATION_IN_DAYS} days)
 
 *Powered by [github-codebuild-logs]({SAR_APP_URL}),\
@@ -34,58 +45,386 @@ PR_COMMENT_TEMPLATE = f"""
 {HIDDEN_COMMENT}
 """
 
-CODEBUILD = boto3.client('codebuild')
-SECRETS_MANAGER = boto3.client('secretsmanager')
+AGGREGATED_PR_COMMENT_TEMPLATE = f"""
+### AWS CodeBuild CI Report
+
+* Commit ID: {{commit_id}}
+
+| CodeBuild project | Result | Build Logs |
+| --- | --- | --- |
+{{rows}}
+
+*Powered by [github-codebuild-logs]({SAR_APP_URL}),\
+ available on the [AWS Serverless Application Repository]({SAR_HOMEPAGE})*
+
+{HIDDEN_COMMENT}
+"""
+
+AGGREGATED_PR_COMMENT_ROW_TEMPLATE = ('| {project_name} | {build_status}{first_failure} | '
+                                      '[Build Logs]({logs_url}) (available for {expiration_in_days} days) |')
+
+# number of times an aggregated comment is re-rendered when concurrent builds keep changing its state
+MAX_AGGREGATED_COMMENT_RENDERS = 3
+
+# GitHub's maximum page size for listing comments
+COMMENTS_PER_PAGE = 100
+
+# status codes of GitHub responses that are retried; 403 responses are only retried if they are rate limit errors
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RETRY_METHODS = ['GET', 'POST', 'PATCH', 'DELETE']
+MAX_RETRIES = 5
+
+CODEBUILD = metrics.instrument(boto3.client('codebuild'))
+SECRETS_MANAGER = metrics.instrument(boto3.client('secretsmanager'))
+
+
+class FailFastRetry(GithubRetry):
+    """Retry GitHub requests like GithubRetry, except those rejected because the rate limit budget is exhausted.
+
+    GithubRetry waits for the budget to reset, which can take longer than the Lambda function may run. Instead, these
+    requests fail with RateLimitExceededException right away, so the work can be deferred.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        """Raise RateLimitExceededException for responses that exhausted the budget, otherwise see GithubRetry."""
+        if response is not None and response.status in (403, 429) and \
+                response.headers.get('X-RateLimit-Remaining') == '0':
+            raise RateLimitExceededException(response.status, {'message': 'GitHub rate limit budget is exhausted'},
+                                             dict(response.headers))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
 
 
 class GithubProxy:
     """Encapsulate interactions with Github."""
 
     def __init__(self):
-        """Initialize proxy."""
-        pass
+        """Initialize proxy.
+
+        GitHub is accessed through plain REST requests addressed by owner/repo and PR number, without hydrating any
+        PyGithub objects first, so each action costs as few requests as possible. The GitHub client, and the CodeBuild
+        project info and OAuth token it was created from, are cached across warm invocations for
+        GITHUB_CACHE_TTL_SECONDS, so rotated tokens are picked up without a cold start.
+
+        The GitHub client keeps a pool of GITHUB_MAX_CONCURRENT_REQUESTS keep-alive connections, so that many requests
+        can be sent at the same time. Instead of spacing out requests up front, rate limited requests are retried after
+        the time GitHub asks for in its Retry-After or rate limit reset headers.
+
+        The rate limit budget GitHub reports is tracked across warm containers, see ratelimit. Once it is exhausted,
+        requests fail with RateLimitExceededException right away, instead of waiting for the reset for longer than the
+        Lambda function may run. So do requests that GitHub rejects because the budget is exhausted, e.g., by other
+        users of the same token, see FailFastRetry.
+        """
+        self._cache = TTLCache(ttl=config.GITHUB_CACHE_TTL_SECONDS)
+        self._rate_limit = RateLimitTracker()
+        self._request_counts = collections.Counter()
+        self._request_counts_lock = threading.Lock()
+
+    def get_cache_stats(self):
+        """Return hit and miss counts of the GitHub info cache."""
+        return self._cache.stats()
+
+    def is_rate_limit_low(self, critical=False):
+        """Return True if the GitHub rate limit budget is too low to send a request now.
+
+        Requests that aren't critical, e.g., deleting previous comments, leave GITHUB_RATE_LIMIT_RESERVE requests of
+        the budget to critical ones, which are only held back once the budget is exhausted.
+        """
+        remaining = self._rate_limit.get_remaining()
+        return remaining is not None and remaining < (1 if critical else config.GITHUB_RATE_LIMIT_RESERVE)
+
+    def get_rate_limit_reset_seconds(self):
+        """Return the number of seconds until the GitHub rate limit budget resets, or 0 if it isn't known."""
+        return self._rate_limit.get_seconds_until_reset()
+
+    def sync_rate_limit(self):
+        """Share the GitHub rate limit budget reported to this container with other containers."""
+        self._rate_limit.sync(force=True)
+
+    def pop_request_count(self, build):
+        """Return the number of GitHub requests made for the given build and stop tracking it."""
+        with self._request_counts_lock:
+            return self._request_counts.pop(build.id, 0)
 
     def publish_pr_comment(self, build):
-        """Publish PR comment with link to build logs."""
-        pr_comment = PR_COMMENT_TEMPLATE.format(
-            project_name=config.PROJECT_NAME,
-            commit_id=build.commit_id,
-            build_status=build.status,
-            logs_url=build.get_logs_url(),
-        )
+        """Publish PR comment with link to build logs and return the comment ID.
+
+        In sticky comment mode, the app's existing comment on the PR is updated in place instead. In aggregated comment
+        mode, the build's result is added to a single comment listing the results of all projects built for the commit.
+        If live logs are enabled, the comment published while the build was running is updated in place, see
+        _publish_live_comment().
+        """
+        pr_comment = _render_pr_comment(build)
+
+        if config.COMMENT_MODE == 'sticky':
+            return self._publish_sticky_comment(build, pr_comment)
+        if config.COMMENT_MODE == 'aggregated':
+            return self._publish_aggregated_comment(build)
+        if config.LIVE_LOGS:
+            return self._publish_live_comment(build, pr_comment)
+
+        LOG.debug('Publishing PR Comment: pr_id=%s, comment=%s', build.get_pr_id(), pr_comment)
+        _, comment = self._request(build, 'POST', '/issues/{}/comments'.format(build.get_pr_id()),
+                                   input={'body': pr_comment})
+        return comment['id']
+
+    def delete_live_comment(self, build):
+        """Delete the comment published for a build while it was running, if there is one, see publish_pr_comment()."""
+        comment_id = self._get_live_comment_id(build)
+        if not comment_id:
+            return
+        LOG.debug('Deleting live logs PR Comment: pr_id=%s, comment_id=%s', build.get_pr_id(), comment_id)
+        try:
+            self._request(build, 'DELETE', '/issues/comments/{}'.format(comment_id))
+        except UnknownObjectException:
+            LOG.debug('Live logs PR comment no longer exists: pr_id=%s, comment_id=%s', build.get_pr_id(), comment_id)
+
+    def update_pr_comment(self, build, comment_id):
+        """Update the comment published for a build with publish_pr_comment(), e.g., once its first failure is known."""
+        if config.COMMENT_MODE == 'aggregated':
+            return self._publish_aggregated_comment(build)
+
+        pr_comment = _render_pr_comment(build)
+        LOG.debug('Updating PR Comment: pr_id=%s, comment_id=%s, comment=%s', build.get_pr_id(), comment_id, pr_comment)
+        self._request(build, 'PATCH', '/issues/comments/{}'.format(comment_id), input={'body': pr_comment})
+        return comment_id
+
+    def retract_pr_comment(self, build, comment_id):
+        """Roll back the comment published for a build with publish_pr_comment() if its logs couldn't be copied.
+
+        A new comment is deleted, so retrying the build event doesn't leave a duplicate comment behind. Sticky and
+        aggregated comments are updated to show that copying the logs failed instead, since they're shared with other
+        builds.
+        """
+        if config.COMMENT_MODE != 'new':
+            return self.update_pr_comment(build, comment_id)
+
+        LOG.debug('Deleting PR Comment: pr_id=%s, comment_id=%s', build.get_pr_id(), comment_id)
+        self._request(build, 'DELETE', '/issues/comments/{}'.format(comment_id))
 
-        repo = self._get_repo()
-        LOG.debug('Publishing PR Comment: repo=%s/%s, pr_id=%s, comment=%s',
-                  self._github_owner, self._github_repo, build.get_pr_id(), pr_comment)
-        repo.get_pull(build.get_pr_id()).create_issue_comment(pr_comment)
-
-    def delete_previous_comments(self, build):
-        """Delete previous PR comments."""
-        repo = self._get_repo()
-        for comment in repo.get_issue(build.get_pr_id()).get_comments():
-            if HIDDEN_COMMENT in comment.body:  # Check for hidden comment in body
-                try:  # Not critical, catch all GitHub exceptions here
-                    LOG.debug('Deleting previous comment: repo=%s/%s, pr_id=%s, comment_id=%s',
-                              self._github_owner, self._github_repo, build.get_pr_id(), comment.id)
-                    comment.delete()
-                except GithubException as e:
-                    LOG.warning('Failed to delete previous comment: repo=%s/%s, pr_id=%s, comment_id=%s, error=%s',
-                                self._github_owner, self._github_repo, build.get_pr_id(), comment.id, str(e))
-
-    def _get_repo(self):
-        if not hasattr(self, '_repo'):
-            gh_client = self._get_client()
-            self._repo = gh_client.get_user(self._github_owner).get_repo(self._github_repo)
-        return self._repo
+    def _publish_sticky_comment(self, build, pr_comment):
+        """Update the app's comment on the PR, creating it if there is none yet.
+
+        The comment ID is remembered in a state document in the build logs bucket, so the PR's comments only need to be
+        searched for the app's comment the first time. The document is only changed with conditional writes, so
+        concurrent builds agree on one comment, see _store_sticky_comment_id().
+        """
+        state_key = 'pr/{}/sticky-comment.json'.format(build.get_pr_id())
+        state, etag = bucketstate.get_with_etag(state_key)
+        comment_id = state['comment_id'] if state else self._find_previous_comment_id(build)
+
+        if comment_id:
+            try:
+                LOG.debug('Updating PR Comment: pr_id=%s, comment_id=%s, comment=%s',
+                          build.get_pr_id(), comment_id, pr_comment)
+                self._request(build, 'PATCH', '/issues/comments/{}'.format(comment_id), input={'body': pr_comment})
+                if state:
+                    return comment_id
+                return self._store_sticky_comment_id(build, state_key, None, comment_id, pr_comment, created=False)
+            except UnknownObjectException:
+                LOG.info('Sticky PR comment no longer exists, creating a new one: pr_id=%s, comment_id=%s',
+                         build.get_pr_id(), comment_id)
+
+        LOG.debug('Publishing PR Comment: pr_id=%s, comment=%s', build.get_pr_id(), pr_comment)
+        _, comment = self._request(build, 'POST', '/issues/{}/comments'.format(build.get_pr_id()),
+                                   input={'body': pr_comment})
+        return self._store_sticky_comment_id(build, state_key, etag, comment['id'], pr_comment, created=True)
+
+    def _store_sticky_comment_id(self, build, state_key, etag, comment_id, pr_comment, created):
+        """Remember comment_id as the PR's sticky comment, unless a concurrent build stored another one first.
+
+        The state document is only replaced if it still has the given ETag, or created if etag is None. If a concurrent
+        build stored its comment first, that comment is updated instead, and a comment this build created is deleted,
+        since it would otherwise never be updated again. Returns the ID of the PR's sticky comment.
+        """
+        try:
+            bucketstate.put(state_key, {'comment_id': comment_id}, if_match=etag, if_none_match=etag is None)
+            return comment_id
+        except bucketstate.ConflictError:
+            winner_id = bucketstate.get(state_key)['comment_id']
+        if winner_id == comment_id:
+            return comment_id
+
+        if created:
+            LOG.debug('Deleting duplicate sticky comment: pr_id=%s, comment_id=%s', build.get_pr_id(), comment_id)
+            self._request(build, 'DELETE', '/issues/comments/{}'.format(comment_id))
+        LOG.debug('Updating PR Comment: pr_id=%s, comment_id=%s, comment=%s', build.get_pr_id(), winner_id, pr_comment)
+        self._request(build, 'PATCH', '/issues/comments/{}'.format(winner_id), input={'body': pr_comment})
+        return winner_id
+
+    def _publish_live_comment(self, build, pr_comment):
+        """Publish the comment of a build with live logs, so the build only ever has a single comment.
+
+        The ID of the comment published while the build is running is remembered in a state document in the build logs
+        bucket. Once the build is finished, that comment is updated with its result, unless it no longer exists.
+        """
+        if build.status != IN_PROGRESS:
+            comment_id = self._get_live_comment_id(build)
+            if comment_id:
+                try:
+                    LOG.debug('Updating PR Comment: pr_id=%s, comment_id=%s, comment=%s',
+                              build.get_pr_id(), comment_id, pr_comment)
+                    self._request(build, 'PATCH', '/issues/comments/{}'.format(comment_id), input={'body': pr_comment})
+                    return comment_id
+                except UnknownObjectException:
+                    LOG.info('Live logs PR comment no longer exists, creating a new one: pr_id=%s, comment_id=%s',
+                             build.get_pr_id(), comment_id)
+
+        LOG.debug('Publishing PR Comment: pr_id=%s, comment=%s', build.get_pr_id(), pr_comment)
+        _, comment = self._request(build, 'POST', '/issues/{}/comments'.format(build.get_pr_id()),
+                                   input={'body': pr_comment})
+        if build.status == IN_PROGRESS:
+            bucketstate.put(_get_live_comment_key(build), {'comment_id': comment['id']})
+        return comment['id']
+
+    def _get_live_comment_id(self, build):
+        state = bucketstate.get(_get_live_comment_key(build)) if config.LIVE_LOGS else None
+        return state['comment_id'] if state else None
+
+    def _publish_aggregated_comment(self, build):
+        """Record the build's result in the PR's aggregated state document and render it as a single comment.
+
+        The state document is keyed by PR and commit and can be shared by several deployments of this app through
+        AGGREGATED_COMMENT_BUCKET_NAME. It is only changed with conditional writes, so concurrent builds never lose each
+        other's rows and agree on one comment.
+        """
+        state_key = 'pr/{}/{}/aggregated-comment.json'.format(build.get_pr_id(), build.commit_id)
+        bucket_name = config.AGGREGATED_COMMENT_BUCKET_NAME
+
+        def add_build(state):
+            state = state or {'commit_id': build.commit_id, 'builds': {}}
+            state['builds'][config.PROJECT_NAME] = {
+                'build_status': build.status,
+                'first_failure': _format_first_failure(build),
+                'logs_url': build.get_logs_url(),
+                'expiration_in_days': config.EXPIRATION_IN_DAYS,
+            }
+            return state
+
+        state, etag = bucketstate.update(state_key, add_build, bucket_name)
+
+        comment_id = state.get('comment_id')
+        if not comment_id:
+            _, comment = self._request(build, 'POST', '/issues/{}/comments'.format(build.get_pr_id()),
+                                       input={'body': _render_aggregated_comment(state)})
+
+            def set_comment_id(state):
+                state.setdefault('comment_id', comment['id'])
+                return state
+
+            state, etag = bucketstate.update(state_key, set_comment_id, bucket_name)
+            comment_id = state['comment_id']
+            if comment_id == comment['id']:
+                return comment_id
+
+            # a concurrent build created the comment first, so update that one instead
+            LOG.debug('Deleting duplicate aggregated comment: pr_id=%s, comment_id=%s',
+                      build.get_pr_id(), comment['id'])
+            self._request(build, 'DELETE', '/issues/comments/{}'.format(comment['id']))
+
+        # re-render until the state didn't change while updating the comment, so the last build to finish always leaves
+        # a complete comment behind
+        for _ in range(MAX_AGGREGATED_COMMENT_RENDERS):
+            self._request(build, 'PATCH', '/issues/comments/{}'.format(comment_id),
+                          input={'body': _render_aggregated_comment(state)})
+            latest_state, latest_etag = bucketstate.get_with_etag(state_key, bucket_name)
+            if latest_etag == etag:
+                break
+            state, etag = latest_state, latest_etag
+        return comment_id
+
+    def _find_previous_comment_id(self, build):
+        """Return the ID of the most recent comment the app posted on the PR, or None if there is none."""
+        comment_ids = [comment['id'] for comment in self._iter_pr_comments(build) if HIDDEN_COMMENT in comment['body']]
+        return comment_ids[-1] if comment_ids else None
+
+    def delete_previous_comments(self, build, before_comment_id=None):
+        """Delete previous PR comments.
+
+        If before_comment_id is given, only comments older than that comment are deleted. Comment IDs increase over
+        time, so this keeps the given comment and those published after it.
+        """
+        # collect comments before deleting any, since deleting shifts the following comments to earlier pages
+        comment_ids = [comment['id'] for comment in self._iter_pr_comments(build)
+                       if HIDDEN_COMMENT in comment['body']]  # Check for hidden comment in body
+        if before_comment_id is not None:
+            comment_ids = [comment_id for comment_id in comment_ids if comment_id < before_comment_id]
+        # the comment published while the build was running is updated with its result instead
+        live_comment_id = self._get_live_comment_id(build)
+        comment_ids = [comment_id for comment_id in comment_ids if comment_id != live_comment_id]
+        if not comment_ids:
+            return
+
+        # comments are independent of each other, so they're deleted concurrently
+        with ThreadPoolExecutor(max_workers=min(len(comment_ids), config.GITHUB_MAX_CONCURRENT_REQUESTS)) as executor:
+            futures = [executor.submit(self._delete_comment, build, comment_id) for comment_id in comment_ids]
+        # re-raise errors of the deletions, e.g., so that they're deferred once the rate limit is exceeded
+        for future in futures:
+            future.result()
+
+    def _delete_comment(self, build, comment_id):
+        try:  # Not critical, catch all GitHub exceptions here
+            LOG.debug('Deleting previous comment: repo=%s/%s, pr_id=%s, comment_id=%s',
+                      self._github_owner, self._github_repo, build.get_pr_id(), comment_id)
+            self._request(build, 'DELETE', '/issues/comments/{}'.format(comment_id))
+        except RateLimitExceededException:
+            raise
+        except GithubException as e:
+            LOG.warning('Failed to delete previous comment: repo=%s/%s, pr_id=%s, comment_id=%s, error=%s',
+                        self._github_owner, self._github_repo, build.get_pr_id(), comment_id, str(e))
+
+    def _iter_pr_comments(self, build):
+        for page in itertools.count(1):
+            _, comments = self._request(build, 'GET', '/issues/{}/comments'.format(build.get_pr_id()),
+                                        parameters={'per_page': COMMENTS_PER_PAGE, 'page': page})
+            yield from comments
+            if len(comments) < COMMENTS_PER_PAGE:
+                return
+
+    def _request(self, build, verb, repo_path, **kwargs):
+        """Send a REST request for a path relative to the GitHub repo, e.g., /issues/1/comments.
+
+        Returns a (headers, data) tuple. If GitHub rejects the cached token, e.g., because it was rotated, the cache is
+        invalidated and the request is retried once with freshly loaded GitHub info.
+        """
+        try:
+            return self._send(build, verb, repo_path, **kwargs)
+        except BadCredentialsException:
+            LOG.info('GitHub rejected cached credentials, reloading GitHub info')
+            self._cache.invalidate()
+            return self._send(build, verb, repo_path, **kwargs)
+
+    def _send(self, build, verb, repo_path, **kwargs):
+        # GithubRetry would wait for the budget to reset, which can take longer than the Lambda function may run
+        if self._rate_limit.get_remaining() == 0:
+            raise RateLimitExceededException(403, {'message': 'GitHub rate limit budget is exhausted'}, None)
+
+        client = self._get_client()
+        with self._request_counts_lock:
+            self._request_counts[build.id] += 1
+        url = '/repos/{}/{}{}'.format(self._github_owner, self._github_repo, repo_path)
+        LOG.debug('GitHub request: %s %s', verb, url)
+        try:
+            headers, data = client.requester.requestJsonAndCheck(verb, url, **kwargs)
+        except GithubException as e:
+            self._rate_limit.record(e.headers)
+            raise
+        self._rate_limit.record(headers)
+        return headers, data
 
     def _get_client(self):
-        if not hasattr(self, '_client'):
-            self._init_client()
-        return self._client
+        return self._cache.get_or_load('client', self._load_client)
 
-    def _init_client(self):
+    def _load_client(self):
         self._init_github_info()
-        self._client = Github(self._github_token)
+        return Github(
+            self._github_token,
+            base_url=config.GITHUB_API_URL,
+            pool_size=config.GITHUB_MAX_CONCURRENT_REQUESTS,
+            retry=FailFastRetry(total=MAX_RETRIES, status_forcelist=RETRY_STATUS_CODES, allowed_methods=RETRY_METHODS),
+            # concurrency is bounded by GITHUB_MAX_CONCURRENT_REQUESTS and rate limits are handled by retries instead
+            seconds_between_requests=None,
+            seconds_between_writes=None,
+        )
 
     def _init_github_info(self):
         response = CODEBUILD.batch_get_projects(
@@ -119,3 +458,34 @@ class GithubProxy:
 
         self._github_owner = matches.group(1)
         self._github_repo = matches.group(2)
+
+
+def _get_live_comment_key(build):
+    return 'builds/{}/live-comment.json'.format(quote(build.id, safe=''))
+
+
+def _render_pr_comment(build):
+    return PR_COMMENT_TEMPLATE.format(
+        project_name=config.PROJECT_NAME,
+        commit_id=build.commit_id,
+        build_status=build.status,
+        first_failure=_format_first_failure(build),
+        logs_url=build.get_logs_url(),
+    )
+
+
+def _format_first_failure(build):
+    # without the copied logs, there is no first failure to link to either
+    if build.logs_copy_failed:
+        return ' (copying the build logs failed)'
+    # successful builds often log harmless errors, so only failed builds link to their first failure
+    if build.status == 'SUCCEEDED' or not build.first_failure:
+        return ''
+    return ' ([first failure at line {}]({}))'.format(build.first_failure['line'], build.get_first_failure_url())
+
+
+def _render_aggregated_comment(state):
+    # results recorded by older versions of the app have no first_failure
+    rows = [AGGREGATED_PR_COMMENT_ROW_TEMPLATE.format(project_name=project_name, **{'first_failure': '', **result})
+            for project_name, result in sorted(state['builds'].items())]
+    return AGGREGATED_PR_COMMENT_TEMPLATE.format(commit_id=state['commit_id'], rows='\n'.join(rows))
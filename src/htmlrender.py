@@ -0,0 +1,285 @@
+"""Paginated HTML rendition of a build log, rendered while the log is streamed."""
+
+import codecs
+import html
+import json
+import re
+from urllib.parse import quote_plus, urlencode
+
+import config
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+# number of characters of the log rendered on each page
+PAGE_SIZE = 1024 * 1024
+
+INDEX_PAGE = 'index.html'
+
+# ANSI escape sequences; only SGR sequences (ending with m) change the text style, all others are dropped
+ANSI_ESCAPE_REGEX = re.compile(r'\x1b\[([0-9;?]*)([A-Za-z])')
+PHASE_START_REGEX = re.compile(r'^\[Container\] .*Entering phase (\w+)')
+PHASE_END_REGEX = re.compile(r'^\[Container\] .*Phase complete: (\w+) State: (\w+)')
+
+STYLE = """
+body { margin: 0; background: #1e1e1e; color: #d4d4d4; font-family: sans-serif; }
+nav { padding: 8px 16px; background: #333; }
+nav a { color: #9cdcfe; margin-right: 16px; }
+main { padding: 8px 16px; }
+main a { color: #9cdcfe; }
+pre { margin: 0; padding: 8px 16px; font-size: 13px; white-space: pre-wrap; word-break: break-all; }
+a.ln { display: inline-block; width: 7ch; margin-right: 1ch; color: #858585; text-align: right; text-decoration: none; }
+.ansi-1 { font-weight: bold; } .ansi-3 { font-style: italic; } .ansi-4 { text-decoration: underline; }
+.ansi-30 { color: #000; } .ansi-31 { color: #cd3131; } .ansi-32 { color: #0dbc79; } .ansi-33 { color: #e5e510; }
+.ansi-34 { color: #2472c8; } .ansi-35 { color: #bc3fbc; } .ansi-36 { color: #11a8cd; } .ansi-37 { color: #e5e5e5; }
+.ansi-90 { color: #666; } .ansi-91 { color: #f14c4c; } .ansi-92 { color: #23d18b; } .ansi-93 { color: #f5f543; }
+.ansi-94 { color: #3b8eea; } .ansi-95 { color: #d670d6; } .ansi-96 { color: #29b8db; } .ansi-97 { color: #fff; }
+.ansi-40 { background: #000; } .ansi-41 { background: #cd3131; } .ansi-42 { background: #0dbc79; }
+.ansi-43 { background: #e5e510; } .ansi-44 { background: #2472c8; } .ansi-45 { background: #bc3fbc; }
+.ansi-46 { background: #11a8cd; } .ansi-47 { background: #e5e5e5; } .ansi-100 { background: #666; }
+.ansi-101 { background: #f14c4c; } .ansi-102 { background: #23d18b; } .ansi-103 { background: #f5f543; }
+.ansi-104 { background: #3b8eea; } .ansi-105 { background: #d670d6; } .ansi-106 { background: #29b8db; }
+.ansi-107 { background: #fff; }
+"""
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{style}</style>
+</head>
+<body>
+<nav>{nav}</nav>
+{content}
+<nav>{nav}</nav>
+</body>
+</html>
+"""
+
+
+# loads the chunks of a deduplicated log one after the other and appends them to the page, see render_chunk_viewer()
+CHUNK_VIEWER_SCRIPT = """
+(async () => {
+  const log = document.getElementById('log');
+  for (const url of URLS) {
+    const response = await fetch(url);
+    if (!response.ok) {
+      log.append('\\n[Failed to load the rest of the build log: HTTP ' + response.status + ']\\n');
+      return;
+    }
+    log.append(await response.text());
+  }
+})();
+"""
+
+CHUNK_VIEWER_TAIL_LINES = 1000
+
+
+def get_index_key(log_key):
+    """Return the key of the table of contents page of the HTML rendition of the log stored under log_key."""
+    return '{}/html/{}'.format(log_key.rsplit('/', 1)[0], INDEX_PAGE)
+
+
+class HtmlRenderer:
+    """Render a build log as HTML pages of PAGE_SIZE characters each, plus a table of contents page.
+
+    The log is rendered line by line as it is streamed, and each page is stored as soon as it is complete, so only one
+    page is kept in memory. ANSI color codes are converted to CSS classes, and each line gets an anchor, e.g., #L42,
+    so the table of contents can link to the start of each CodeBuild phase. Pages link to each other through the build
+    logs API endpoint, since the presigned URLs they are served from expire.
+    """
+
+    def __init__(self, bucket, log_key, title):
+        """Create renderer storing the rendition of the log stored under log_key in the given bucket."""
+        self._bucket = bucket
+        self._log_key = log_key
+        self._title = title
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._ansi = _AnsiConverter()
+        self._partial_line = ''
+        self._line = 1
+        self._in_line = False
+        self._page = []
+        self._page_number = 1
+        self._page_size = 0
+        self._page_first_lines = [1]
+        self._phases = []
+
+    def tap(self, byte_iter):
+        """Render an iterable of byte strings while passing it through unchanged."""
+        for data in byte_iter:
+            self.feed(data)
+            yield data
+        self.finish()
+
+    def feed(self, data):
+        """Render the next chunk of the log."""
+        lines = (self._partial_line + self._decoder.decode(data)).split('\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            self._render(line + '\n', line_end=True)
+
+        # don't let a very long line grow beyond the page size, render it in pieces instead
+        if len(self._partial_line) >= PAGE_SIZE:
+            self._render(self._partial_line, line_end=False)
+            self._partial_line = ''
+
+    def finish(self):
+        """Render the rest of the log and store the last page and the table of contents page."""
+        self._partial_line += self._decoder.decode(b'', final=True)
+        if self._partial_line:
+            self._render(self._partial_line, line_end=True)
+            self._partial_line = ''
+        self._store_page(is_last=True)
+        self._store_index()
+
+    def _render(self, text, line_end):
+        if self._page_size >= PAGE_SIZE:
+            self._store_page(is_last=False)
+            self._page_first_lines.append(self._line)
+
+        if not self._in_line:
+            self._in_line = True
+            self._page.append('<a id="L{0}" href="#L{0}" class="ln">{0}</a>'.format(self._line))
+            self._record_phase(text)
+
+        self._page.append(self._ansi.convert(text))
+        self._page_size += len(text)
+        if line_end:
+            self._in_line = False
+            self._line += 1
+
+    def _record_phase(self, line):
+        phase_start = PHASE_START_REGEX.match(line)
+        if phase_start:
+            self._phases.append({'name': phase_start.group(1), 'page': self._page_number, 'line': self._line})
+        phase_end = PHASE_END_REGEX.match(line)
+        if phase_end and self._phases and self._phases[-1]['name'] == phase_end.group(1):
+            self._phases[-1]['state'] = phase_end.group(2)
+
+    def _store_page(self, is_last):
+        nav = [_link(get_index_key(self._log_key), 'Contents')]
+        if self._page_number > 1:
+            nav.append(_link(self._get_page_key(self._page_number - 1), 'Previous page'))
+        if not is_last:
+            nav.append(_link(self._get_page_key(self._page_number + 1), 'Next page'))
+        nav.append(_link(self._log_key, 'Raw log', raw=True))
+
+        content = '<pre>{}{}</pre>'.format(''.join(self._page), self._ansi.close())
+        self._put(self._get_page_key(self._page_number), '{} - page {}'.format(self._title, self._page_number),
+                  nav, content)
+        # the style at the end of a page carries over to the next one
+        self._page = [self._ansi.reopen()]
+        self._page_size = 0
+        if not is_last:
+            self._page_number += 1
+
+    def _store_index(self):
+        phases = ['<li>{}{}</li>'.format(
+            _link(self._get_page_key(phase['page']), phase['name'], fragment='L{}'.format(phase['line'])),
+            ' ({})'.format(html.escape(phase['state'])) if 'state' in phase else ''
+        ) for phase in self._phases]
+        pages = ['<li>{}</li>'.format(_link(self._get_page_key(page_number), 'Page {} (from line {})'.format(
+            page_number, first_line))) for page_number, first_line in enumerate(self._page_first_lines, start=1)]
+
+        content = '<main>'
+        if phases:
+            content += '<h2>Phases</h2><ul>{}</ul>'.format(''.join(phases))
+        content += '<h2>Pages</h2><ul>{}</ul></main>'.format(''.join(pages))
+        self._put(get_index_key(self._log_key), self._title, [_link(self._log_key, 'Raw log', raw=True)], content)
+
+    def _get_page_key(self, page_number):
+        return '{}/html/page-{}.html'.format(self._log_key.rsplit('/', 1)[0], page_number)
+
+    def _put(self, key, title, nav, content):
+        LOG.debug('Storing HTML page: key=%s', key)
+        body = PAGE_TEMPLATE.format(title=html.escape(title), style=STYLE, nav=''.join(nav), content=content)
+        self._bucket.meta.client.put_object(Bucket=self._bucket.name, Key=key, Body=body.encode('utf-8'),
+                                            ContentType='text/html; charset=utf-8')
+
+
+class _AnsiConverter:
+    """Convert ANSI SGR sequences to spans with ansi-<code> CSS classes, keeping the style across calls."""
+
+    def __init__(self):
+        self._styles = set()
+        self._foreground = None
+        self._background = None
+        self._open = False
+
+    def convert(self, text):
+        parts = []
+        position = 0
+        for match in ANSI_ESCAPE_REGEX.finditer(text):
+            parts.append(html.escape(text[position:match.start()], quote=False))
+            position = match.end()
+            if match.group(2) == 'm':
+                parts.append(self.close())
+                self._apply(match.group(1))
+                parts.append(self.reopen())
+        parts.append(html.escape(text[position:], quote=False))
+        return ''.join(parts)
+
+    def reopen(self):
+        """Open a span for the current style, if there is any."""
+        classes = sorted(self._styles) + [code for code in (self._foreground, self._background) if code]
+        self._open = bool(classes)
+        return '<span class="{}">'.format(' '.join('ansi-{}'.format(code) for code in classes)) if classes else ''
+
+    def close(self):
+        """Close the span for the current style, if one is open."""
+        closing_tag = '</span>' if self._open else ''
+        self._open = False
+        return closing_tag
+
+    def _apply(self, parameters):
+        codes = [int(code) if code.isdigit() else 0 for code in parameters.split(';')]
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self._styles.clear()
+                self._foreground = self._background = None
+            elif code in (1, 3, 4):
+                self._styles.add(code)
+            elif code in (22, 23, 24):
+                self._styles.discard(code - 21)
+            elif 30 <= code <= 37 or 90 <= code <= 97:
+                self._foreground = code
+            elif code == 39:
+                self._foreground = None
+            elif 40 <= code <= 47 or 100 <= code <= 107:
+                self._background = code
+            elif code == 49:
+                self._background = None
+            elif code in (38, 48):
+                # 256 color and true color codes aren't supported, skip their arguments
+                i += {5: 2, 2: 4}.get(codes[i + 1] if i + 1 < len(codes) else None, 0)
+            i += 1
+
+
+def render_chunk_viewer(log_key, title, chunk_urls):
+    """Return an HTML page showing a log stored as chunks, see dedup, that is too large to be returned at once.
+
+    The page loads the chunks from the given presigned URLs in the browser, which requires the bucket to allow
+    cross-origin GET requests. Without JavaScript, the page links to each chunk instead.
+    """
+    nav = '<a href="?{}">Last {} lines</a>'.format(
+        html.escape(urlencode({'key': log_key, 'tail': CHUNK_VIEWER_TAIL_LINES})), CHUNK_VIEWER_TAIL_LINES)
+    parts = ''.join('<li><a href="{}">Part {}</a></li>'.format(html.escape(url), number)
+                    for number, url in enumerate(chunk_urls, start=1))
+    # </script> can't appear in JSON strings inside a script element
+    urls = json.dumps(chunk_urls).replace('</', '<\\/')
+    content = '<pre id="log"></pre><noscript><main><ul>{}</ul></main></noscript>'.format(parts)
+    content += '<script>const URLS = {};{}</script>'.format(urls, CHUNK_VIEWER_SCRIPT)
+    return PAGE_TEMPLATE.format(title=html.escape(title), style=STYLE, nav=nav, content=content)
+
+
+def _link(key, text, raw=False, fragment=None):
+    url = '{}?key={}'.format(config.BUILD_LOGS_API_ENDPOINT, quote_plus(key))
+    if raw:
+        url += '&raw=true'
+    if fragment:
+        url += '#' + fragment
+    return '<a href="{}">{}</a>'.format(html.escape(url), html.escape(text))
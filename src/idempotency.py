@@ -0,0 +1,80 @@
+"""Detection of duplicate build events.
+
+EventBridge delivers events at least once, so the same build event can be processed more than once. Before doing any
+work for a build event, a marker for the build and its status is created in the build logs bucket with a conditional
+write, which only succeeds for the first delivery of the event.
+
+The marker records when the invocation that claimed the event is stopped at the latest. An invocation that crashes,
+runs out of memory or times out leaves its marker behind, and retries of the event take it over once that deadline has
+passed, instead of skipping the event as a duplicate.
+"""
+
+import time
+from urllib.parse import quote
+
+import bucketstate
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+# Lambda functions run for at most 15 minutes, which is the deadline of invocations whose Lambda context isn't known
+PROCESSING_TIMEOUT_SECONDS = 15 * 60
+
+
+def get_deadline(context):
+    """Return the time, in seconds since the epoch, by which the invocation with the given Lambda context is stopped."""
+    if context is None:
+        return time.time() + PROCESSING_TIMEOUT_SECONDS
+    return time.time() + context.get_remaining_time_in_millis() / 1000
+
+
+def claim(build, deadline):
+    """Return True if the build's event should be processed, or False if it is a duplicate.
+
+    An event is a duplicate if it was already processed, or if another invocation is processing it right now, i.e., its
+    claim hasn't expired yet. A claim expires at the deadline of the invocation that made it, see get_deadline().
+    """
+    key = _get_marker_key(build)
+    try:
+        bucketstate.put(key, _processing(deadline), if_none_match=True)
+        return True
+    except bucketstate.ConflictError:
+        pass
+
+    marker, etag = bucketstate.get_with_etag(key)
+    if marker is None:
+        # the marker was released by a failed invocation in the meantime
+        return _take_over(key, None, deadline)
+    # markers written before claims recorded their expiry only have the time they were claimed at
+    expires_at = marker.get('expires_at', marker.get('claimed_at', 0) + PROCESSING_TIMEOUT_SECONDS)
+    if marker['state'] == 'processing' and time.time() >= expires_at:
+        LOG.info('Taking over build event left behind by a failed invocation: build_id=%s, status=%s',
+                 build.id, build.status)
+        return _take_over(key, etag, deadline)
+    return False
+
+
+def complete(build):
+    """Mark the build's event as processed."""
+    bucketstate.put(_get_marker_key(build), {'state': 'done', 'completed_at': time.time()})
+
+
+def release(build):
+    """Remove the claim on the build's event after processing it failed, so it can be retried."""
+    bucketstate.delete(_get_marker_key(build))
+
+
+def _processing(deadline):
+    return {'state': 'processing', 'claimed_at': time.time(), 'expires_at': deadline}
+
+
+def _take_over(key, etag, deadline):
+    try:
+        bucketstate.put(key, _processing(deadline), if_match=etag, if_none_match=etag is None)
+        return True
+    except bucketstate.ConflictError:
+        return False
+
+
+def _get_marker_key(build):
+    return 'events/{}/{}.json'.format(quote(build.id, safe=''), build.status)
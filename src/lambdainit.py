@@ -3,13 +3,20 @@
 This file must be imported as the first import in any file containing a Lambda function handler method.
 """
 
+import os
 import sys
 
 # add packaged dependencies to search path
 sys.path.append('lib')
 
-# imports of library dependencies must come after setting up the dependency search path
-from aws_xray_sdk.core import patch_all  # noqa: E402
+# Comma-separated names of the libraries to patch for X-Ray tracing, e.g., botocore. All supported libraries are patched
+# if it's not set, and none if it's empty, which keeps cold starts of functions that need little tracing short.
+XRAY_PATCH_MODULES = os.getenv('XRAY_PATCH_MODULES')
 
-# patch all supported libraries for X-Ray tracing
-patch_all()
+# imports of library dependencies must come after setting up the dependency search path
+if XRAY_PATCH_MODULES is None:
+    from aws_xray_sdk.core import patch_all
+    patch_all()
+elif XRAY_PATCH_MODULES.strip():
+    from aws_xray_sdk.core import patch
+    patch([module.strip() for module in XRAY_PATCH_MODULES.split(',') if module.strip()])
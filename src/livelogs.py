@@ -0,0 +1,164 @@
+"""Publish build logs while the build is still running.
+
+While a build runs, each of its build events appends the log data logged since the previous one, see append(). S3
+objects can't be appended to, so the log copied so far is kept as numbered segment objects of SEGMENT_SIZE bytes plus a
+pending object with the rest. A checkpoint state document records them along with the CloudWatch Logs forward token to
+resume reading from and the state of the error indexer. Segments are at least as large as the minimum multipart upload
+part size, so logs are assembled from them with server-side copies instead of uploading them again.
+
+The log copied so far is published under the live log key, see get_live_key(). Once the build is finished, finish()
+only reads the log data logged since the last checkpoint and assembles the complete log under the regular log key.
+"""
+
+import uuid
+from urllib.parse import quote
+
+import botocore
+
+import bucketstate
+import errorindex
+import lambdalogging
+import s3upload
+
+LOG = lambdalogging.getLogger(__name__)
+
+# segments must be at least 5 MiB, the minimum size of all but the last part of a multipart upload
+SEGMENT_SIZE = s3upload.PART_SIZE
+
+LIVE_LOG_NAME = 'live.log'
+
+# DeleteObjects deletes at most 1000 objects per call
+MAX_DELETE_OBJECTS = 1000
+
+
+def get_live_key(log_key):
+    """Return the key the log stored under log_key is published under while the build is still running."""
+    return '{}/{}'.format(log_key.rsplit('/', 1)[0], LIVE_LOG_NAME)
+
+
+def append(bucket, build_id, log_key, read_log, patterns=None):
+    """Append the log data logged since the last checkpoint and publish the log copied so far under the live log key.
+
+    read_log is called with the forward token to resume reading from, or None to read from the start of the log, and
+    returns an iterable of (data, next_token) tuples. Returns False without appending anything if the log was already
+    finished or another invocation appended to it concurrently, in which case a later build event picks up the data.
+    """
+    checkpoint_key = _get_checkpoint_key(build_id)
+    checkpoint, etag = bucketstate.get_with_etag(checkpoint_key)
+    if checkpoint and checkpoint['finished']:
+        LOG.debug('Not appending to live log of finished build: build_id=%s', build_id)
+        return False
+
+    checkpoint = checkpoint or _new_checkpoint()
+    indexer = errorindex.ErrorIndexer.from_state(checkpoint['index'], patterns)
+    new_pending_key = None
+    try:
+        new_checkpoint, rest = _read(bucket, log_key, checkpoint, read_log, indexer)
+        if rest:
+            new_pending_key = '{}/live/pending-{}'.format(log_key.rsplit('/', 1)[0], uuid.uuid4().hex)
+            bucket.meta.client.put_object(Bucket=bucket.name, Key=new_pending_key, Body=rest)
+            new_checkpoint['pending'] = new_pending_key
+        bucketstate.put(checkpoint_key, new_checkpoint, if_match=etag, if_none_match=etag is None)
+    except bucketstate.ConflictError:
+        LOG.info('Live log was appended to concurrently: build_id=%s', build_id)
+        _delete(bucket, [new_pending_key] if new_pending_key else [])
+        return False
+
+    if checkpoint['pending']:
+        _delete(bucket, [checkpoint['pending']])
+    s3upload.upload_composed(bucket, get_live_key(log_key), _get_segment_keys(log_key, new_checkpoint['segments']),
+                             rest, ContentType='text/plain')
+    LOG.debug('Appended to live log: build_id=%s, checkpoint=%s', build_id, new_checkpoint)
+    return True
+
+
+def finish(bucket, build_id, log_key, read_log, patterns=None, **object_args):
+    """Append the log data logged since the last checkpoint and store the complete log under log_key.
+
+    read_log is the same as for append(). object_args are passed on to S3, e.g., ContentType. Returns the ErrorIndexer
+    of the complete log. Once the log is finished, the objects it was assembled from are deleted.
+    """
+    checkpoint_key = _get_checkpoint_key(build_id)
+    for attempt in range(1, bucketstate.MAX_UPDATE_ATTEMPTS + 1):
+        checkpoint, etag = bucketstate.get_with_etag(checkpoint_key)
+        indexer = errorindex.ErrorIndexer.from_state(checkpoint and checkpoint['index'], patterns)
+        if checkpoint and checkpoint['finished']:
+            LOG.debug('Live log was already finished: build_id=%s', build_id)
+            return indexer
+
+        checkpoint = checkpoint or _new_checkpoint()
+        try:
+            new_checkpoint, rest = _read(bucket, log_key, checkpoint, read_log, indexer)
+            indexer.finish()
+            segment_keys = _get_segment_keys(log_key, new_checkpoint['segments'])
+            s3upload.upload_composed(bucket, log_key, segment_keys, rest, **object_args)
+            new_checkpoint.update(index=indexer.get_state(), finished=True)
+            bucketstate.put(checkpoint_key, new_checkpoint, if_match=etag, if_none_match=etag is None)
+        except bucketstate.ConflictError:
+            # the log stored under log_key is overwritten with the complete one on the next attempt
+            LOG.debug('Live log was appended to concurrently, retrying: build_id=%s, attempt=%d', build_id, attempt)
+            continue
+
+        LOG.debug('Finished live log: build_id=%s, checkpoint=%s', build_id, new_checkpoint)
+        _delete(bucket, segment_keys + [key for key in (checkpoint['pending'], get_live_key(log_key)) if key])
+        return indexer
+    raise bucketstate.ConflictError('Could not finish live log of build {} after {} attempts'.format(
+        build_id, bucketstate.MAX_UPDATE_ATTEMPTS))
+
+
+def _new_checkpoint():
+    return {'token': None, 'segments': 0, 'pending': None, 'index': None, 'finished': False}
+
+
+def _read(bucket, log_key, checkpoint, read_log, indexer):
+    """Store the log data logged since the checkpoint in new segments and return the new checkpoint and the rest."""
+    buffer = bytearray()
+    if checkpoint['pending']:
+        try:
+            buffer += bucket.meta.client.get_object(Bucket=bucket.name, Key=checkpoint['pending'])['Body'].read()
+        except botocore.exceptions.ClientError as e:
+            # the invocation that replaced the checkpoint deletes the pending object it references
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                raise bucketstate.ConflictError('Pending object {} was replaced'.format(checkpoint['pending'])) from e
+            raise
+
+    segments = checkpoint['segments']
+    token = checkpoint['token']
+    for data, token in read_log(checkpoint['token']):
+        indexer.scan(data)
+        buffer += data
+        while len(buffer) >= SEGMENT_SIZE:
+            # a segment always holds the same bytes of the log, so concurrent invocations can safely overwrite it
+            bucket.meta.client.put_object(Bucket=bucket.name, Key=_get_segment_key(log_key, segments + 1),
+                                          Body=bytes(buffer[:SEGMENT_SIZE]))
+            del buffer[:SEGMENT_SIZE]
+            segments += 1
+
+    new_checkpoint = {
+        'token': token,
+        'segments': segments,
+        'pending': None,
+        'index': indexer.get_state(),
+        'finished': False,
+    }
+    return new_checkpoint, bytes(buffer)
+
+
+def _get_segment_keys(log_key, segments):
+    return [_get_segment_key(log_key, number) for number in range(1, segments + 1)]
+
+
+def _get_segment_key(log_key, number):
+    return '{}/live/segment-{}'.format(log_key.rsplit('/', 1)[0], number)
+
+
+def _get_checkpoint_key(build_id):
+    return 'live/{}.json'.format(quote(build_id, safe=''))
+
+
+def _delete(bucket, keys):
+    for i in range(0, len(keys), MAX_DELETE_OBJECTS):
+        bucket.meta.client.delete_objects(Bucket=bucket.name, Delete={
+            'Objects': [{'Key': key} for key in keys[i:i + MAX_DELETE_OBJECTS]],
+            'Quiet': True,
+        })
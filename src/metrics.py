@@ -0,0 +1,111 @@
+"""Per-invocation metrics emitted as a CloudWatch Embedded Metric Format (EMF) log line.
+
+CloudWatch Logs extracts the metrics from the log line, so no PutMetricData calls are needed, and the line can also be
+queried with CloudWatch Logs Insights. Metrics are collected in a Metrics object for the current invocation, see
+start(). Timers and values recorded once per build, e.g., stage durations, are kept as lists of values, so percentiles
+can be computed across the builds of a batch. Counters are summed over the invocation.
+"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+
+import config
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+NAMESPACE = 'GitHubCodeBuildLogs'
+
+# EMF accepts at most 100 values per metric
+MAX_VALUES_PER_METRIC = 100
+
+# the metrics of the current invocation, see start()
+CURRENT = None
+
+
+class Metrics:
+    """Collect the metrics of one invocation; safe to use from several threads."""
+
+    def __init__(self):
+        """Create empty metrics."""
+        self._values = collections.defaultdict(list)
+        self._counters = collections.Counter()
+        self._units = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit='Count'):
+        """Record a value of a metric, e.g., the number of bytes copied for a build."""
+        with self._lock:
+            self._values[name].append(value)
+            self._units[name] = unit
+
+    def increment(self, name, value=1, unit='Count'):
+        """Add value to a counter that is summed over the invocation."""
+        with self._lock:
+            self._counters[name] += value
+            self._units[name] = unit
+
+    def increment_cache_stats(self, name, stats_before, stats_after):
+        """Add the hits and misses of a cache since stats_before to the <name>Hits and <name>Misses counters.
+
+        Caches outlive invocations in warm containers, so their stats, see ttlcache.TTLCache.stats(), are cumulative.
+        """
+        self.increment(name + 'Hits', stats_after['hits'] - stats_before['hits'])
+        self.increment(name + 'Misses', stats_after['misses'] - stats_before['misses'])
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Record the duration of the with block in milliseconds, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, round((time.perf_counter() - start) * 1000, 3), 'Milliseconds')
+
+    def to_emf(self, timestamp=None):
+        """Return the metrics as an EMF document."""
+        with self._lock:
+            metrics = {name: values[:MAX_VALUES_PER_METRIC] for name, values in self._values.items()}
+            metrics.update(self._counters)
+            units = dict(self._units)
+
+        document = {
+            '_aws': {
+                'Timestamp': int((time.time() if timestamp is None else timestamp) * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['ProjectName']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in sorted(metrics)],
+                }],
+            },
+            'ProjectName': config.PROJECT_NAME,
+        }
+        document.update(metrics)
+        return document
+
+    def emit(self):
+        """Print the metrics as a single EMF log line."""
+        # EMF log lines must be plain JSON, so they're printed instead of going through the log formatter
+        print(json.dumps(self.to_emf(), separators=(',', ':')), flush=True)
+
+
+def start():
+    """Start collecting metrics for a new invocation and return them."""
+    global CURRENT
+    CURRENT = Metrics()
+    return CURRENT
+
+
+def instrument(client):
+    """Count the AWS API calls made with a boto3 client in the AwsCalls counter of the current invocation."""
+    # registered first, since handlers that return a response, e.g., botocore's Stubber, skip the remaining handlers
+    client.meta.events.register_first('before-call.*.*', _count_aws_call)
+    return client
+
+
+def _count_aws_call(**kwargs):
+    if CURRENT is not None:
+        CURRENT.increment('AwsCalls')
@@ -3,38 +3,306 @@
 # must be the first import in files with lambda function handlers
 import lambdainit  # noqa: F401
 
-from build import Build
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+from github import RateLimitExceededException
+
+from build import IN_PROGRESS, Build, load_build_details
 import config
+import deferral
 from github_proxy import GithubProxy
+import idempotency
 import lambdalogging
+import metrics
 
 LOG = lambdalogging.getLogger(__name__)
 
 GITHUB = GithubProxy()
 
+# maximum number of builds from one SQS batch that are processed at the same time
+MAX_CONCURRENT_BUILDS = 10
 
-def handler(build_event, context):
+
+def handler(event, context):
     """Process build events.
 
     If the build event is for the CodeBuild project this app is managing and it's specifically triggered by a PR, copy
     copy the build logs to the app S3 bucket and post a link to the logs as a comment on the GitHub PR.
+
+    The event is either a single build event delivered by EventBridge or a batch of build events delivered through an
+    SQS queue. For SQS batches, the IDs of the messages that failed to process are returned as batchItemFailures so
+    only those are retried.
+
+    If live logs are enabled, events for builds that are still running copy the logs logged so far, and a link to them
+    is posted once per build.
+
+    While the GitHub rate limit budget is low, GitHub work is deferred to the deferred work queue, which delivers it
+    back to this handler as SQS batches, see deferral.
+
+    Stage durations, log sizes and API call counts are emitted as a single CloudWatch Embedded Metric Format line per
+    invocation, see metrics.
     """
-    LOG.debug('Received event: %s', build_event)
+    LOG.debug('Received event: %s', event)
+    invocation_metrics = metrics.start()
+    cache_stats = GITHUB.get_cache_stats()
+    deadline = idempotency.get_deadline(context)
+    try:
+        if 'Records' in event:
+            return _process_batch(event['Records'], deadline)
+
+        _process_build(Build(event), deadline)
+    finally:
+        GITHUB.sync_rate_limit()
+        invocation_metrics.increment_cache_stats('GitHubCache', cache_stats, GITHUB.get_cache_stats())
+        invocation_metrics.emit()
+
+
+def _process_batch(records, deadline):
+    builds = {}
+    deferred_work = {}
+    failed_message_ids = []
+    for record in records:
+        try:
+            message = json.loads(record['body'])
+            if deferral.is_deferred(message):
+                build, tasks, comment_id = deferral.load(message)
+                builds[record['messageId']] = build
+                deferred_work[record['messageId']] = (tasks, comment_id)
+            else:
+                builds[record['messageId']] = Build(message)
+        except (ValueError, KeyError):
+            LOG.exception('Invalid build event: message_id=%s', record['messageId'])
+            failed_message_ids.append(record['messageId'])
+
+    if builds:
+        with metrics.CURRENT.timer('BuildDetails'):
+            load_build_details(list(builds.values()))
+
+        with ThreadPoolExecutor(max_workers=min(len(builds), MAX_CONCURRENT_BUILDS)) as executor:
+            futures = {}
+            for message_id, build in builds.items():
+                if message_id in deferred_work:
+                    futures[message_id] = executor.submit(_process_deferred, build, *deferred_work[message_id])
+                else:
+                    futures[message_id] = executor.submit(_process_build, build, deadline)
+
+        for message_id, future in futures.items():
+            if future.exception():
+                LOG.error('Failed to process build event: message_id=%s, build_id=%s',
+                          message_id, builds[message_id].id, exc_info=future.exception())
+                failed_message_ids.append(message_id)
 
-    build = Build(build_event)
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
 
-    if not build.is_pr_build():
+
+def _process_build(build, deadline):
+    invocation_metrics = metrics.CURRENT
+    invocation_metrics.increment('Builds')
+
+    # unless build details were loaded for a whole batch up front, this includes loading them
+    with invocation_metrics.timer('PrDetection'):
+        is_pr_build = build.is_pr_build()
+    if not is_pr_build:
         LOG.debug('Not a PR build')
         return
 
+    if build.status == IN_PROGRESS:
+        _append_live_logs(build, deadline, invocation_metrics)
+        return
+
+    if not idempotency.claim(build, deadline):
+        LOG.info('Skipping duplicate build event: build_id=%s, status=%s', build.id, build.status)
+        invocation_metrics.increment('DuplicateEvents')
+        return
+
+    try:
+        _copy_logs_and_comment(build, invocation_metrics)
+    except Exception:
+        # let retries of the event process it again
+        idempotency.release(build)
+        raise
+    idempotency.complete(build)
+
+
+def _append_live_logs(build, deadline, invocation_metrics):
+    if not config.LIVE_LOGS:
+        LOG.debug('Ignoring event for running build, live logs are disabled')
+        return
+
+    with invocation_metrics.timer('AppendLiveLogs'):
+        appended = build.append_live_logs()
+
+    if not appended:
+        return
+    # the link is only a head start on the comment of the finished build, so it's skipped rather than deferred, and
+    # left to a later event of the build, while the GitHub rate limit budget is low
+    if GITHUB.is_rate_limit_low():
+        LOG.info('Not publishing live logs link because GitHub rate limit budget is low: build_id=%s', build.id)
+        invocation_metrics.increment('SkippedLiveLogsLinks')
+        return
+    # the link to the logs is the same while the build is running and once it is finished, so it's only posted once
+    if not idempotency.claim(build, deadline):
+        return
+    try:
+        LOG.info('Publishing live logs link for PR build: project=%s, pr_id=%s, build_logs_url=%s',
+                 build.project_name, build.get_pr_id(), build.get_logs_url())
+        with invocation_metrics.timer('PublishComment'):
+            GITHUB.publish_pr_comment(build)
+    except RateLimitExceededException:
+        LOG.warning('Not publishing live logs link because GitHub rate limit exceeded: build_id=%s', build.id,
+                    exc_info=True)
+        invocation_metrics.increment('SkippedLiveLogsLinks')
+        idempotency.release(build)
+        return
+    except Exception:
+        idempotency.release(build)
+        raise
+    finally:
+        invocation_metrics.increment('GitHubRequests', GITHUB.pop_request_count(build))
+    idempotency.complete(build)
+
+
+def _copy_logs_and_comment(build, invocation_metrics):
+    """Copy the build's logs and comment on its PR at the same time.
+
+    The comment only needs the logs URL, which is known up front, so previous comments are deleted and the comment is
+    published while the logs are copied. If the build's first failure is only found once the logs are copied, the
+    comment is updated with a link to it. If copying the logs fails, the comment is rolled back, see
+    GithubProxy.retract_pr_comment(). GitHub work that can't be done while the GitHub rate limit budget is low is
+    deferred, see _run_github_task().
+    """
     LOG.info('Copying build logs for PR build: project=%s, pr_id=%s, build_logs_url=%s',
              build.project_name, build.get_pr_id(), build.get_logs_url())
-    build.copy_logs()
+    try:
+        with invocation_metrics.timer('CopyLogsAndComment'):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                commenting = executor.submit(_comment, build)
+                try:
+                    with invocation_metrics.timer('CopyLogs'):
+                        build.copy_logs()
+                except Exception:
+                    build.logs_copy_failed = True
+                    _retract_comment(build, commenting, invocation_metrics)
+                    raise
+                finally:
+                    invocation_metrics.put('LogBytes', build.log_bytes, 'Bytes')
+                    invocation_metrics.put('LogPages', build.log_pages)
+                    if build.log_bytes_written is not None:
+                        invocation_metrics.put('LogBytesWritten', build.log_bytes_written, 'Bytes')
+                comment_id, deferred_tasks = commenting.result()
 
-    if config.DELETE_PREVIOUS_COMMENTS:
-        GITHUB.delete_previous_comments(build)
+            # successful builds don't link to their first failure, see GithubProxy
+            if comment_id and build.status != 'SUCCEEDED' and build.first_failure:
+                _run_github_task(build, deferral.UPDATE_COMMENT, deferred_tasks, 'UpdateComment',
+                                 GITHUB.update_pr_comment, build, comment_id)
+            if deferred_tasks:
+                _defer(build, deferred_tasks, comment_id, invocation_metrics)
+    finally:
+        github_requests = GITHUB.pop_request_count(build)
+        invocation_metrics.increment('GitHubRequests', github_requests)
+        LOG.info('GitHub requests made for build: build_id=%s, count=%d', build.id, github_requests)
+
+
+def _comment(build):
+    """Delete previous comments if configured and publish the build's comment.
+
+    Returns a (comment ID, deferred tasks) tuple. The comment ID is None if no comment was published.
+    """
+    deferred_tasks = []
+    # a sticky comment is updated in place, so there are no previous comments to delete
+    if config.DELETE_PREVIOUS_COMMENTS and config.COMMENT_MODE == 'new':
+        _run_github_task(build, deferral.DELETE_PREVIOUS_COMMENTS, deferred_tasks, 'DeletePreviousComments',
+                         GITHUB.delete_previous_comments, build)
 
     if build.status == 'SUCCEEDED' and not config.COMMENT_ON_SUCCESS:
-        LOG.debug('Not publishing comment because build SUCCEEDED but COMMENT_ON_SUCCESS is set to false.')
-    else:
-        GITHUB.publish_pr_comment(build)
+        if not config.LIVE_LOGS:
+            LOG.debug('Not publishing comment because build SUCCEEDED but COMMENT_ON_SUCCESS is set to false.')
+            return None, deferred_tasks
+        # the comment published while the build was running would otherwise keep showing it in progress; sticky and
+        # aggregated comments are shared with other builds, so they're updated with the result instead
+        if config.COMMENT_MODE == 'new':
+            LOG.debug('Deleting live logs comment because build SUCCEEDED but COMMENT_ON_SUCCESS is set to false.')
+            _run_github_task(build, deferral.DELETE_LIVE_COMMENT, deferred_tasks, 'DeleteLiveComment',
+                             GITHUB.delete_live_comment, build)
+            return None, deferred_tasks
+    comment_id = _run_github_task(build, deferral.PUBLISH_COMMENT, deferred_tasks, 'PublishComment',
+                                  GITHUB.publish_pr_comment, build)
+    return comment_id, deferred_tasks
+
+
+def _retract_comment(build, commenting, invocation_metrics):
+    # deferred tasks are dropped, the build event is retried as a whole
+    try:
+        comment_id, _ = commenting.result()
+    except Exception:
+        LOG.exception('Failed to comment on PR: build_id=%s', build.id)
+        return
+    if comment_id:
+        LOG.info('Rolling back PR comment, since copying the build logs failed: build_id=%s, comment_id=%s',
+                 build.id, comment_id)
+        with invocation_metrics.timer('RetractComment'):
+            GITHUB.retract_pr_comment(build, comment_id)
+
+
+def _process_deferred(build, tasks, comment_id):
+    """Do the GitHub work deferred for a build, see deferral.
+
+    Tasks are done in order. Once a task can't be done, because the GitHub rate limit budget is still low, it is
+    deferred again along with the tasks after it.
+    """
+    invocation_metrics = metrics.CURRENT
+    deferred_tasks = []
+    try:
+        for task in tasks:
+            if deferred_tasks:
+                deferred_tasks.append(task)
+            elif task == deferral.PUBLISH_COMMENT:
+                comment_id = _run_github_task(build, task, deferred_tasks, 'PublishComment',
+                                              GITHUB.publish_pr_comment, build)
+            elif task == deferral.UPDATE_COMMENT:
+                _run_github_task(build, task, deferred_tasks, 'UpdateComment',
+                                 GITHUB.update_pr_comment, build, comment_id)
+            elif task == deferral.DELETE_LIVE_COMMENT:
+                _run_github_task(build, task, deferred_tasks, 'DeleteLiveComment', GITHUB.delete_live_comment, build)
+            else:
+                # comments published after the deferred one belong to later builds, so they're kept
+                _run_github_task(build, task, deferred_tasks, 'DeletePreviousComments',
+                                 GITHUB.delete_previous_comments, build, comment_id)
+        if deferred_tasks:
+            _defer(build, deferred_tasks, comment_id, invocation_metrics)
+    finally:
+        invocation_metrics.increment('GitHubRequests', GITHUB.pop_request_count(build))
+
+
+def _run_github_task(build, task, deferred_tasks, timer_name, function, *args):
+    """Call function with args, timed as timer_name, and return its result, unless the task has to be deferred.
+
+    If the GitHub rate limit budget is too low for the task, or GitHub rejects it because the rate limit is exceeded,
+    the task is added to deferred_tasks instead and None is returned. Publishing and updating the comment of a build
+    that didn't succeed is critical, so it's only deferred once the budget is exhausted, see
+    GithubProxy.is_rate_limit_low().
+    """
+    if deferral.is_enabled():
+        critical = task != deferral.DELETE_PREVIOUS_COMMENTS and build.status != 'SUCCEEDED'
+        if GITHUB.is_rate_limit_low(critical):
+            LOG.info('GitHub rate limit budget is low: build_id=%s, task=%s', build.id, task)
+            deferred_tasks.append(task)
+            return None
+
+    try:
+        with metrics.CURRENT.timer(timer_name):
+            return function(*args)
+    except RateLimitExceededException:
+        if not deferral.is_enabled():
+            raise
+        LOG.warning('GitHub rate limit exceeded: build_id=%s, task=%s', build.id, task, exc_info=True)
+        deferred_tasks.append(task)
+        return None
+
+
+def _defer(build, tasks, comment_id, invocation_metrics):
+    deferral.defer(build, tasks, comment_id, GITHUB.get_rate_limit_reset_seconds())
+    invocation_metrics.increment('DeferredTasks', len(tasks))
@@ -0,0 +1,93 @@
+"""Tracking of the GitHub API rate limit budget.
+
+GitHub reports how many requests are left in the current rate limit window, and when the window resets, in the
+X-RateLimit-Remaining and X-RateLimit-Reset headers of its responses. RateLimitTracker records them and shares them with
+other warm containers through a small state document in the build logs bucket, so an invocation knows the budget left
+before sending its first request. The state document is read and written at most every SYNC_INTERVAL_SECONDS, so
+tracking costs a few S3 requests no matter how many GitHub requests are sent.
+"""
+
+import threading
+import time
+
+import bucketstate
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+STATE_KEY = 'github/rate-limit.json'
+
+SYNC_INTERVAL_SECONDS = 10
+
+
+class RateLimitTracker:
+    """Track the GitHub rate limit budget reported by GitHub responses; safe to use from several threads."""
+
+    def __init__(self):
+        """Create tracker that doesn't know the budget yet."""
+        self._remaining = None
+        self._reset = None
+        self._changed = False
+        self._synced_at = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def record(self, headers):
+        """Record the budget reported in the headers of a GitHub response, if they report it."""
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            if self._merge(int(remaining), int(reset)):
+                self._changed = True
+
+    def get_remaining(self):
+        """Return the number of requests left until the budget resets, or None if it isn't known."""
+        self.sync()
+        with self._lock:
+            if self._reset is None or self._reset <= time.time():
+                return None
+            return self._remaining
+
+    def get_seconds_until_reset(self):
+        """Return the number of seconds until the budget resets, or 0 if it isn't known."""
+        with self._lock:
+            return max(0, self._reset - time.time()) if self._reset else 0
+
+    def sync(self, force=False):
+        """Merge the budget recorded by other containers and share the one recorded by this one.
+
+        Does nothing if the last sync was less than SYNC_INTERVAL_SECONDS ago, unless force is True, in which case the
+        budget is shared if it changed since. The budget is only an estimate, so failing to sync is logged and ignored.
+        """
+        with self._sync_lock:
+            with self._lock:
+                if self._synced_at is not None:
+                    if force and not self._changed:
+                        return
+                    if not force and time.monotonic() - self._synced_at < SYNC_INTERVAL_SECONDS:
+                        return
+                self._synced_at = time.monotonic()
+                self._changed = False
+
+            try:
+                state = bucketstate.get(STATE_KEY)
+                with self._lock:
+                    if state:
+                        self._merge(state['remaining'], state['reset'])
+                    shared = {'remaining': self._remaining, 'reset': self._reset}
+                # concurrent writes may lose each other's updates, which only delays noticing a shrinking budget
+                if shared['reset'] is not None and shared != state:
+                    bucketstate.put(STATE_KEY, shared)
+            except Exception:
+                LOG.warning('Failed to sync GitHub rate limit budget', exc_info=True)
+
+    def _merge(self, remaining, reset):
+        # a later reset starts a new window, within the same window the budget only shrinks
+        if self._reset is None or reset > self._reset or (reset == self._reset and remaining < self._remaining):
+            self._remaining = remaining
+            self._reset = reset
+            return True
+        return False
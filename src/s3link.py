@@ -6,29 +6,87 @@ from botocore.client import Config
 
 import config
 import lambdalogging
+import sigv4
+from ttlcache import TTLCache
 
 LOG = lambdalogging.getLogger(__name__)
-S3 = boto3.client('s3', config=Config(signature_version='s3v4'))
-BUCKET = boto3.resource('s3', config=Config(signature_version='s3v4')).Bucket(config.BUCKET_NAME)
+
+URL_EXPIRATION_SECONDS = 600  # 10 minutes
+
+# Presigned URLs are cached for half their lifetime, so a URL served from the cache is always valid for at least another
+# 5 minutes. Missing keys are only cached briefly, since their logs may still be being copied.
+URL_CACHE = TTLCache(ttl=URL_EXPIRATION_SECONDS // 2, maxsize=1024)
+NOT_FOUND_CACHE_TTL_SECONDS = 30
+_NOT_CACHED = object()
+
+# created on first use, see _get_s3() and _get_credentials()
+S3 = None
+CREDENTIALS = None
 
 
 def get_presigned_url(key):
-    """Generate presigned URL for given object key if it exists."""
+    """Generate presigned URL for given object key if it exists.
+
+    Results, including keys that don't exist, are cached in memory so repeated requests for popular logs don't touch S3.
+    """
     if not key:
         return None
 
+    url = URL_CACHE.get(key, _NOT_CACHED)
+    if url is _NOT_CACHED:
+        url = _generate_presigned_url(key)
+        URL_CACHE.put(key, url, ttl=NOT_FOUND_CACHE_TTL_SECONDS if url is None else None)
+    LOG.debug('Presigned URL cache stats: %s', URL_CACHE.stats())
+    return url
+
+
+def get_presigned_urls(keys):
+    """Generate presigned URLs for objects that are known to exist, e.g., the chunks listed in a log manifest.
+
+    Unlike get_presigned_url(), no requests are made to check that the objects exist, and URLs aren't cached.
+    """
+    return [_presign(key) for key in keys]
+
+
+def _generate_presigned_url(key):
     try:
-        BUCKET.Object(key).load()
+        _get_s3().head_object(Bucket=config.BUCKET_NAME, Key=key)
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == '404':
             return None
         raise
+    return _presign(key)
+
 
-    return S3.generate_presigned_url(
+def _presign(key):
+    # presign locally if possible, which is much faster than going through the client
+    credentials = _get_credentials()
+    if credentials and config.REGION:
+        url = sigv4.presign_s3_get_url(config.BUCKET_NAME, key, URL_EXPIRATION_SECONDS, config.REGION, credentials)
+        if url:
+            return url
+
+    return _get_s3().generate_presigned_url(
         ClientMethod='get_object',
-        ExpiresIn=600,  # 10 minutes
+        ExpiresIn=URL_EXPIRATION_SECONDS,
         Params={
                 'Bucket': config.BUCKET_NAME,
                 'Key': key
         }
     )
+
+
+def _get_s3():
+    # the client is created lazily and without the boto3 resource layer to keep cold starts of the build logs API fast
+    global S3
+    if S3 is None:
+        S3 = boto3.client('s3', config=Config(signature_version='s3v4'))
+    return S3
+
+
+def _get_credentials():
+    # Lambda's credentials don't change during the lifetime of a container
+    global CREDENTIALS
+    if CREDENTIALS is None:
+        CREDENTIALS = sigv4.get_environment_credentials()
+    return CREDENTIALS
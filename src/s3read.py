@@ -0,0 +1,187 @@
+"""Read parts of archived build logs from S3 without downloading whole objects."""
+
+import collections
+import json
+import zlib
+
+import boto3
+import botocore
+
+import config
+import dedup
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+# created on first use, see _get_s3()
+S3 = None
+
+# Lambda proxy integration responses are limited to 6 MB, so leave some room for the rest of the response
+MAX_READ_BYTES = 5 * 1024 * 1024
+TAIL_BLOCK_SIZE = 256 * 1024
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+def read_tail(key, num_lines):
+    """Return the last num_lines lines of the log stored under key, or None if it doesn't exist.
+
+    Plain logs are read backwards from the end of the object with ranged GETs until enough lines have been read.
+    Compressed logs can't be read from the end, so they are decompressed as a stream, keeping only the last lines.
+    At most MAX_READ_BYTES of lines are returned.
+    """
+    head = _head(key)
+    if head is None:
+        return None
+
+    if head.get('ContentEncoding') == 'gzip':
+        # keep one extra line, since the last one is empty if the log ends with a newline
+        lines = collections.deque(maxlen=num_lines + 1)
+        partial_line = b''
+        for data in _iter_decoded(key):
+            lines.extend((partial_line + data).split(b'\n'))
+            partial_line = lines.pop()
+        lines.append(partial_line)
+        tail = _last_lines(b'\n'.join(lines), num_lines)
+    else:
+        tail = _read_tail_bytes(key, head['ContentLength'], num_lines)
+
+    return _decode(tail[-MAX_READ_BYTES:])
+
+
+def read_range(key, start, end=None):
+    """Return a (content, start, end, size) tuple for a byte range of the log stored under key.
+
+    Returns None if the log doesn't exist. Like HTTP ranges, end is inclusive and defaults to the end of the log. At
+    most MAX_READ_BYTES are read. Offsets refer to the uncompressed log, even if it is stored compressed. size is None
+    for compressed logs, since their uncompressed size isn't known without reading them completely.
+    """
+    head = _head(key)
+    if head is None:
+        return None
+
+    if head.get('ContentEncoding') == 'gzip':
+        size = None
+        end = start + MAX_READ_BYTES - 1 if end is None else min(end, start + MAX_READ_BYTES - 1)
+        content = bytearray()
+        position = 0
+        for data in _iter_decoded(key):
+            if position + len(data) > start:
+                content += data[max(0, start - position):end - position + 1]
+            position += len(data)
+            if position > end:
+                break
+        end = start + len(content) - 1
+    else:
+        size = head['ContentLength']
+        end = min(size - 1 if end is None else end, start + MAX_READ_BYTES - 1, size - 1)
+        content = _get_range(key, start, end) if start <= end else b''
+
+    return _decode(bytes(content)), start, end, size
+
+
+def read_manifest(log_key):
+    """Return the manifest of the log stored as chunks under log_key, or None if it isn't stored as chunks."""
+    try:
+        response = _get_s3().get_object(Bucket=config.BUCKET_NAME, Key=dedup.get_manifest_key(log_key))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+
+def read_chunked_tail(manifest, num_lines):
+    """Return the last num_lines lines of a log stored as chunks, like read_tail().
+
+    Whole chunks are read from the end of the log until enough lines have been read.
+    """
+    data = b''
+    for chunk in reversed(manifest['chunks']):
+        if data.count(b'\n') > num_lines or len(data) >= MAX_READ_BYTES:
+            break
+        data = _get_chunk(manifest, chunk) + data
+    return _decode(_last_lines(data, num_lines)[-MAX_READ_BYTES:])
+
+
+def read_chunked_range(manifest, start, end=None):
+    """Return a (content, start, end, size) tuple for a byte range of a log stored as chunks, like read_range().
+
+    Only the chunks overlapping the range are read, with ranged GETs unless they are compressed. The size of the log is
+    recorded in its manifest, so it is known even for compressed logs.
+    """
+    size = manifest['size']
+    end = min(size - 1 if end is None else end, start + MAX_READ_BYTES - 1, size - 1)
+    content = bytearray()
+    chunk_end = 0
+    for chunk in manifest['chunks']:
+        chunk_start, chunk_end = chunk_end, chunk_end + chunk['size']
+        if chunk_start > end:
+            break
+        if chunk_end <= start:
+            continue
+        first, last = max(start, chunk_start) - chunk_start, min(end, chunk_end - 1) - chunk_start
+        if manifest['content_encoding'] == 'gzip':
+            content += _get_chunk(manifest, chunk)[first:last + 1]
+        else:
+            content += _get_range(chunk['key'], first, last)
+    return _decode(bytes(content)), start, end, size
+
+
+def _get_chunk(manifest, chunk):
+    data = _get_s3().get_object(Bucket=config.BUCKET_NAME, Key=chunk['key'])['Body'].read()
+    if manifest['content_encoding'] == 'gzip':
+        # each chunk is a gzip member of its own
+        data = zlib.decompress(data, wbits=16 + zlib.MAX_WBITS)
+    return data
+
+
+def _read_tail_bytes(key, size, num_lines):
+    data = b''
+    end = size
+    # a log normally ends with a newline, so num_lines lines are preceded by num_lines + 1 newlines
+    while end > 0 and data.count(b'\n') <= num_lines and len(data) < MAX_READ_BYTES:
+        start = max(0, end - TAIL_BLOCK_SIZE)
+        data = _get_range(key, start, end - 1) + data
+        end = start
+    return _last_lines(data, num_lines)
+
+
+def _last_lines(data, num_lines):
+    lines = data.split(b'\n')
+    keep = num_lines + 1 if data.endswith(b'\n') else num_lines
+    return b'\n'.join(lines[-keep:])
+
+
+def _iter_decoded(key):
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    body = _get_s3().get_object(Bucket=config.BUCKET_NAME, Key=key)['Body']
+    for data in iter(lambda: body.read(STREAM_BLOCK_SIZE), b''):
+        yield decompressor.decompress(data)
+    yield decompressor.flush()
+
+
+def _get_range(key, start, end):
+    LOG.debug('Reading byte range: key=%s, range=%d-%d', key, start, end)
+    response = _get_s3().get_object(Bucket=config.BUCKET_NAME, Key=key, Range='bytes={}-{}'.format(start, end))
+    return response['Body'].read()
+
+
+def _head(key):
+    try:
+        return _get_s3().head_object(Bucket=config.BUCKET_NAME, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == '404':
+            return None
+        raise
+
+
+def _get_s3():
+    global S3
+    if S3 is None:
+        S3 = boto3.client('s3')
+    return S3
+
+
+def _decode(data):
+    # ranges may start or end in the middle of a multi-byte character
+    return data.decode('utf-8', errors='replace')
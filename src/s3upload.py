@@ -0,0 +1,103 @@
+"""Stream data into S3 objects without buffering it all in memory."""
+
+import itertools
+import zlib
+
+import lambdalogging
+
+LOG = lambdalogging.getLogger(__name__)
+
+# S3 requires every multipart upload part except the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+
+
+def rechunk(byte_iter, chunk_size=None):
+    """Regroup an iterable of byte strings into chunks of chunk_size bytes. The last chunk may be smaller."""
+    chunk_size = chunk_size or PART_SIZE
+    buffer = bytearray()
+    for data in byte_iter:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def gzip_stream(byte_iter):
+    """Gzip an iterable of byte strings incrementally, yielding compressed data as it becomes available."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # +16 selects the gzip container format
+    for data in byte_iter:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def upload_stream(bucket, key, chunks, **object_args):
+    """Upload an iterable of byte chunks to the given S3 bucket resource under key.
+
+    Data that fits in a single chunk is written with one PutObject call. Anything larger is written as a multipart
+    upload with one part per chunk, so only a couple of chunks are ever held in memory. Returns the number of bytes
+    uploaded.
+
+    Requests are sent with the bucket's client, which, unlike the resource, is safe to share between threads.
+    """
+    client = bucket.meta.client
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    second = next(chunks, None)
+    if second is None:
+        client.put_object(Bucket=bucket.name, Key=key, Body=first, **object_args)
+        return len(first)
+
+    upload_id = client.create_multipart_upload(Bucket=bucket.name, Key=key, **object_args)['UploadId']
+    LOG.debug('Started multipart upload: key=%s, upload_id=%s', key, upload_id)
+    try:
+        parts = []
+        size = 0
+        for part_number, chunk in enumerate(itertools.chain([first, second], chunks), start=1):
+            response = client.upload_part(Bucket=bucket.name, Key=key, UploadId=upload_id, PartNumber=part_number,
+                                          Body=chunk)
+            parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+            size += len(chunk)
+        client.complete_multipart_upload(Bucket=bucket.name, Key=key, UploadId=upload_id,
+                                         MultipartUpload={'Parts': parts})
+    except Exception:
+        LOG.warning('Aborting multipart upload: key=%s, upload_id=%s', key, upload_id)
+        client.abort_multipart_upload(Bucket=bucket.name, Key=key, UploadId=upload_id)
+        raise
+    return size
+
+
+def upload_composed(bucket, key, source_keys, tail=b'', **object_args):
+    """Store the concatenation of the objects stored under source_keys and the bytes tail under key.
+
+    The source objects are copied server-side as parts of a multipart upload, so they aren't downloaded, but each of
+    them must be at least 5 MiB, the minimum part size. Returns the number of parts uploaded.
+    """
+    client = bucket.meta.client
+    if not source_keys:
+        client.put_object(Bucket=bucket.name, Key=key, Body=tail, **object_args)
+        return 1
+
+    upload_id = client.create_multipart_upload(Bucket=bucket.name, Key=key, **object_args)['UploadId']
+    LOG.debug('Started multipart upload: key=%s, upload_id=%s', key, upload_id)
+    try:
+        parts = []
+        for part_number, source_key in enumerate(source_keys, start=1):
+            response = client.upload_part_copy(Bucket=bucket.name, Key=key, UploadId=upload_id,
+                                               PartNumber=part_number,
+                                               CopySource={'Bucket': bucket.name, 'Key': source_key})
+            parts.append({'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']})
+        if tail:
+            response = client.upload_part(Bucket=bucket.name, Key=key, UploadId=upload_id,
+                                          PartNumber=len(parts) + 1, Body=tail)
+            parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+        client.complete_multipart_upload(Bucket=bucket.name, Key=key, UploadId=upload_id,
+                                         MultipartUpload={'Parts': parts})
+    except Exception:
+        LOG.warning('Aborting multipart upload: key=%s, upload_id=%s', key, upload_id)
+        client.abort_multipart_upload(Bucket=bucket.name, Key=key, UploadId=upload_id)
+        raise
+    return len(parts)
@@ -0,0 +1,63 @@
+"""In-memory cache for values that should survive warm Lambda invocations for a limited time."""
+
+import collections
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live.
+
+    Counts hits and misses so callers can report how effective the cache is.
+    """
+
+    def __init__(self, ttl, maxsize=128):
+        """Create cache holding up to maxsize entries, each for ttl seconds unless given its own ttl."""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        """Cache value for key, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Return the cached value for key, calling loader to create and cache it if it is missing or expired."""
+        with self._lock:
+            sentinel = object()
+            value = self.get(key, sentinel)
+            if value is sentinel:
+                value = loader()
+                self.put(key, value, ttl)
+            return value
+
+    def invalidate(self, key=None):
+        """Remove key from the cache, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Return hit and miss counts."""
+        return {'hits': self.hits, 'misses': self.misses}
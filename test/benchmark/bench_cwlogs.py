@@ -0,0 +1,52 @@
+"""Compare FilterLogEvents and GetLogEvents for reading a single build log stream.
+
+Usage: python test/benchmark/bench_cwlogs.py [--lines 10000 100000 1000000] [--latency-ms 2]
+"""
+
+import argparse
+
+import benchutil
+import cwlogs
+import fakes
+
+
+def iter_filtered_log_events(log_group, log_stream):
+    """Yield pages of log events for a single log stream using FilterLogEvents, like the app used to.
+
+    FilterLogEvents scans the whole log group and returns small, uneven pages.
+    """
+    paginator = cwlogs.CW_LOGS.get_paginator('filter_log_events')
+    for page in paginator.paginate(logGroupName=log_group, logStreamNames=[log_stream]):
+        yield page['events']
+
+
+def read_log(reader, client):
+    """Read a whole log stream with the given cwlogs reader and return its size in bytes."""
+    cwlogs.CW_LOGS = client
+    size = 0
+    for events in reader('log-group', 'log-stream'):
+        size += len(''.join(event['message'] for event in events).encode('utf-8'))
+    return size
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--latency-ms', type=float, default=2)
+    args = parser.parse_args()
+
+    rows = []
+    for num_lines in args.lines:
+        for name, reader, operation in [
+                ('FilterLogEvents', iter_filtered_log_events, 'filter_log_events'),
+                ('GetLogEvents', cwlogs.iter_log_events, 'get_log_events')]:
+            client = fakes.FakeLogsClient(num_lines, latency=args.latency_ms / 1000)
+            size, elapsed = benchutil.timed(read_log, reader, client)
+            rows.append([num_lines, name, client.calls[operation], size, '{:.3f}'.format(elapsed)])
+
+    benchutil.print_table(['lines', 'api', 'calls', 'bytes', 'seconds'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare storing the logs of retried builds as whole objects and as deduplicated chunks.
+
+Each corpus is the log of a build followed by the logs of its retries. A retry logs the same steps as the build, except
+in a few regions of its log, e.g., the output of flaky tests, and a few scattered lines that differ in durations.
+
+Usage: python test/benchmark/bench_dedup.py [--lines 100000 1000000] [--retries 3] [--changed-regions 5]
+    [--changed-percent 0.01]
+"""
+
+import argparse
+import gzip
+import random
+
+import benchutil
+import dedup
+from fake_s3 import FakeBucket, FakeS3
+
+BUCKET_NAME = 'build-logs-bucket-1a2b3c'
+REGION_LINES = 200
+
+
+def build_log(num_lines, rng):
+    """Return the lines of a synthetic build log."""
+    return ['[Container] 2024/01/01 00:{:02d}:{:02d} step {} of module {}: ok ({} ms)\n'.format(
+        i // 60 % 60, i % 60, i, i % 97, rng.randint(1, 999)) for i in range(num_lines)]
+
+
+def retry_log(lines, changed_regions, changed_percent, rng):
+    """Return the lines of a retry of the build that logged lines."""
+    retried = list(lines)
+    for _ in range(changed_regions):
+        start = rng.randrange(len(retried) - REGION_LINES)
+        retried[start:start + REGION_LINES] = ['flaky test output {}\n'.format(rng.random())
+                                               for _ in range(rng.randint(REGION_LINES // 2, REGION_LINES * 2))]
+    return [line.replace('ok (', 'ok after retry (') if rng.random() * 100 < changed_percent else line
+            for line in retried]
+
+
+def store_whole(logs, compress):
+    """Store each log as a single object, like s3upload does, and return the number of bytes uploaded."""
+    return sum(len(gzip.compress(log, compresslevel=6)) if compress else len(log) for log in logs)
+
+
+def store_deduplicated(logs, compress):
+    """Store each log as chunks and return (bytes uploaded, number of distinct chunks)."""
+    s3 = FakeS3()
+    bucket = FakeBucket(s3, BUCKET_NAME)
+    bytes_written = 0
+    for i, log in enumerate(logs):
+        pages = (log[start:start + 1024 * 1024] for start in range(0, len(log), 1024 * 1024))
+        bytes_written += dedup.upload(bucket, 'build-{}/build.log'.format(i), 'commit', pages, compress)
+    chunks = sum(1 for _, key in s3.objects if key.startswith(dedup.CHUNK_PREFIX))
+    return bytes_written, chunks
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--changed-regions', type=int, default=5)
+    parser.add_argument('--changed-percent', type=float, default=0.01)
+    args = parser.parse_args()
+
+    rows = []
+    for num_lines in args.lines:
+        rng = random.Random(num_lines)
+        lines = build_log(num_lines, rng)
+        logs = [''.join(lines).encode('utf-8')]
+        for _ in range(args.retries):
+            logs.append(''.join(retry_log(lines, args.changed_regions, args.changed_percent, rng)).encode('utf-8'))
+        log_bytes = sum(len(log) for log in logs)
+
+        for compress in [False, True]:
+            whole_bytes = store_whole(logs, compress)
+            (dedup_bytes, chunks), elapsed = benchutil.timed(store_deduplicated, logs, compress)
+            rows.append([num_lines, len(logs), compress, log_bytes, whole_bytes, dedup_bytes, chunks,
+                         '{:.2f}'.format(elapsed), '{:.1f}'.format(log_bytes / elapsed / 1e6),
+                         '{:.1f}%'.format(100 * (1 - dedup_bytes / whole_bytes))])
+
+    benchutil.print_table(['lines', 'logs', 'gzip', 'log bytes', 'whole bytes', 'dedup bytes', 'chunks', 'seconds',
+                           'MB/s', 'saved'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Run the Lambda function handlers end to end against local stand-ins for AWS and GitHub.
+
+processbuildevents.handler copies a synthetic build log from a fake CloudWatch Logs service into an in-memory S3 and
+comments on a PR served by a fake GitHub REST server. getbuildlogs.handler then serves the log. Each scenario runs in
+its own process, so the reported peak RSS belongs to that scenario alone. Note that it includes the copied log, which
+the in-memory S3 keeps.
+
+Usage: python test/benchmark/bench_e2e.py [--lines 10000 100000 1000000] [--comments 0 100] [--latency-ms 2]
+                                          [--github-latency-ms 20] [--comment-mode new] [--delete-previous-comments]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+
+import benchutil
+import fakes
+
+# keep the X-Ray SDK out of the measurements, there is no daemon to send traces to
+os.environ.setdefault('XRAY_PATCH_MODULES', '')
+
+
+def run_scenario(args, num_lines, num_comments):
+    """Run one scenario and return a dict of its measurements; runs in a child process."""
+    github = fakes.FakeGitHubServer(num_comments, latency=args.github_latency_ms / 1000).start()
+    os.environ['GITHUB_API_URL'] = github.url
+    os.environ['COMMENT_MODE'] = args.comment_mode
+    os.environ['DELETE_PREVIOUS_COMMENTS'] = 'true' if args.delete_previous_comments else 'false'
+    os.environ['COMMENT_ON_SUCCESS'] = 'true'
+    os.environ['LOG_FETCH_CONCURRENCY'] = str(args.log_fetch_concurrency)
+
+    import build
+    import bucketstate
+    import cwlogs
+    import getbuildlogs
+    import github_proxy
+    import processbuildevents
+    import s3link
+    import s3read
+
+    logs = fakes.FakeLogsClient(num_lines, latency=args.latency_ms / 1000)
+    codebuild = fakes.FakeCodeBuildClient(pr_id=1, num_lines=num_lines)
+    s3 = fakes.FakeS3Client(os.environ['BUILD_LOGS_BUCKET_NAME'])
+    cwlogs.CW_LOGS = logs
+    build.CODEBUILD = github_proxy.CODEBUILD = codebuild
+    build.BUCKET = bucketstate.S3 = s3link.S3 = s3read.S3 = s3
+
+    build_event = {
+        'detail': {
+            'build-id': 'arn:aws:codebuild:us-east-1:123456789012:build/project:build-1',
+            'project-name': os.environ['CODEBUILD_PROJECT_NAME'],
+            'build-status': 'FAILED',
+            'additional-information': {
+                'source-version': 'pr/1',
+                'resolved-source-version': 'da39a3ee5e6b4b0d3255bfef95601890afd80709',
+                'logs': {'group-name': 'log-group', 'stream-name': 'build-1'},
+            },
+        }
+    }
+    # the handler prints an EMF metrics line, which isn't part of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, process_seconds = benchutil.timed(processbuildevents.handler, build_event, None)
+
+    log_key = 'build-1/build.log'
+    log_size = len(s3.objects[(s3.bucket_name, log_key)][0])
+    get_seconds = {}
+    for name, query_parameters in [('redirect', {}), ('tail', {'tail': '100'}), ('range', {'range': '0-65535'})]:
+        response, get_seconds[name] = benchutil.timed(
+            getbuildlogs.handler, {'queryStringParameters': dict(query_parameters, key=log_key)}, None)
+        assert response['statusCode'] in (200, 206, 307), response
+
+    github.stop()
+    return {
+        'lines': num_lines,
+        'comments': num_comments,
+        'bytes': log_size,
+        'process_seconds': process_seconds,
+        'get_seconds': get_seconds,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'cwlogs_calls': sum(logs.calls.values()),
+        'codebuild_calls': sum(codebuild.calls.values()),
+        's3_calls': sum(s3.calls.values()),
+        'github_calls': sum(github.calls.values()),
+    }
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--comments', type=int, nargs='+', default=[0, 100])
+    parser.add_argument('--latency-ms', type=float, default=2)
+    parser.add_argument('--github-latency-ms', type=float, default=20)
+    parser.add_argument('--comment-mode', choices=['new', 'sticky', 'aggregated'], default='new')
+    parser.add_argument('--delete-previous-comments', action='store_true')
+    parser.add_argument('--log-fetch-concurrency', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines instead of a table')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for num_lines in args.lines:
+        for num_comments in args.comments:
+            with context.Pool(1) as pool:
+                results.append(pool.apply(run_scenario, (args, num_lines, num_comments)))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    benchutil.print_table(
+        ['lines', 'comments', 'MB', 'process s', 'MB/s', 'tail ms', 'range ms', 'peak RSS MB', 'cwlogs', 'codebuild',
+         's3', 'github'],
+        [[result['lines'], result['comments'], '{:.1f}'.format(result['bytes'] / 1e6),
+          '{:.3f}'.format(result['process_seconds']),
+          '{:.1f}'.format(result['bytes'] / 1e6 / result['process_seconds']),
+          '{:.1f}'.format(result['get_seconds']['tail'] * 1000),
+          '{:.1f}'.format(result['get_seconds']['range'] * 1000),
+          '{:.0f}'.format(result['peak_rss_mb']), result['cwlogs_calls'], result['codebuild_calls'],
+          result['s3_calls'], result['github_calls']] for result in results])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
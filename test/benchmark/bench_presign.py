@@ -0,0 +1,51 @@
+"""Compare boto3's generate_presigned_url with the local SigV4 presigner used by s3link.
+
+Usage: python test/benchmark/bench_presign.py [--urls 10000]
+"""
+
+import argparse
+
+import benchutil
+import boto3
+from botocore.client import Config
+
+import sigv4
+
+BUCKET_NAME = 'build-logs-bucket-1a2b3c'
+REGION = 'us-east-1'
+
+
+def presign_boto3(s3, keys):
+    """Presign a GET URL for each key with boto3."""
+    for key in keys:
+        s3.generate_presigned_url(ClientMethod='get_object', ExpiresIn=600, Params={'Bucket': BUCKET_NAME, 'Key': key})
+
+
+def presign_local(credentials, keys):
+    """Presign a GET URL for each key with the local presigner."""
+    for key in keys:
+        sigv4.presign_s3_get_url(BUCKET_NAME, key, 600, REGION, credentials)
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=10000)
+    args = parser.parse_args()
+
+    keys = ['{:08x}-log-stream/build.log'.format(i) for i in range(args.urls)]
+    credentials = sigv4.Credentials('AKIDEXAMPLE', 'secret', 'token')
+    s3 = boto3.client('s3', region_name=REGION, config=Config(signature_version='s3v4'),
+                      aws_access_key_id=credentials.access_key, aws_secret_access_key=credentials.secret_key,
+                      aws_session_token=credentials.token)
+
+    rows = []
+    for name, presign, signer in [('boto3', presign_boto3, s3), ('sigv4', presign_local, credentials)]:
+        _, elapsed = benchutil.timed(presign, signer, keys)
+        rows.append([name, args.urls, '{:.3f}'.format(elapsed), '{:.1f}'.format(elapsed / args.urls * 1e6)])
+
+    benchutil.print_table(['presigner', 'urls', 'seconds', 'us/url'], rows)
+
+
+if __name__ == '__main__':
+    main()
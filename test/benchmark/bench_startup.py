@@ -0,0 +1,82 @@
+"""Measure import time of the Lambda function handler modules, i.e., the part of cold starts the app controls.
+
+Each handler module is imported in a fresh interpreter with -X importtime, once for each X-Ray patching mode. The
+cumulative import time of the handler module and the modules contributing most to it are reported. If --budget-ms is
+given, exits with an error if the lean mode import time of GetBuildLogs exceeds it, so regressions are caught.
+
+Usage: python test/benchmark/bench_startup.py [--runs 5] [--top 10] [--budget-ms 500]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+import benchutil
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src')
+
+HANDLER_MODULES = ['getbuildlogs', 'processbuildevents']
+
+# XRAY_PATCH_MODULES values, see lambdainit
+XRAY_MODES = [
+    ('patch_all', None),
+    ('lean', 'botocore'),
+    ('off', ''),
+]
+
+
+def import_times(module, xray_patch_modules):
+    """Import module in a fresh interpreter and return a dict of the cumulative import time in ms of each module."""
+    env = dict(os.environ)
+    env.pop('XRAY_PATCH_MODULES', None)
+    if xray_patch_modules is not None:
+        env['XRAY_PATCH_MODULES'] = xray_patch_modules
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=SRC_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                            check=True)
+
+    # lines look like "import time:       215 |        892 |   botocore.session", times in microseconds
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = times.get(name.strip(), 0) + int(cumulative) / 1000
+    return times
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float)
+    args = parser.parse_args()
+
+    rows = []
+    medians = {}
+    for module in HANDLER_MODULES:
+        for mode, xray_patch_modules in XRAY_MODES:
+            runs = [import_times(module, xray_patch_modules) for _ in range(args.runs)]
+            medians[module, mode] = statistics.median(times[module] for times in runs)
+            rows.append([module, mode, '{:.1f}'.format(medians[module, mode]),
+                         '{:.1f}'.format(min(times[module] for times in runs))])
+    benchutil.print_table(['module', 'xray', 'median ms', 'min ms'], rows)
+
+    for module in HANDLER_MODULES:
+        times = import_times(module, 'botocore')
+        # only report top-level packages and the app's own modules, nested modules are included in their cumulative time
+        top = sorted(((ms, name) for name, ms in times.items() if '.' not in name and name != module), reverse=True)
+        print('\nSlowest imports of {} in lean mode:'.format(module))
+        benchutil.print_table(['module', 'cumulative ms'],
+                              [[name, '{:.1f}'.format(ms)] for ms, name in top[:args.top]])
+
+    if args.budget_ms is not None and medians['getbuildlogs', 'lean'] > args.budget_ms:
+        sys.exit('getbuildlogs import time {:.1f} ms exceeds budget of {:.1f} ms'.format(
+            medians['getbuildlogs', 'lean'], args.budget_ms))
+
+
+if __name__ == '__main__':
+    main()
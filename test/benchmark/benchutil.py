@@ -0,0 +1,38 @@
+"""Setup and helpers shared by the local benchmarks.
+
+Importing this module makes the app code importable and sets the config environment variables the app expects, the same
+way test/unit/conftest.py does for unit tests.
+"""
+
+import os
+import sys
+import time
+
+my_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, my_path + '/../../src/')
+sys.path.insert(0, my_path + '/../unit/')
+
+import test_constants  # noqa: E402
+
+os.environ.setdefault('BUILD_LOGS_BUCKET_NAME', test_constants.BUCKET_NAME)
+os.environ.setdefault('CODEBUILD_PROJECT_NAME', test_constants.PROJECT_NAME)
+os.environ.setdefault('EXPIRATION_IN_DAYS', str(test_constants.EXPIRATION_IN_DAYS))
+os.environ.setdefault('BUILD_LOGS_API_ENDPOINT', test_constants.BUILD_LOGS_API_ENDPOINT)
+os.environ.setdefault('GITHUB_OAUTH_TOKEN_SECRET_ARN', test_constants.GITHUB_OAUTH_TOKEN_SECRET_ARN)
+os.environ.setdefault('AWS_DEFAULT_REGION', test_constants.REGION)
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return a (result, elapsed seconds) tuple."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def print_table(headers, rows):
+    """Print rows as a fixed-width text table."""
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
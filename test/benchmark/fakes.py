@@ -0,0 +1,309 @@
+"""Local stand-ins for the AWS services used by the app, for benchmarking."""
+
+import datetime
+import http.server
+import json
+import re
+import threading
+import time
+import types
+import urllib.parse
+
+from fake_s3 import FakeS3
+
+MAX_EVENTS_PER_PAGE = 10000
+MAX_BYTES_PER_PAGE = 1024 * 1024
+EVENT_OVERHEAD_BYTES = 26
+
+# body of a comment posted by the app, see github_proxy.HIDDEN_COMMENT
+APP_COMMENT_BODY = '\n<!--\nCREATED BY GITHUB-CODEBUILD-LOGS\n-->\n'
+
+
+class FakeLogsClient:
+    """CloudWatch Logs client serving one synthetic build log stream of a given number of lines.
+
+    Events are generated on demand, so arbitrarily large streams cost no memory. The stream lives in a log group with
+    other_streams other streams of the same size, whose events FilterLogEvents has to scan past. Every API call sleeps
+    for latency seconds to model the network round-trip.
+    """
+
+    def __init__(self, num_lines, other_streams=3, latency=0.002, filter_scan_limit=2000, start_time=0):
+        """Create fake client."""
+        self.num_lines = num_lines
+        self.other_streams = other_streams
+        self.latency = latency
+        self.filter_scan_limit = filter_scan_limit
+        self.start_time = start_time
+        self.calls = {}
+
+    def event(self, index):
+        """Return the event for the given line of the build log."""
+        return {
+            'timestamp': self.start_time + index,
+            'message': '[{:09d}] synthetic build output: compiling module {}\n'.format(index, index % 97),
+            'ingestionTime': self.start_time + index,
+        }
+
+    def get_log_events(self, logGroupName, logStreamName, startFromHead=False, nextToken=None, startTime=None,
+                       endTime=None, limit=MAX_EVENTS_PER_PAGE):
+        """Emulate GetLogEvents, reading forward from the head of the stream."""
+        self._call('get_log_events')
+        first = int(nextToken.split('/')[1]) if nextToken else self._index_at(startTime, 0)
+        last = self._index_at(endTime, self.num_lines)
+        events = self._page(first, last, min(limit, MAX_EVENTS_PER_PAGE))
+        return {
+            'events': events,
+            'nextForwardToken': 'f/{}'.format(first + len(events)),
+            'nextBackwardToken': 'b/{}'.format(first),
+        }
+
+    def filter_log_events(self, logGroupName, logStreamNames, nextToken=None):
+        """Emulate FilterLogEvents, which scans events of every stream in the group."""
+        self._call('filter_log_events')
+        group_size = self.num_lines * (self.other_streams + 1)
+        scan_start = int(nextToken) if nextToken else 0
+        scan_end = min(scan_start + self.filter_scan_limit, group_size)
+        first = -(-scan_start // (self.other_streams + 1))
+        last = -(-scan_end // (self.other_streams + 1))
+        response = {'events': self._page(first, last, MAX_EVENTS_PER_PAGE)}
+        if scan_end < group_size:
+            response['nextToken'] = str(scan_end)
+        return response
+
+    def get_paginator(self, operation_name):
+        """Return a paginator for filter_log_events."""
+        assert operation_name == 'filter_log_events'
+        return _FakePaginator(self.filter_log_events)
+
+    def _index_at(self, timestamp, default):
+        if timestamp is None:
+            return default
+        return max(0, min(self.num_lines, timestamp - self.start_time))
+
+    def _page(self, first, last, max_events):
+        events = []
+        size = 0
+        for index in range(first, min(last, first + max_events)):
+            event = self.event(index)
+            size += len(event['message']) + EVENT_OVERHEAD_BYTES
+            if size > MAX_BYTES_PER_PAGE:
+                break
+            events.append(event)
+        return events
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        time.sleep(self.latency)
+
+
+class _FakePaginator:
+
+    def __init__(self, operation):
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self._operation(**kwargs)
+            yield page
+            if 'nextToken' not in page:
+                return
+            kwargs['nextToken'] = page['nextToken']
+
+
+class FakeS3Client(FakeS3):
+    """In-memory S3 client that counts calls and also serves as the app's boto3 Bucket resource."""
+
+    def __init__(self, bucket_name):
+        """Create fake client for a single bucket."""
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.calls = {}
+        # the app accesses the bucket through its client
+        self.name = bucket_name
+        self.meta = types.SimpleNamespace(client=self)
+
+    def get_object(self, **kwargs):
+        """Emulate GetObject."""
+        self._call('get_object')
+        return super().get_object(**kwargs)
+
+    def head_object(self, **kwargs):
+        """Emulate HeadObject."""
+        self._call('head_object')
+        return super().head_object(**kwargs)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        """Emulate PutObject."""
+        self._call('put_object')
+        return super().put_object(Bucket, Key, Body, **kwargs)
+
+    def delete_object(self, **kwargs):
+        """Emulate DeleteObject."""
+        self._call('delete_object')
+        return super().delete_object(**kwargs)
+
+    def create_multipart_upload(self, **kwargs):
+        """Emulate CreateMultipartUpload."""
+        self._call('create_multipart_upload')
+        return super().create_multipart_upload(**kwargs)
+
+    def upload_part(self, **kwargs):
+        """Emulate UploadPart."""
+        self._call('upload_part')
+        return super().upload_part(**kwargs)
+
+    def complete_multipart_upload(self, **kwargs):
+        """Emulate CompleteMultipartUpload."""
+        self._call('complete_multipart_upload')
+        return super().complete_multipart_upload(**kwargs)
+
+    def abort_multipart_upload(self, **kwargs):
+        """Emulate AbortMultipartUpload."""
+        self._call('abort_multipart_upload')
+        return super().abort_multipart_upload(**kwargs)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        """Return a fake presigned URL."""
+        return 'https://{}.s3.amazonaws.com/{}?X-Amz-Expires={}'.format(Params['Bucket'], Params['Key'], ExpiresIn)
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+
+class FakeCodeBuildClient:
+    """CodeBuild client describing PR builds whose logs are served by a FakeLogsClient, and a GitHub project."""
+
+    def __init__(self, pr_id, num_lines):
+        """Create fake client."""
+        self.pr_id = pr_id
+        self.num_lines = num_lines
+        self.calls = {}
+
+    def batch_get_builds(self, ids):
+        """Emulate BatchGetBuilds."""
+        self._call('batch_get_builds')
+        return {'builds': [{
+            'id': build_id,
+            'sourceVersion': 'pr/{}'.format(self.pr_id),
+            'resolvedSourceVersion': 'da39a3ee5e6b4b0d3255bfef95601890afd80709',
+            'startTime': datetime.datetime.fromtimestamp(0, datetime.timezone.utc),
+            'endTime': datetime.datetime.fromtimestamp(self.num_lines / 1000, datetime.timezone.utc),
+            'logs': {'groupName': 'log-group', 'streamName': build_id.split(':')[-1]},
+        } for build_id in ids]}
+
+    def batch_get_projects(self, names):
+        """Emulate BatchGetProjects."""
+        self._call('batch_get_projects')
+        return {'projects': [{
+            'name': names[0],
+            'source': {
+                'type': 'GITHUB',
+                'location': 'https://github.com/owner/repo.git',
+                'auth': {'type': 'OAUTH', 'resource': 'token'},
+            },
+        }]}
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+
+class FakeGitHubServer:
+    """Local HTTP server emulating the GitHub REST API for PR comments.
+
+    Every PR starts out with num_comments comments, a share of them posted by the app, and every request waits for
+    latency seconds before it is answered. Requests are counted by method.
+    """
+
+    def __init__(self, num_comments=0, latency=0.02, app_comment_ratio=0.1):
+        """Create fake server; call start() to serve requests."""
+        self.num_comments = num_comments
+        self.latency = latency
+        self.app_comment_ratio = app_comment_ratio
+        self.calls = {}
+        self._comments = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+
+    @property
+    def url(self):
+        """Return the base URL of the server."""
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def start(self):
+        """Serve requests in a background thread."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _pr_comments(self, pr_id):
+        if pr_id not in self._comments:
+            app_every = int(1 / self.app_comment_ratio) if self.app_comment_ratio else 0
+            self._comments[pr_id] = [
+                self._new_comment(APP_COMMENT_BODY if app_every and i % app_every == 0 else 'LGTM')
+                for i in range(self.num_comments)
+            ]
+        return self._comments[pr_id]
+
+    def _new_comment(self, body):
+        comment = {'id': self._next_id, 'body': body}
+        self._next_id += 1
+        return comment
+
+    def _handle(self, method, path, query, body):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            match = re.match(r'^/repos/[^/]+/[^/]+/issues/(\d+)/comments$', path)
+            if match and method == 'GET':
+                per_page = int(query.get('per_page', ['30'])[0])
+                page = int(query.get('page', ['1'])[0])
+                return 200, self._pr_comments(match.group(1))[(page - 1) * per_page:page * per_page]
+            if match and method == 'POST':
+                comment = self._new_comment(body['body'])
+                self._pr_comments(match.group(1)).append(comment)
+                return 201, comment
+
+            match = re.match(r'^/repos/[^/]+/[^/]+/issues/comments/(\d+)$', path)
+            if match:
+                comment_id = int(match.group(1))
+                for comments in self._comments.values():
+                    for comment in comments:
+                        if comment['id'] == comment_id:
+                            if method == 'DELETE':
+                                comments.remove(comment)
+                                return 204, None
+                            comment['body'] = body['body']
+                            return 200, comment
+            return 404, {'message': 'Not Found'}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                self._respond()
+
+            do_POST = do_PATCH = do_DELETE = do_GET
+
+            def _respond(self):
+                url = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, data = server._handle(self.command, url.path, urllib.parse.parse_qs(url.query), body)
+                payload = json.dumps(data).encode('utf-8') if data is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,106 @@
+"""In-memory stand-in for the S3 client operations used by the app, including conditional writes and ranged reads."""
+
+import datetime
+import hashlib
+import io
+import types
+
+import botocore
+
+
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.last_modified = {}
+        self.put_count = 0
+        self.get_count = 0
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('NoSuchKey', 'GetObject')
+        self.get_count += 1
+        body, etag = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            body = body[int(start):int(end) + 1]
+        return dict(self.metadata[(Bucket, Key)], Body=io.BytesIO(body), ETag=etag, ContentLength=len(body),
+                    LastModified=self.last_modified[(Bucket, Key)])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise _client_error('404', 'HeadObject')
+        body, etag = self.objects[(Bucket, Key)]
+        return dict(self.metadata[(Bucket, Key)], ETag=etag, ContentLength=len(body),
+                    LastModified=self.last_modified[(Bucket, Key)])
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        current = self.objects.get((Bucket, Key))
+        if IfNoneMatch == '*' and current is not None:
+            raise _client_error('PreconditionFailed', 'PutObject')
+        if IfMatch is not None and (current is None or current[1] != IfMatch):
+            raise _client_error('PreconditionFailed', 'PutObject')
+
+        self.put_count += 1
+        etag = '"{}-{}"'.format(hashlib.md5(Body).hexdigest(), self.put_count)
+        self.objects[(Bucket, Key)] = (Body, etag)
+        self.metadata[(Bucket, Key)] = kwargs
+        self.last_modified[(Bucket, Key)] = datetime.datetime.now(datetime.timezone.utc)
+        return {'ETag': etag}
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective='COPY', **kwargs):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        if source not in self.objects:
+            raise _client_error('NoSuchKey', 'CopyObject')
+        metadata = kwargs if MetadataDirective == 'REPLACE' else self.metadata[source]
+        return self.put_object(Bucket, Key, self.objects[source][0], **metadata)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        self.metadata.pop((Bucket, Key), None)
+        self.last_modified.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = 'upload-{}'.format(len(self.uploads) + 1)
+        self.uploads[upload_id] = {'key': (Bucket, Key), 'args': kwargs, 'parts': {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId]['parts'][PartNumber] = Body
+        return {'ETag': '"part-{}"'.format(PartNumber)}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        if source not in self.objects:
+            raise _client_error('NoSuchKey', 'UploadPartCopy')
+        self.uploads[UploadId]['parts'][PartNumber] = self.objects[source][0]
+        return {'CopyPartResult': {'ETag': '"part-{}"'.format(PartNumber)}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId)
+        body = b''.join(upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        return FakeS3.put_object(self, Bucket, Key, body, **upload['args'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class FakeBucket:
+    """Stand-in for the boto3 Bucket resource of a bucket in a FakeS3, which is only accessed through its client."""
+
+    def __init__(self, s3, name):
+        self.name = name
+        self.meta = types.SimpleNamespace(client=s3)
+
+
+def _client_error(code, operation_name):
+    return botocore.exceptions.ClientError({'Error': {'Code': code}}, operation_name)
@@ -0,0 +1,118 @@
+import io
+
+import botocore
+import pytest
+
+import bucketstate
+from fake_s3 import FakeS3
+import test_constants
+
+
+@pytest.fixture
+def mock_s3(mocker):
+    mocker.patch.object(bucketstate, 'S3')
+    return bucketstate.S3
+
+
+def test_get(mock_s3):
+    mock_s3.get_object.return_value = {'Body': io.BytesIO(b'{"foo": "bar"}'), 'ETag': '"etag"'}
+
+    assert bucketstate.get('some/key.json') == {'foo': 'bar'}
+    mock_s3.get_object.assert_called_once_with(Bucket=test_constants.BUCKET_NAME, Key='state/some/key.json')
+
+
+def test_get_no_such_key(mock_s3):
+    mock_s3.get_object.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+    assert bucketstate.get('some/key.json') is None
+
+
+def test_get_other_error(mock_s3):
+    mock_s3.get_object.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'boom!'}}, 'GetObject')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        bucketstate.get('some/key.json')
+
+
+def test_delete(mock_s3):
+    bucketstate.delete('some/key.json')
+
+    mock_s3.delete_object.assert_called_once_with(Bucket=test_constants.BUCKET_NAME, Key='state/some/key.json')
+
+
+def test_put(mock_s3):
+    bucketstate.put('some/key.json', {'foo': 'bar'})
+
+    mock_s3.put_object.assert_called_once_with(
+        Bucket=test_constants.BUCKET_NAME,
+        Key='state/some/key.json',
+        Body=b'{"foo": "bar"}',
+        ContentType='application/json'
+    )
+
+
+def test_put_conditional(mocker):
+    mocker.patch.object(bucketstate, 'S3', FakeS3())
+
+    etag = bucketstate.put('key.json', {'v': 1}, if_none_match=True)
+    with pytest.raises(bucketstate.ConflictError):
+        bucketstate.put('key.json', {'v': 2}, if_none_match=True)
+
+    new_etag = bucketstate.put('key.json', {'v': 2}, if_match=etag)
+    with pytest.raises(bucketstate.ConflictError):
+        bucketstate.put('key.json', {'v': 3}, if_match=etag)
+
+    assert bucketstate.get_with_etag('key.json') == ({'v': 2}, new_etag)
+
+
+def test_put_other_error(mock_s3):
+    mock_s3.put_object.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'boom!'}}, 'PutObject')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        bucketstate.put('key.json', {}, if_none_match=True)
+
+
+def test_update(mocker):
+    mocker.patch.object(bucketstate, 'S3', FakeS3())
+
+    def increment(document):
+        document = document or {'count': 0}
+        document['count'] += 1
+        return document
+
+    assert bucketstate.update('key.json', increment)[0] == {'count': 1}
+    assert bucketstate.update('key.json', increment, 'other-bucket')[0] == {'count': 1}
+    document, etag = bucketstate.update('key.json', increment)
+
+    assert document == {'count': 2}
+    assert bucketstate.get_with_etag('key.json') == (document, etag)
+
+
+def test_update_retries_on_conflict(mocker):
+    fake_s3 = FakeS3()
+    mocker.patch.object(bucketstate, 'S3', fake_s3)
+    bucketstate.put('key.json', {'rows': []})
+
+    def add_row(document):
+        if document['rows'] == []:
+            # simulate another invocation adding a row between our read and write
+            bucketstate.put('key.json', {'rows': ['theirs']})
+        document['rows'].append('ours')
+        return document
+
+    document, _ = bucketstate.update('key.json', add_row)
+
+    assert document == {'rows': ['theirs', 'ours']}
+    assert bucketstate.get('key.json') == document
+
+
+def test_update_gives_up(mocker):
+    mocker.patch.object(bucketstate, 'S3', FakeS3())
+    bucketstate.put('key.json', {'count': 0})
+
+    def always_conflict(document):
+        bucketstate.put('key.json', {'count': document['count'] + 1})
+        return document
+
+    with pytest.raises(bucketstate.ConflictError):
+        bucketstate.update('key.json', always_conflict)
@@ -1,3 +1,7 @@
+from datetime import datetime, timezone
+import gzip
+import json
+import botocore
 import pytest
 
 import build
@@ -7,6 +11,7 @@ BUILD_ID = 'some-build'
 BUILD_STATUS = 'SUCCEEDED'
 LOG_GROUP_NAME = "log-group"
 LOG_STREAM_NAME = "log-stream"
+BUCKET_NAME = test_constants.BUCKET_NAME
 
 
 @pytest.fixture
@@ -17,16 +22,23 @@ def mock_codebuild(mocker):
 
 @pytest.fixture
 def mock_cw_logs(mocker):
-    mocker.patch.object(build, 'CW_LOGS')
-    return build.CW_LOGS
+    mocker.patch.object(build.cwlogs, 'CW_LOGS')
+    return build.cwlogs.CW_LOGS
 
 
 @pytest.fixture
 def mock_bucket(mocker):
     mocker.patch.object(build, 'BUCKET')
+    build.BUCKET.name = BUCKET_NAME
     return build.BUCKET
 
 
+@pytest.fixture
+def mock_s3(mock_bucket):
+    # the bucket is only accessed through its client
+    return mock_bucket.meta.client
+
+
 def test_init():
     build_obj = build.Build(_mock_build_event())
     assert build_obj.id == BUILD_ID
@@ -70,29 +82,8 @@ def test_is_pr_build_is_pr(mocker, mock_codebuild):
     assert build_obj.is_pr_build() is True
 
 
-def test_copy_logs(mocker, mock_codebuild, mock_cw_logs, mock_bucket):
-    mock_cw_logs.get_paginator.return_value.paginate.return_value = [
-        {
-            'events': [
-                {
-                    'message': 'foo',
-                },
-                {
-                    'message': 'bar',
-                }
-            ]
-        },
-        {
-            'events': [
-                {
-                    'message': 'baz',
-                },
-                {
-                    'message': 'blah',
-                }
-            ]
-        },
-    ]
+def test_copy_logs(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    _mock_log_pages([['foo', 'bar'], ['baz', 'blah']])
     _mock_build_details('pr/123')
 
     build_obj = build.Build(_mock_build_event())
@@ -100,33 +91,291 @@ def test_copy_logs(mocker, mock_codebuild, mock_cw_logs, mock_bucket):
 
     mock_codebuild.batch_get_builds.assert_called_once_with(ids=[BUILD_ID])
 
-    mock_cw_logs.get_paginator.assert_called_once_with('filter_log_events')
-    mock_cw_logs.get_paginator.return_value.paginate.assert_called_once_with(
-        logGroupName=LOG_GROUP_NAME,
-        logStreamNames=[LOG_STREAM_NAME]
-    )
+    assert mock_cw_logs.get_log_events.call_args_list == [
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True,
+                    nextToken='token-1'),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True,
+                    nextToken='token-2'),
+    ]
+
+    assert mock_s3.put_object.call_args_list == [
+        mocker.call(Bucket=BUCKET_NAME, Key=LOG_STREAM_NAME + '/build.log', Body=b'foobarbazblah',
+                    ContentType="text/plain"),
+        mocker.call(Bucket=BUCKET_NAME, Key=LOG_STREAM_NAME + '/build.log.index.json', Body=mocker.ANY,
+                    ContentType='application/json'),
+    ]
+    assert build_obj.first_failure is None
+
+
+def test_copy_logs_compressed(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'COMPRESS_LOGS', True)
+    _mock_log_pages([['foo', 'bar']])
+    _mock_build_details('pr/123')
+
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    kwargs = mock_s3.put_object.call_args_list[0].kwargs
+    assert kwargs['Key'] == LOG_STREAM_NAME + '/build.log'
+    assert kwargs['ContentType'] == 'text/plain'
+    assert kwargs['ContentEncoding'] == 'gzip'
+    assert gzip.decompress(kwargs['Body']) == b'foobar'
+    assert build_obj.log_bytes_written == len(kwargs['Body'])
+
+
+def test_copy_logs_deduplicated(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'DEDUPLICATE_LOGS', True)
+    mock_upload = mocker.patch.object(build.dedup, 'upload')
+    mock_upload.side_effect = lambda bucket, key, scope, data, compress: len(b''.join(data))
+    _mock_log_pages([['foo', 'bar']])
+
+    build_obj = build.Build(_mock_build_event(additional_information=_mock_additional_information()))
+    build_obj.copy_logs()
+
+    mock_upload.assert_called_once_with(mock_bucket, LOG_STREAM_NAME + '/build.log', 'abc123', mocker.ANY, False)
+    assert build_obj.log_bytes_written == 6
+    assert mock_s3.put_object.call_args_list == [
+        mocker.call(Bucket=BUCKET_NAME, Key=LOG_STREAM_NAME + '/build.log.index.json', Body=mocker.ANY,
+                    ContentType='application/json'),
+    ]
+
+
+def test_copy_logs_multipart(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    mocker.patch.object(build.s3upload, 'PART_SIZE', 4)
+    _mock_log_pages([['foo', 'bar'], ['baz']])
+    mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    mock_s3.upload_part.return_value = {'ETag': 'etag'}
+    _mock_build_details('pr/123')
 
-    mock_bucket.put_object.assert_called_once_with(
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    mock_s3.put_object.assert_called_once_with(Bucket=BUCKET_NAME,
+                                               Key=LOG_STREAM_NAME + '/build.log.index.json', Body=mocker.ANY,
+                                               ContentType='application/json')
+    mock_s3.create_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=LOG_STREAM_NAME + '/build.log',
+                                                            ContentType='text/plain')
+    assert [c.kwargs['Body'] for c in mock_s3.upload_part.call_args_list] == [b'foob', b'arba', b'z']
+    mock_s3.complete_multipart_upload.assert_called_once()
+
+
+def test_copy_logs_parallel(mocker, mock_codebuild, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'LOG_FETCH_CONCURRENCY', 4)
+    mocker.patch.object(build.config, 'LOG_FETCH_WINDOW_SECONDS', 60)
+    mock_parallel = mocker.patch.object(build.cwlogs, 'iter_log_events_parallel')
+    mock_parallel.return_value = [[{'message': 'foo'}], [{'message': 'bar'}]]
+    _mock_build_details('pr/123')
+    build_details = mock_codebuild.batch_get_builds.return_value['builds'][0]
+    build_details['startTime'] = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    build_details['endTime'] = datetime(2020, 1, 1, 1, tzinfo=timezone.utc)
+
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    mock_parallel.assert_called_once_with(
+        LOG_GROUP_NAME,
+        LOG_STREAM_NAME,
+        1577836800000,
+        1577840400000,
+        concurrency=4,
+        window_seconds=60,
+    )
+    assert mock_s3.put_object.call_args_list[0] == mocker.call(
+        Bucket=BUCKET_NAME,
         Key=LOG_STREAM_NAME + '/build.log',
-        Body='foobarbazblah',
+        Body=b'foobar',
         ContentType="text/plain"
     )
 
 
+def test_copy_logs_error_index(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'COMPRESS_LOGS', True)
+    _mock_log_pages([['[Container] Entering phase BUILD\n', 'ok\n'], ['make: *** ERROR 2\n', 'FAILED\n']])
+    _mock_build_details('pr/123')
+
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    index_call = mock_s3.put_object.call_args_list[1]
+    assert index_call.kwargs['Key'] == LOG_STREAM_NAME + '/build.log.index.json'
+    assert json.loads(index_call.kwargs['Body'])['entries'] == [[1, 0, 'phase'], [3, 36, 'error'], [4, 54, 'failed']]
+    assert build_obj.first_failure == {'line': 3, 'offset': 36, 'class': 'error'}
+    assert build_obj.get_first_failure_url() == build_obj.get_logs_url() + '&range=36-'
+
+
+def test_copy_logs_render_html(mocker, mock_codebuild, mock_cw_logs, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'RENDER_HTML', True)
+    _mock_log_pages([['foo\n', 'bar\n']])
+    _mock_build_details('pr/123')
+
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    assert sorted(c.kwargs['Key'] for c in mock_s3.put_object.call_args_list) == [
+        LOG_STREAM_NAME + '/build.log',
+        LOG_STREAM_NAME + '/build.log.index.json',
+        LOG_STREAM_NAME + '/html/index.html',
+        LOG_STREAM_NAME + '/html/page-1.html',
+    ]
+
+
+def test_copy_logs_live(mocker, mock_codebuild, mock_bucket, mock_s3):
+    mocker.patch.object(build.config, 'LIVE_LOGS', True)
+    mocker.patch.object(build.config, 'RENDER_HTML', True)
+    mock_finish = mocker.patch.object(build.livelogs, 'finish')
+    mock_finish.return_value.first_failure.return_value = None
+    mock_finish.return_value.to_dict.return_value = {}
+    mock_s3.get_object.return_value['Body'].iter_chunks.return_value = [b'foo\n']
+    _mock_build_details('pr/123')
+
+    build_obj = build.Build(_mock_build_event())
+    build_obj.copy_logs()
+
+    mock_finish.assert_called_once_with(mock_bucket, BUILD_ID, LOG_STREAM_NAME + '/build.log',
+                                        build_obj._read_log_after, None, ContentType='text/plain')
+    mock_s3.get_object.assert_called_once_with(Bucket=BUCKET_NAME, Key=LOG_STREAM_NAME + '/build.log')
+    assert sorted(c.kwargs['Key'] for c in mock_s3.put_object.call_args_list) == [
+        LOG_STREAM_NAME + '/build.log.index.json',
+        LOG_STREAM_NAME + '/html/index.html',
+        LOG_STREAM_NAME + '/html/page-1.html',
+    ]
+
+
+def test_append_live_logs(mocker, mock_codebuild, mock_cw_logs, mock_bucket):
+    mock_append = mocker.patch.object(build.livelogs, 'append', return_value=True)
+    mock_cw_logs.get_log_events.side_effect = [
+        {'events': [{'message': 'foo\n'}], 'nextForwardToken': 'f/2'},
+        {'events': [], 'nextForwardToken': 'f/2'},
+    ]
+    build_event = _mock_build_event(additional_information=_mock_additional_information())
+    del build_event['detail']['build-status']
+
+    build_obj = build.Build(build_event)
+    assert build_obj.status == build.IN_PROGRESS
+    assert build_obj.append_live_logs() is True
+
+    mock_append.assert_called_once_with(mock_bucket, BUILD_ID, LOG_STREAM_NAME + '/build.log',
+                                        build_obj._read_log_after, None)
+    assert list(build_obj._read_log_after('f/1')) == [(b'foo\n', 'f/2'), (b'', 'f/2')]
+    assert build_obj.log_bytes == 4
+
+
+def test_append_live_logs_no_log_stream(mocker, mock_codebuild):
+    mock_append = mocker.patch.object(build.livelogs, 'append')
+    mock_codebuild.batch_get_builds.return_value = {'builds': [{'logs': {}}]}
+
+    build_obj = build.Build(_mock_build_event())
+
+    assert build_obj.append_live_logs() is False
+    mock_append.assert_not_called()
+
+
+def test_read_log_after_no_log_stream(mocker, mock_codebuild, mock_cw_logs):
+    mock_cw_logs.get_log_events.side_effect = botocore.exceptions.ClientError(
+        {'Error': {'Code': 'ResourceNotFoundException'}}, 'GetLogEvents')
+    _mock_build_details('pr/123')
+
+    build_obj = build.Build(_mock_build_event())
+
+    assert list(build_obj._read_log_after(None)) == []
+
+
+def test_get_first_failure_url_no_failure(mocker, mock_codebuild):
+    _mock_build_details('pr/123')
+    build_obj = build.Build(_mock_build_event())
+    assert build_obj.get_first_failure_url() is None
+
+
 def test_get_logs_url(mocker, mock_codebuild):
     _mock_build_details('pr/123')
     build_obj = build.Build(_mock_build_event())
     assert build_obj.get_logs_url() == test_constants.BUILD_LOGS_API_ENDPOINT + '?key=' + LOG_STREAM_NAME + '%2Fbuild.log'
 
 
-def _mock_build_event():
-    return {
+def test_load_build_details(mocker, mock_codebuild):
+    mocker.patch.object(build, 'MAX_BATCH_GET_BUILDS', 2)
+    builds = [build.Build(_mock_build_event(build_id)) for build_id in ['b1', 'b2', 'b2', 'missing']]
+    mock_codebuild.batch_get_builds.side_effect = [
+        {'builds': [{'id': 'b1'}, {'id': 'b2'}]},
+        {'builds': [{'id': 'b2'}], 'buildsNotFound': ['missing']},
+    ]
+
+    build.load_build_details(builds)
+
+    assert mock_codebuild.batch_get_builds.call_args_list == [
+        mocker.call(ids=['b1', 'b2']),
+        mocker.call(ids=['b2', 'missing']),
+    ]
+    assert [b._build_details['id'] for b in builds[:3]] == ['b1', 'b2', 'b2']
+    assert not hasattr(builds[3], '_build_details')
+
+
+def test_build_details_from_event(mocker, mock_codebuild):
+    build_obj = build.Build(_mock_build_event(additional_information=_mock_additional_information()))
+
+    assert build_obj.get_pr_id() == 123
+    assert build_obj.commit_id == 'abc123'
+    assert build_obj.get_logs_url() == test_constants.BUILD_LOGS_API_ENDPOINT + '?key=' + LOG_STREAM_NAME + '%2Fbuild.log'
+    mock_codebuild.batch_get_builds.assert_not_called()
+
+
+def test_build_details_missing_from_event(mocker, mock_codebuild):
+    additional_information = _mock_additional_information()
+    del additional_information['logs']
+    _mock_build_details('pr/456')
+    build_obj = build.Build(_mock_build_event(additional_information=additional_information))
+
+    assert build_obj.get_pr_id() == 123
+    assert build_obj.get_logs_url() == test_constants.BUILD_LOGS_API_ENDPOINT + '?key=' + LOG_STREAM_NAME + '%2Fbuild.log'
+    mock_codebuild.batch_get_builds.assert_called_once_with(ids=[BUILD_ID])
+
+
+def test_load_build_details_skips_builds_with_details_in_event(mocker, mock_codebuild):
+    builds = [
+        build.Build(_mock_build_event('b1', additional_information=_mock_additional_information())),
+        build.Build(_mock_build_event('b2')),
+    ]
+    mock_codebuild.batch_get_builds.return_value = {'builds': [{'id': 'b2'}]}
+
+    build.load_build_details(builds)
+
+    mock_codebuild.batch_get_builds.assert_called_once_with(ids=['b2'])
+    assert not hasattr(builds[0], '_build_details')
+    assert builds[1]._build_details == {'id': 'b2'}
+
+
+def test_load_build_details_skips_non_pr_builds(mocker, mock_codebuild):
+    builds = [build.Build(_mock_build_event(additional_information={'source-version': 'main'}))]
+
+    build.load_build_details(builds)
+
+    mock_codebuild.batch_get_builds.assert_not_called()
+    assert builds[0].is_pr_build() is False
+
+
+def _mock_build_event(build_id=BUILD_ID, additional_information=None):
+    build_event = {
         'detail': {
-            'build-id': BUILD_ID,
+            'build-id': build_id,
             'project-name': test_constants.PROJECT_NAME,
             'build-status': BUILD_STATUS
         }
     }
+    if additional_information:
+        build_event['detail']['additional-information'] = additional_information
+    return build_event
+
+
+def _mock_additional_information():
+    return {
+        'source-version': 'pr/123',
+        'resolved-source-version': 'abc123',
+        'logs': {
+            'group-name': LOG_GROUP_NAME,
+            'stream-name': LOG_STREAM_NAME,
+        },
+    }
 
 
 def _mock_build_details(source_version):
@@ -144,3 +393,14 @@ def _mock_build_details(source_version):
         build_details['builds'][0]['sourceVersion'] = source_version
 
     build.CODEBUILD.batch_get_builds.return_value = build_details
+
+
+def _mock_log_pages(pages):
+    responses = [
+        {
+            'events': [{'message': message} for message in messages],
+            'nextForwardToken': 'token-{}'.format(i + 1),
+        } for i, messages in enumerate(pages)
+    ]
+    responses.append({'events': [], 'nextForwardToken': 'token-{}'.format(len(pages))})
+    build.cwlogs.CW_LOGS.get_log_events.side_effect = responses
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import botocore
+import pytest
+
+import cwlogs
+
+LOG_GROUP_NAME = 'log-group'
+LOG_STREAM_NAME = 'log-stream'
+
+
+@pytest.fixture
+def mock_cw_logs(mocker):
+    mocker.patch.object(cwlogs, 'CW_LOGS')
+    return cwlogs.CW_LOGS
+
+
+def test_iter_log_events(mocker, mock_cw_logs):
+    mock_cw_logs.get_log_events.side_effect = [
+        {'events': [{'message': 'foo'}], 'nextForwardToken': 'f/1'},
+        {'events': [], 'nextForwardToken': 'f/2'},
+        {'events': [{'message': 'bar'}], 'nextForwardToken': 'f/3'},
+        {'events': [], 'nextForwardToken': 'f/3'},
+    ]
+
+    pages = list(cwlogs.iter_log_events(LOG_GROUP_NAME, LOG_STREAM_NAME))
+
+    assert pages == [[{'message': 'foo'}], [], [{'message': 'bar'}], []]
+    assert mock_cw_logs.get_log_events.call_args_list == [
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, nextToken='f/1'),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, nextToken='f/2'),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, nextToken='f/3'),
+    ]
+
+
+def test_iter_log_events_after(mocker, mock_cw_logs):
+    mock_cw_logs.get_log_events.side_effect = [
+        {'events': [{'message': 'foo'}], 'nextForwardToken': 'f/2'},
+        {'events': [], 'nextForwardToken': 'f/2'},
+    ]
+
+    pages = list(cwlogs.iter_log_events_after(LOG_GROUP_NAME, LOG_STREAM_NAME, 'f/1'))
+
+    assert pages == [([{'message': 'foo'}], 'f/2'), ([], 'f/2')]
+    assert mock_cw_logs.get_log_events.call_args_list == [
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, nextToken='f/1'),
+        mocker.call(logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, nextToken='f/2'),
+    ]
+
+
+def test_iter_log_events_time_range(mocker, mock_cw_logs):
+    mock_cw_logs.get_log_events.return_value = {'events': [], 'nextForwardToken': None}
+
+    list(cwlogs.iter_log_events(LOG_GROUP_NAME, LOG_STREAM_NAME, start_time=1000, end_time=2000))
+
+    mock_cw_logs.get_log_events.assert_called_once_with(
+        logGroupName=LOG_GROUP_NAME, logStreamName=LOG_STREAM_NAME, startFromHead=True, startTime=1000, endTime=2000)
+
+
+def test_iter_log_events_parallel(mocker):
+    fake_logs = FakeLogsClient(timestamps=range(-500, 10500, 10), page_size=7)
+    mocker.patch.object(cwlogs, 'CW_LOGS', fake_logs)
+
+    pages = cwlogs.iter_log_events_parallel(LOG_GROUP_NAME, LOG_STREAM_NAME, 0, 10000, concurrency=3,
+                                            window_seconds=1)
+    messages = [event['message'] for events in pages for event in events]
+
+    assert messages == [str(timestamp) for timestamp in range(-500, 10500, 10)]
+    assert set(fake_logs.windows) == {(None, 1000), (9000, None)} | {(t, t + 1000) for t in range(1000, 9000, 1000)}
+    assert len(fake_logs.windows) == 10
+    assert 1 < fake_logs.max_concurrent_calls <= 3
+
+
+def test_iter_log_events_parallel_short_build(mocker):
+    fake_logs = FakeLogsClient(timestamps=range(0, 100), page_size=30)
+    mocker.patch.object(cwlogs, 'CW_LOGS', fake_logs)
+
+    pages = cwlogs.iter_log_events_parallel(LOG_GROUP_NAME, LOG_STREAM_NAME, 0, 100, concurrency=3,
+                                            window_seconds=60)
+
+    assert [event['message'] for events in pages for event in events] == [str(t) for t in range(0, 100)]
+    assert fake_logs.windows == [(None, None)]
+
+
+def test_get_log_events_throttled(mocker, mock_cw_logs):
+    mock_sleep = mocker.patch.object(cwlogs.time, 'sleep')
+    response = {'events': [], 'nextForwardToken': 'f/1'}
+    mock_cw_logs.get_log_events.side_effect = [_client_error('ThrottlingException')] * 2 + [response]
+
+    assert cwlogs._get_log_events(logGroupName=LOG_GROUP_NAME) == response
+
+    assert mock_cw_logs.get_log_events.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+def test_get_log_events_throttled_too_often(mocker, mock_cw_logs):
+    mocker.patch.object(cwlogs.time, 'sleep')
+    mock_cw_logs.get_log_events.side_effect = _client_error('ThrottlingException')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        cwlogs._get_log_events(logGroupName=LOG_GROUP_NAME)
+
+    assert mock_cw_logs.get_log_events.call_count == cwlogs.MAX_THROTTLE_RETRIES + 1
+
+
+def test_get_log_events_other_error(mocker, mock_cw_logs):
+    mock_sleep = mocker.patch.object(cwlogs.time, 'sleep')
+    mock_cw_logs.get_log_events.side_effect = _client_error('ResourceNotFoundException')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        cwlogs._get_log_events(logGroupName=LOG_GROUP_NAME)
+
+    mock_sleep.assert_not_called()
+
+
+def _client_error(code):
+    return botocore.exceptions.ClientError({'Error': {'Code': code}}, 'GetLogEvents')
+
+
+class FakeLogsClient:
+
+    def __init__(self, timestamps, page_size):
+        self.events = [{'timestamp': t, 'message': str(t)} for t in timestamps]
+        self.page_size = page_size
+        self.windows = []
+        self.max_concurrent_calls = 0
+        self._concurrent_calls = 0
+        self._lock = threading.Lock()
+
+    def get_log_events(self, logGroupName, logStreamName, startFromHead, startTime=None, endTime=None,
+                       nextToken=None):
+        with self._lock:
+            self._concurrent_calls += 1
+            self.max_concurrent_calls = max(self.max_concurrent_calls, self._concurrent_calls)
+            if nextToken is None:
+                self.windows.append((startTime, endTime))
+        time.sleep(0.001)
+
+        in_window = [event for event in self.events
+                     if (startTime is None or event['timestamp'] >= startTime) and
+                     (endTime is None or event['timestamp'] < endTime)]
+        first = int(nextToken) if nextToken else 0
+        page = in_window[first:first + self.page_size]
+
+        with self._lock:
+            self._concurrent_calls -= 1
+        return {'events': page, 'nextForwardToken': str(first + len(page))}
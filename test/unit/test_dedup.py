@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta, timezone
+import gzip
+import json
+import random
+
+import pytest
+
+import dedup
+from fake_s3 import FakeBucket, FakeS3
+import test_constants
+
+LOG_KEY = 'stream/build.log'
+
+
+@pytest.fixture
+def small_chunks(mocker):
+    mocker.patch.object(dedup, 'MIN_CHUNK_SIZE', 1000)
+    mocker.patch.object(dedup, 'MAX_CHUNK_SIZE', 10000)
+    mocker.patch.object(dedup, 'BOUNDARY_BITS', 4)
+    mocker.patch.object(dedup, 'BOUNDARY_MASK', 15)
+
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def bucket(fake_s3):
+    return FakeBucket(fake_s3, test_constants.BUCKET_NAME)
+
+
+def test_iter_chunks(small_chunks):
+    log = _log(1000)
+    # boundaries don't depend on how the log is split into pages
+    pages = [log[i:i + 777] for i in range(0, len(log), 777)]
+
+    chunks = list(dedup.iter_chunks(pages))
+
+    assert b''.join(chunks) == log
+    assert len(chunks) > 5
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert all(len(chunk) >= dedup.MIN_CHUNK_SIZE for chunk in chunks[:-1])
+    assert chunks == list(dedup.iter_chunks([log]))
+
+
+def test_iter_chunks_resynchronize(small_chunks):
+    lines = _log(1000).splitlines(keepends=True)
+    changed = lines[:300] + [b'a line that was changed\n', b'and one that was added\n'] + lines[301:]
+
+    chunks = list(dedup.iter_chunks([b''.join(lines)]))
+    changed_chunks = list(dedup.iter_chunks([b''.join(changed)]))
+
+    # only the chunks around the change differ
+    assert len(set(changed_chunks) - set(chunks)) <= 2
+
+
+def test_iter_chunks_long_line(small_chunks):
+    log = b'x' * 25000 + b'\nend\n'
+
+    chunks = list(dedup.iter_chunks([log[:12000], log[12000:]]))
+
+    assert b''.join(chunks) == log
+    assert max(len(chunk) for chunk in chunks) == dedup.MAX_CHUNK_SIZE
+
+
+def test_iter_chunks_empty():
+    assert list(dedup.iter_chunks([])) == []
+
+
+def test_upload(small_chunks, fake_s3, bucket):
+    log = _log(1000)
+
+    bytes_written = dedup.upload(bucket, LOG_KEY, 'commit', iter([log]))
+
+    manifest = _manifest(fake_s3)
+    assert manifest['version'] == dedup.MANIFEST_VERSION
+    assert manifest['size'] == len(log)
+    assert manifest['content_encoding'] is None
+    assert b''.join(_object(fake_s3, chunk['key']) for chunk in manifest['chunks']) == log
+    assert all(chunk['key'].startswith('chunks/commit/') for chunk in manifest['chunks'])
+    assert bytes_written == len(log)
+
+
+def test_upload_retry(small_chunks, fake_s3, bucket):
+    log = _log(1000)
+    lines = log.splitlines(keepends=True)
+    retried_log = b''.join(lines[:500] + [b'a line that only the retry logged\n'] + lines[500:])
+    dedup.upload(bucket, LOG_KEY, 'commit', [log])
+    put_count = fake_s3.put_count
+
+    bytes_written = dedup.upload(bucket, 'retry/build.log', 'commit', [retried_log])
+
+    assert bytes_written < len(retried_log) / 4
+    manifest = json.loads(_object(fake_s3, 'retry/build.log' + dedup.MANIFEST_SUFFIX))
+    assert b''.join(_object(fake_s3, chunk['key']) for chunk in manifest['chunks']) == retried_log
+    # only the changed chunks and the manifest are stored
+    assert fake_s3.put_count - put_count <= 3
+
+
+def test_upload_other_scope(small_chunks, fake_s3, bucket):
+    log = _log(100)
+    dedup.upload(bucket, LOG_KEY, 'commit', [log])
+
+    assert dedup.upload(bucket, 'other/build.log', 'other-commit', [log]) == len(log)
+
+
+def test_upload_compressed(small_chunks, fake_s3, bucket):
+    log = _log(1000)
+
+    bytes_written = dedup.upload(bucket, LOG_KEY, 'commit', [log], compress=True)
+
+    manifest = _manifest(fake_s3)
+    assert manifest['content_encoding'] == 'gzip'
+    chunks = [_object(fake_s3, chunk['key']) for chunk in manifest['chunks']]
+    # the chunks also make up a gzip stream of the whole log
+    assert gzip.decompress(b''.join(chunks)) == log
+    assert bytes_written == sum(len(chunk) for chunk in chunks)
+    assert fake_s3.metadata[(test_constants.BUCKET_NAME, manifest['chunks'][0]['key'])] == {
+        'ContentType': 'text/plain', 'ContentEncoding': 'gzip'}
+
+
+def test_upload_renews_old_chunks(small_chunks, fake_s3, bucket):
+    log = _log(100)
+    dedup.upload(bucket, LOG_KEY, 'commit', [log])
+    key = _manifest(fake_s3)['chunks'][0]['key']
+    chunk = _object(fake_s3, key)
+    fake_s3.last_modified[(test_constants.BUCKET_NAME, key)] = datetime.now(timezone.utc) - timedelta(days=1)
+
+    assert dedup.upload(bucket, 'retry/build.log', 'commit', [log]) == 0
+
+    assert fake_s3.last_modified[(test_constants.BUCKET_NAME, key)].date() == datetime.now(timezone.utc).date()
+    assert fake_s3.metadata[(test_constants.BUCKET_NAME, key)] == {'ContentType': 'text/plain'}
+    assert _object(fake_s3, key) == chunk
+
+
+def _log(num_lines):
+    # like build logs, lines differ in timestamps and durations
+    rng = random.Random(num_lines)
+    return ''.join('[{:06d}] step {} took {} ms\n'.format(i, i % 17, rng.randint(1, 999))
+                   for i in range(num_lines)).encode('utf-8')
+
+
+def _manifest(fake_s3):
+    return json.loads(_object(fake_s3, LOG_KEY + dedup.MANIFEST_SUFFIX))
+
+
+def _object(fake_s3, key):
+    return fake_s3.objects[(test_constants.BUCKET_NAME, key)][0]
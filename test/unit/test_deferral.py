@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import deferral
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/deferred-work'
+FIRST_FAILURE = {'line': 3, 'offset': 42, 'class': 'error'}
+
+
+@pytest.fixture
+def mock_sqs(mocker):
+    mocker.patch.object(deferral.config, 'DEFERRED_WORK_QUEUE_URL', QUEUE_URL)
+    return mocker.patch.object(deferral, 'SQS')
+
+
+def test_is_enabled(mocker):
+    mocker.patch.object(deferral.config, 'DEFERRED_WORK_QUEUE_URL', None)
+    assert not deferral.is_enabled()
+
+    mocker.patch.object(deferral.config, 'DEFERRED_WORK_QUEUE_URL', QUEUE_URL)
+    assert deferral.is_enabled()
+
+
+def test_defer_and_load(mock_sqs):
+    build = deferral.Build(_mock_build_event())
+    build.first_failure = FIRST_FAILURE
+
+    deferral.defer(build, [deferral.DELETE_PREVIOUS_COMMENTS, deferral.PUBLISH_COMMENT], delay_seconds=120.5)
+
+    mock_sqs.send_message.assert_called_once()
+    kwargs = mock_sqs.send_message.call_args.kwargs
+    assert kwargs['QueueUrl'] == QUEUE_URL
+    assert kwargs['DelaySeconds'] == 120
+
+    message = json.loads(kwargs['MessageBody'])
+    assert deferral.is_deferred(message)
+    loaded_build, tasks, comment_id = deferral.load(message)
+    assert loaded_build.id == build.id
+    assert loaded_build.get_pr_id() == 1
+    assert loaded_build.first_failure == FIRST_FAILURE
+    # the build's own comment is published before previous ones are deleted
+    assert tasks == [deferral.PUBLISH_COMMENT, deferral.DELETE_PREVIOUS_COMMENTS]
+    assert comment_id is None
+
+
+@pytest.mark.parametrize('delay_seconds, expected_delay_seconds', [
+    (0, deferral.MIN_DELAY_SECONDS),
+    (3600, deferral.MAX_DELAY_SECONDS),
+])
+def test_defer_delay(mock_sqs, delay_seconds, expected_delay_seconds):
+    deferral.defer(deferral.Build(_mock_build_event()), [deferral.UPDATE_COMMENT], 42, delay_seconds)
+
+    kwargs = mock_sqs.send_message.call_args.kwargs
+    assert kwargs['DelaySeconds'] == expected_delay_seconds
+    assert json.loads(kwargs['MessageBody'])['deferred']['comment_id'] == 42
+
+
+def test_is_deferred():
+    assert not deferral.is_deferred(_mock_build_event())
+
+
+def _mock_build_event():
+    return {
+        'detail': {
+            'build-id': 'arn:aws:codebuild:us-east-1:123456789012:build/project:build-1',
+            'project-name': 'project',
+            'build-status': 'FAILED',
+            'additional-information': {
+                'source-version': 'pr/1',
+                'resolved-source-version': 'da39a3ee5e6b4b0d3255bfef95601890afd80709',
+                'logs': {'group-name': 'log-group', 'stream-name': 'build-1'},
+            },
+        }
+    }
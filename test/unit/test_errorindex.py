@@ -0,0 +1,106 @@
+import json
+
+import errorindex
+
+LOG = (b'[Container] 2020/01/01 00:00:00 Entering phase BUILD\n'
+       b'compiling\n'
+       b'ERROR: compilation failed with ERROR\n'
+       b'Traceback (most recent call last):\n'
+       b'  File "build.py", line 1\n'
+       b'1 FAILED, 2 passed\n'
+       b'[Container] 2020/01/01 00:00:01 Phase complete: BUILD State: FAILED')
+
+
+def test_scan():
+    indexer = errorindex.ErrorIndexer()
+    indexer.scan(LOG)
+    indexer.finish()
+
+    assert indexer.entries == [
+        {'line': 1, 'offset': 0, 'class': 'phase'},
+        {'line': 3, 'offset': LOG.index(b'ERROR'), 'class': 'error'},
+        {'line': 4, 'offset': LOG.index(b'Traceback'), 'class': 'traceback'},
+        {'line': 6, 'offset': LOG.index(b'1 FAILED'), 'class': 'failed'},
+        {'line': 7, 'offset': LOG.rindex(b'[Container]'), 'class': 'command_failed'},
+    ]
+    assert indexer.first_failure() == {'line': 3, 'offset': LOG.index(b'ERROR'), 'class': 'error'}
+
+
+def test_scan_codebuild_command_failure():
+    # a build whose npm test command exited with 1, as logged by CodeBuild
+    log = (b'[Container] 2024/05/01 12:00:00.000001 Entering phase BUILD\n'
+           b'[Container] 2024/05/01 12:00:00.000002 Running command npm test\n'
+           b'\n'
+           b'> app@1.0.0 test\n'
+           b'> jest\n'
+           b'\n'
+           b'[Container] 2024/05/01 12:00:09.000003 Command did not exit successfully npm test exit status 1\n'
+           b'[Container] 2024/05/01 12:00:09.000004 Phase complete: BUILD State: FAILED\n'
+           b'[Container] 2024/05/01 12:00:09.000005 Phase context status code: COMMAND_EXECUTION_ERROR '
+           b'Message: Error while executing command: npm test. Reason: exit status 1\n'
+           b'[Container] 2024/05/01 12:00:09.000006 Entering phase POST_BUILD\n')
+    indexer = errorindex.ErrorIndexer()
+    indexer.scan(log)
+    indexer.finish()
+
+    assert [entry['class'] for entry in indexer.entries] == [
+        'phase', 'command_failed', 'command_failed', 'command_failed', 'phase']
+    assert indexer.first_failure() == {
+        'line': 7, 'offset': log.index(b'[Container] 2024/05/01 12:00:09.000003'), 'class': 'command_failed'}
+
+
+def test_tap_chunks_split_lines():
+    expected = errorindex.ErrorIndexer()
+    expected.scan(LOG)
+    expected.finish()
+
+    indexer = errorindex.ErrorIndexer()
+    chunks = [LOG[i:i + 7] for i in range(0, len(LOG), 7)]
+    assert b''.join(indexer.tap(iter(chunks))) == LOG
+
+    assert indexer.entries == expected.entries
+
+
+def test_resume_from_state():
+    expected = errorindex.ErrorIndexer()
+    expected.scan(LOG)
+    expected.finish()
+
+    split = LOG.index(b'Traceback') + 5
+    indexer = errorindex.ErrorIndexer()
+    indexer.scan(LOG[:split])
+    state = json.loads(json.dumps(indexer.get_state()))
+    indexer = errorindex.ErrorIndexer.from_state(state)
+    indexer.scan(LOG[split:])
+    indexer.finish()
+
+    assert indexer.entries == expected.entries
+    assert errorindex.ErrorIndexer.from_state(None).entries == []
+
+
+def test_custom_patterns():
+    indexer = errorindex.ErrorIndexer({'warning': r'^WARN'})
+    indexer.scan(b'ok\nWARN: deprecated\nERROR\n')
+    indexer.finish()
+
+    assert indexer.to_dict() == {'classes': ['warning'], 'entries': [[2, 3, 'warning']], 'truncated': False}
+    assert indexer.first_failure() == {'line': 2, 'offset': 3, 'class': 'warning'}
+
+
+def test_no_failure():
+    indexer = errorindex.ErrorIndexer()
+    indexer.scan(b'[Container] 2020/01/01 00:00:00 Entering phase BUILD\nall good\n')
+    indexer.finish()
+
+    assert indexer.first_failure() is None
+
+
+def test_truncated(mocker):
+    mocker.patch.object(errorindex, 'MAX_ENTRIES', 2)
+    indexer = errorindex.ErrorIndexer()
+    indexer.scan(b'ERROR\nERROR\nERROR\n')
+    indexer.scan(b'ERROR\n')
+    indexer.finish()
+
+    assert [entry['line'] for entry in indexer.entries] == [1, 2]
+    assert indexer.truncated
@@ -3,14 +3,32 @@ import json
 
 import getbuildlogs
 import test_constants
+from ttlcache import TTLCache
+
+
+@pytest.fixture(autouse=True)
+def features(mocker):
+    mocker.patch.object(getbuildlogs.config, 'RENDER_HTML', True)
+    mocker.patch.object(getbuildlogs.config, 'LIVE_LOGS', True)
+    mocker.patch.object(getbuildlogs.config, 'DEDUPLICATE_LOGS', True)
 
 
 @pytest.fixture
 def mock_s3link(mocker):
     mocker.patch.object(getbuildlogs, 's3link')
+    getbuildlogs.s3link.URL_CACHE = TTLCache(ttl=300)
+    getbuildlogs.s3link.NOT_FOUND_CACHE_TTL_SECONDS = 30
     return getbuildlogs.s3link
 
 
+@pytest.fixture
+def mock_s3read(mocker):
+    mocker.patch.object(getbuildlogs, 's3read')
+    getbuildlogs.s3read.MAX_READ_BYTES = 1000
+    getbuildlogs.s3read.read_manifest.return_value = None
+    return getbuildlogs.s3read
+
+
 def test_handler_no_log_key(mock_s3link):
     api_event = _mock_api_event()
     response = getbuildlogs.handler(api_event, None)
@@ -42,7 +60,7 @@ def test_handler_log_key_no_exist(mock_s3link):
 
 
 def test_handler_happycase(mock_s3link):
-    mock_s3link.get_presigned_url.return_value = 'url'
+    mock_s3link.get_presigned_url.side_effect = lambda key: 'url' if key == 'foo/build.log' else None
 
     api_event = _mock_api_event({'key': 'foo%2Fbuild.log'})
     response = getbuildlogs.handler(api_event, None)
@@ -58,6 +76,254 @@ def test_handler_happycase(mock_s3link):
     mock_s3link.get_presigned_url.assert_called_with('foo/build.log')
 
 
+def test_handler_html_index(mock_s3link):
+    mock_s3link.get_presigned_url.side_effect = lambda key: 'html-url' if key == 'foo/html/index.html' else 'url'
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)
+
+    assert response['statusCode'] == 307
+    assert response['headers'] == {'Location': 'html-url'}
+    mock_s3link.get_presigned_url.assert_called_once_with('foo/html/index.html')
+
+
+def test_handler_html_index_raw(mock_s3link):
+    mock_s3link.get_presigned_url.return_value = 'url'
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'raw': 'true'}), None)
+
+    assert response['headers'] == {'Location': 'url'}
+    mock_s3link.get_presigned_url.assert_called_once_with('foo/build.log')
+
+
+def test_handler_live_log(mock_s3link, mock_s3read):
+    mock_s3link.get_presigned_url.side_effect = lambda key: 'live-url' if key == 'foo/live.log' else None
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)
+
+    assert response['headers'] == {'Location': 'live-url'}
+    mock_s3link.get_presigned_url.assert_called_with('foo/live.log')
+
+
+def test_handler_features_disabled(mocker, mock_s3link, mock_s3read):
+    mocker.patch.object(getbuildlogs.config, 'RENDER_HTML', False)
+    mocker.patch.object(getbuildlogs.config, 'LIVE_LOGS', False)
+    mocker.patch.object(getbuildlogs.config, 'DEDUPLICATE_LOGS', False)
+    mock_s3link.get_presigned_url.return_value = None
+    mock_s3read.read_tail.return_value = None
+
+    assert getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)['statusCode'] == 404
+    assert getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'tail': '1'}), None)['statusCode'] == 404
+
+    # only the plain log can exist
+    mock_s3link.get_presigned_url.assert_called_once_with('foo/build.log')
+    mock_s3read.read_tail.assert_called_once_with('foo/build.log', 1)
+    mock_s3read.read_manifest.assert_not_called()
+
+
+def test_handler_chunked_log(mock_s3link, mock_s3read):
+    mock_s3link.get_presigned_url.return_value = None
+    mock_s3read.read_manifest.return_value = _mock_manifest(size=12)
+    mock_s3read.read_chunked_range.return_value = ('chunked\nlog\n', 0, 11, 12)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)
+
+    assert response == {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/plain; charset=utf-8'
+        },
+        'body': 'chunked\nlog\n'
+    }
+    mock_s3read.read_manifest.assert_called_once_with('foo/build.log')
+    mock_s3read.read_chunked_range.assert_called_once_with(mock_s3read.read_manifest.return_value, 0)
+
+
+def test_handler_chunked_log_manifest_cached(mock_s3link, mock_s3read):
+    mock_s3link.get_presigned_url.return_value = None
+    mock_s3read.read_manifest.return_value = _mock_manifest(size=12)
+    mock_s3read.read_chunked_range.return_value = ('chunked\nlog\n', 0, 11, 12)
+
+    for _ in range(2):
+        assert getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)['statusCode'] == 200
+
+    mock_s3read.read_manifest.assert_called_once_with('foo/build.log')
+
+
+def test_handler_missing_manifest_cached(mock_s3link, mock_s3read):
+    mock_s3link.get_presigned_url.return_value = None
+
+    for _ in range(2):
+        assert getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)['statusCode'] == 404
+
+    mock_s3read.read_manifest.assert_called_once_with('foo/build.log')
+
+
+def test_handler_chunked_log_viewer(mock_s3link, mock_s3read):
+    mock_s3link.get_presigned_url.return_value = None
+    mock_s3link.get_presigned_urls.return_value = ['https://chunk-1', 'https://chunk-2']
+    mock_s3read.read_manifest.return_value = _mock_manifest(size=2000)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log'}), None)
+
+    assert response['statusCode'] == 200
+    assert response['headers'] == {'Content-Type': 'text/html; charset=utf-8'}
+    assert '"https://chunk-1", "https://chunk-2"' in response['body']
+    mock_s3link.get_presigned_urls.assert_called_once_with(['chunks/commit/1', 'chunks/commit/2'])
+    mock_s3read.read_chunked_range.assert_not_called()
+
+
+def test_handler_cache_metrics(mock_s3link, capsys):
+    def get_presigned_url(key):
+        return mock_s3link.URL_CACHE.get(key)
+    mock_s3link.URL_CACHE.put('foo/build.log', 'url')
+    mock_s3link.get_presigned_url.side_effect = get_presigned_url
+
+    getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'raw': 'true'}), None)
+
+    emf = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert emf['PresignedUrlCacheHits'] == 1
+    assert emf['PresignedUrlCacheMisses'] == 0
+
+
+def test_handler_no_query_parameters(mock_s3link):
+    response = getbuildlogs.handler({'queryStringParameters': None}, None)
+    assert response['statusCode'] == 400
+
+
+def test_handler_tail(mock_s3link, mock_s3read):
+    mock_s3read.read_tail.return_value = 'last\nlines\n'
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'tail': '2'}), None)
+
+    assert response == {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/plain; charset=utf-8'
+        },
+        'body': 'last\nlines\n'
+    }
+    mock_s3read.read_tail.assert_called_once_with('foo/build.log', 2)
+    mock_s3link.get_presigned_url.assert_not_called()
+
+
+@pytest.mark.parametrize('tail', ['', 'abc', '0', '-1', str(getbuildlogs.MAX_TAIL_LINES + 1)])
+def test_handler_tail_invalid(mock_s3link, mock_s3read, tail):
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'tail': tail}), None)
+
+    assert response['statusCode'] == 400
+    mock_s3read.read_tail.assert_not_called()
+
+
+def test_handler_tail_not_found(mock_s3link, mock_s3read):
+    mock_s3read.read_tail.return_value = None
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'tail': '10'}), None)
+
+    assert response['statusCode'] == 404
+
+
+def test_handler_tail_live_log(mock_s3link, mock_s3read):
+    mock_s3read.read_tail.side_effect = lambda key, num_lines: 'live\n' if key == 'foo/live.log' else None
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'tail': '1'}), None)
+
+    assert response['body'] == 'live\n'
+
+
+def test_handler_tail_chunked_log(mock_s3link, mock_s3read):
+    mock_s3read.read_tail.return_value = None
+    mock_s3read.read_manifest.return_value = _mock_manifest(size=12)
+    mock_s3read.read_chunked_tail.return_value = 'log\n'
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'tail': '1'}), None)
+
+    assert response['body'] == 'log\n'
+    mock_s3read.read_chunked_tail.assert_called_once_with(mock_s3read.read_manifest.return_value, 1)
+
+
+def test_handler_range(mock_s3link, mock_s3read):
+    mock_s3read.read_range.return_value = ('content', 10, 16, 100)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'range': '10-16'}), None)
+
+    assert response == {
+        'statusCode': 206,
+        'headers': {
+            'Content-Range': 'bytes 10-16/100',
+            'Content-Type': 'text/plain; charset=utf-8'
+        },
+        'body': 'content'
+    }
+    mock_s3read.read_range.assert_called_once_with('foo/build.log', 10, 16)
+
+
+def test_handler_range_open_ended_unknown_size(mock_s3link, mock_s3read):
+    mock_s3read.read_range.return_value = ('content', 10, 16, None)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'range': '10-'}), None)
+
+    assert response['headers']['Content-Range'] == 'bytes 10-16/*'
+    mock_s3read.read_range.assert_called_once_with('foo', 10, None)
+
+
+def test_handler_range_not_satisfiable(mock_s3link, mock_s3read):
+    mock_s3read.read_range.return_value = ('', 200, 99, 100)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'range': '200-'}), None)
+
+    assert response['statusCode'] == 416
+    assert response['headers'] == {'Content-Range': 'bytes */100'}
+
+
+@pytest.mark.parametrize('byte_range', ['', 'abc', '-10', '10-5', '1-2-3'])
+def test_handler_range_invalid(mock_s3link, mock_s3read, byte_range):
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'range': byte_range}), None)
+
+    assert response['statusCode'] == 400
+    mock_s3read.read_range.assert_not_called()
+
+
+def test_handler_range_not_found(mock_s3link, mock_s3read):
+    mock_s3read.read_range.return_value = None
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo', 'range': '0-10'}), None)
+
+    assert response['statusCode'] == 404
+
+
+def test_handler_range_live_log(mocker, mock_s3link, mock_s3read):
+    mock_s3read.read_range.side_effect = [None, ('live', 0, 3, 4)]
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'range': '0-'}), None)
+
+    assert response['statusCode'] == 206
+    assert mock_s3read.read_range.call_args_list == [
+        mocker.call('foo/build.log', 0, None),
+        mocker.call('foo/live.log', 0, None),
+    ]
+
+
+def test_handler_range_chunked_log(mock_s3link, mock_s3read):
+    mock_s3read.read_range.return_value = None
+    mock_s3read.read_manifest.return_value = _mock_manifest(size=12)
+    mock_s3read.read_chunked_range.return_value = ('log', 8, 10, 12)
+
+    response = getbuildlogs.handler(_mock_api_event({'key': 'foo%2Fbuild.log', 'range': '8-10'}), None)
+
+    assert response['statusCode'] == 206
+    assert response['headers']['Content-Range'] == 'bytes 8-10/12'
+    mock_s3read.read_chunked_range.assert_called_once_with(mock_s3read.read_manifest.return_value, 8, 10)
+
+
+def _mock_manifest(size):
+    return {
+        'version': 1,
+        'size': size,
+        'content_encoding': None,
+        'chunks': [{'key': 'chunks/commit/1', 'size': size // 2}, {'key': 'chunks/commit/2', 'size': size - size // 2}],
+    }
+
+
 def _mock_api_event(query_parameters={}):
     return {
         'queryStringParameters': query_parameters
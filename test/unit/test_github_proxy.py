@@ -1,8 +1,17 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+import time
+
+import github
 import pytest
 from unittest.mock import MagicMock
 
+from fake_s3 import FakeS3
 import github_proxy
+import ratelimit
 import test_constants
+import ttlcache
 
 GITHUB_OWNER = 'gh-user'
 GITHUB_REPO = 'gh-repo'
@@ -13,6 +22,8 @@ BUILD_STATUS = 'SUCCEEDED'
 PR_ID = 5
 COMMIT_ID = 'da39a3ee5e6b4b0d3255bfef95601890afd80709'
 LOGS_URL = 'https://foo.com'
+COMMENT_ID = 1234
+STICKY_STATE_KEY = 'pr/{}/sticky-comment.json'.format(PR_ID)
 
 
 @pytest.fixture
@@ -21,11 +32,21 @@ def mock_config(mocker):
     github_proxy.config.configure_mock(
         PROJECT_NAME=test_constants.PROJECT_NAME,
         EXPIRATION_IN_DAYS=test_constants.EXPIRATION_IN_DAYS,
-        GITHUB_OAUTH_TOKEN_SECRET_ARN=''
+        GITHUB_OAUTH_TOKEN_SECRET_ARN='',
+        GITHUB_CACHE_TTL_SECONDS=60,
+        GITHUB_MAX_CONCURRENT_REQUESTS=4,
+        GITHUB_RATE_LIMIT_RESERVE=500,
+        COMMENT_MODE='new',
+        LIVE_LOGS=False
     )
     return github_proxy.config
 
 
+@pytest.fixture(autouse=True)
+def fake_rate_limit_state(mocker):
+    mocker.patch.object(ratelimit.bucketstate, 'S3', FakeS3())
+
+
 @pytest.fixture
 def mock_codebuild(mocker):
     mocker.patch.object(github_proxy, 'CODEBUILD')
@@ -58,64 +79,567 @@ def mock_secretsmanager(mocker):
 @pytest.fixture
 def mock_github(mocker):
     mocker.patch.object(github_proxy, 'Github')
+    github_proxy.Github.return_value.requester.requestJsonAndCheck.return_value = ({}, {'id': COMMENT_ID})
     return github_proxy.Github.return_value
 
+@pytest.fixture
+def mock_bucketstate(mocker):
+    mocker.patch.object(github_proxy, 'bucketstate')
+    github_proxy.bucketstate.get.return_value = None
+    return github_proxy.bucketstate
+
+
 @pytest.fixture
 def mock_log(mocker):
     mocker.patch.object(github_proxy, 'LOG')
     return github_proxy.LOG
 
 def test_publish_pr_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
-    build = MagicMock(status=BUILD_STATUS)
-    build.get_logs_url.return_value = LOGS_URL
-    build.get_pr_id.return_value = PR_ID
-    build.commit_id = COMMIT_ID
+    build = _mock_build()
 
     proxy = github_proxy.GithubProxy()
-    proxy.publish_pr_comment(build)
+    assert proxy.publish_pr_comment(build) == COMMENT_ID
 
     mock_codebuild.batch_get_projects.assert_called_once_with(
         names=[test_constants.PROJECT_NAME]
     )
     mock_secretsmanager.get_secret_value.assert_not_called()
-    github_proxy.Github.assert_called_once_with(CODEBUILD_GITHUB_TOKEN)
+    github_proxy.Github.assert_called_once_with(
+        CODEBUILD_GITHUB_TOKEN, base_url=mock_config.GITHUB_API_URL, pool_size=4, retry=mocker.ANY,
+        seconds_between_requests=None, seconds_between_writes=None)
+    retry = github_proxy.Github.call_args.kwargs['retry']
+    assert sorted(retry.status_forcelist) == [403, 429, 500, 502, 503, 504]
+    assert 'PATCH' in retry.allowed_methods
+
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'POST', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID),
+        input={'body': _expected_comment()}
+    )
+    mock_github.get_user.assert_not_called()
+    assert proxy.pop_request_count(build) == 1
+    assert proxy.pop_request_count(build) == 0
 
-    mock_github.get_user.assert_called_once_with(GITHUB_OWNER)
-    mock_github.get_user.return_value.get_repo.assert_called_once_with(GITHUB_REPO)
-    mock_repo = mock_github.get_user.return_value.get_repo.return_value
-    mock_repo.get_pull.assert_called_once_with(PR_ID)
-    mock_pr = mock_repo.get_pull.return_value
 
-    expected_comment = github_proxy.PR_COMMENT_TEMPLATE.format(
-        project_name=test_constants.PROJECT_NAME,
-        commit_id=COMMIT_ID,
-        build_status=BUILD_STATUS,
-        logs_url=LOGS_URL,
+@pytest.fixture
+def fake_bucketstate(mocker):
+    mocker.patch.object(github_proxy.bucketstate, 'S3', FakeS3())
+    return github_proxy.bucketstate
+
+
+def test_publish_sticky_comment_known_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                              mock_github, fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    fake_bucketstate.put(STICKY_STATE_KEY, {'comment_id': 42})
+    requester = _mock_requester(mock_github, [])
+    build = _mock_build()
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(build) == 42
+
+    assert requester.requests == [
+        ('PATCH', '/repos/{}/{}/issues/comments/42'.format(GITHUB_OWNER, GITHUB_REPO),
+         {'input': {'body': _expected_comment()}}),
+    ]
+    assert fake_bucketstate.S3.put_count == 1
+
+
+def test_publish_sticky_comment_find_previous(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                                              fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    requester = _mock_requester(mock_github, [
+        {'id': 1, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 2, 'body': 'foo'},
+        {'id': 3, 'body': github_proxy.HIDDEN_COMMENT},
+    ])
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == 3
+
+    assert [(verb, url) for verb, url, _ in requester.requests] == [
+        ('GET', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID)),
+        ('PATCH', '/repos/{}/{}/issues/comments/3'.format(GITHUB_OWNER, GITHUB_REPO)),
+    ]
+    assert fake_bucketstate.get(STICKY_STATE_KEY) == {'comment_id': 3}
+
+
+def test_publish_sticky_comment_first_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                                              fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    requester = _mock_requester(mock_github, [{'id': 1, 'body': 'foo'}])
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == FakeRequester.CREATED_COMMENT_ID
+
+    assert [(verb, url) for verb, url, _ in requester.requests] == [
+        ('GET', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID)),
+        ('POST', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID)),
+    ]
+    assert fake_bucketstate.get(STICKY_STATE_KEY) == {'comment_id': FakeRequester.CREATED_COMMENT_ID}
+
+
+def test_publish_sticky_comment_deleted(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                                        fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    fake_bucketstate.put(STICKY_STATE_KEY, {'comment_id': 42})
+    requester = _mock_requester(mock_github, [])
+    requester.missing_comments = {42}
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == FakeRequester.CREATED_COMMENT_ID
+
+    assert [verb for verb, _, _ in requester.requests] == ['PATCH', 'POST']
+    assert fake_bucketstate.get(STICKY_STATE_KEY) == {'comment_id': FakeRequester.CREATED_COMMENT_ID}
+
+
+def test_publish_sticky_comment_concurrent_first_comments(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                          mock_github, fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    requester = _mock_requester(mock_github, [])
+    # a concurrent build creates its comment while this one does
+    requester.on_create = lambda: fake_bucketstate.put(STICKY_STATE_KEY, {'comment_id': 77}, if_none_match=True)
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == 77
+
+    assert [(verb, url.rsplit('/', 1)[1]) for verb, url, _ in requester.requests] == [
+        ('GET', 'comments'),
+        ('POST', 'comments'),
+        ('DELETE', str(FakeRequester.CREATED_COMMENT_ID)),
+        ('PATCH', '77'),
+    ]
+    assert requester.requests[-1][2] == {'input': {'body': _expected_comment()}}
+    assert fake_bucketstate.get(STICKY_STATE_KEY) == {'comment_id': 77}
+
+
+def test_publish_sticky_comment_concurrent_replacements(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                        mock_github, fake_bucketstate):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    fake_bucketstate.put(STICKY_STATE_KEY, {'comment_id': 42})
+    requester = _mock_requester(mock_github, [])
+    requester.missing_comments = {42}
+    # a concurrent build replaces the deleted comment while this one does
+    requester.on_create = lambda: fake_bucketstate.put(STICKY_STATE_KEY, {'comment_id': 77})
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == 77
+
+    assert [(verb, url.rsplit('/', 1)[1]) for verb, url, _ in requester.requests] == [
+        ('PATCH', '42'),
+        ('POST', 'comments'),
+        ('DELETE', str(FakeRequester.CREATED_COMMENT_ID)),
+        ('PATCH', '77'),
+    ]
+    assert fake_bucketstate.get(STICKY_STATE_KEY) == {'comment_id': 77}
+
+
+def test_publish_live_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                              mock_bucketstate):
+    mock_config.configure_mock(LIVE_LOGS=True)
+    requester = _mock_requester(mock_github, [])
+    build = _mock_build()
+    build.status = 'IN_PROGRESS'
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(build) == FakeRequester.CREATED_COMMENT_ID
+
+    state_key = 'builds/project%3Abuild-1/live-comment.json'
+    mock_bucketstate.put.assert_called_once_with(state_key, {'comment_id': FakeRequester.CREATED_COMMENT_ID})
+
+    # once the build is finished, the same comment shows its result
+    mock_bucketstate.get.return_value = {'comment_id': FakeRequester.CREATED_COMMENT_ID}
+    build.status = BUILD_STATUS
+    assert proxy.publish_pr_comment(build) == FakeRequester.CREATED_COMMENT_ID
+
+    mock_bucketstate.get.assert_called_once_with(state_key)
+    assert requester.requests[1] == (
+        'PATCH', '/repos/{}/{}/issues/comments/{}'.format(GITHUB_OWNER, GITHUB_REPO, FakeRequester.CREATED_COMMENT_ID),
+        {'input': {'body': _expected_comment()}})
+    assert [verb for verb, _, _ in requester.requests] == ['POST', 'PATCH']
+
+
+def test_publish_live_comment_without_live_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                   mock_github, mock_bucketstate):
+    mock_config.configure_mock(LIVE_LOGS=True)
+    mock_bucketstate.get.return_value = {'comment_id': 42}
+    requester = _mock_requester(mock_github, [])
+    requester.missing_comments = {42}
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == FakeRequester.CREATED_COMMENT_ID
+
+    assert [verb for verb, _, _ in requester.requests] == ['PATCH', 'POST']
+    mock_bucketstate.put.assert_not_called()
+
+
+def test_delete_live_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                             mock_bucketstate):
+    mock_config.configure_mock(LIVE_LOGS=True)
+    requester = _mock_requester(mock_github, [])
+    proxy = github_proxy.GithubProxy()
+
+    proxy.delete_live_comment(_mock_build())
+    assert requester.requests == []
+
+    mock_bucketstate.get.return_value = {'comment_id': 42}
+    proxy.delete_live_comment(_mock_build())
+    assert requester.requests == [('DELETE', '/repos/{}/{}/issues/comments/42'.format(GITHUB_OWNER, GITHUB_REPO), {})]
+
+
+def test_publish_pr_comment_first_failure(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    build = _mock_build()
+    build.status = 'FAILED'
+    build.first_failure = {'line': 7, 'offset': 120, 'class': 'error'}
+    build.get_first_failure_url.return_value = LOGS_URL + '&range=120-'
+
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(build)
+
+    expected_comment = _expected_comment('FAILED', ' ([first failure at line 7]({}&range=120-))'.format(LOGS_URL))
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'POST', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID),
+        input={'body': expected_comment}
     )
-    mock_pr.create_issue_comment.assert_called_once_with(expected_comment)
 
-def test_delete_previous_comments(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github, mock_log):
-    build = MagicMock(status=BUILD_STATUS)
-    build.get_pr_id.return_value = PR_ID
 
-    mock_repo = mock_github.get_user.return_value.get_repo.return_value
-    mock_issue = mock_repo.get_issue.return_value
+def test_publish_pr_comment_first_failure_succeeded(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                    mock_github):
+    build = _mock_build()
+    build.first_failure = {'line': 7, 'offset': 120, 'class': 'error'}
+
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(build)
+
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'POST', '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID),
+        input={'body': _expected_comment()}
+    )
+
+
+def test_update_pr_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    build = _mock_build()
+    build.status = 'FAILED'
+    build.first_failure = {'line': 7, 'offset': 120, 'class': 'error'}
+    build.get_first_failure_url.return_value = LOGS_URL + '&range=120-'
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.update_pr_comment(build, COMMENT_ID) == COMMENT_ID
+
+    expected_comment = _expected_comment('FAILED', ' ([first failure at line 7]({}&range=120-))'.format(LOGS_URL))
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'PATCH', '/repos/{}/{}/issues/comments/{}'.format(GITHUB_OWNER, GITHUB_REPO, COMMENT_ID),
+        input={'body': expected_comment}
+    )
+
+
+def test_retract_pr_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    build = _mock_build()
+    build.logs_copy_failed = True
+
+    proxy = github_proxy.GithubProxy()
+    proxy.retract_pr_comment(build, COMMENT_ID)
+
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'DELETE', '/repos/{}/{}/issues/comments/{}'.format(GITHUB_OWNER, GITHUB_REPO, COMMENT_ID))
+
+
+def test_retract_sticky_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_config.configure_mock(COMMENT_MODE='sticky')
+    build = _mock_build()
+    build.logs_copy_failed = True
+
+    proxy = github_proxy.GithubProxy()
+    proxy.retract_pr_comment(build, COMMENT_ID)
+
+    mock_github.requester.requestJsonAndCheck.assert_called_once_with(
+        'PATCH', '/repos/{}/{}/issues/comments/{}'.format(GITHUB_OWNER, GITHUB_REPO, COMMENT_ID),
+        input={'body': _expected_comment(first_failure=' (copying the build logs failed)')}
+    )
+
 
-    comment1 = MagicMock()
-    comment2 = MagicMock(body=github_proxy.HIDDEN_COMMENT)
-    comment2.delete.side_effect = github_proxy.GithubException('status', 'data', {})
-    comment3 = MagicMock(body='with ' + github_proxy.HIDDEN_COMMENT + ' comment')
-    mock_issue.get_comments.return_value = [comment1, comment2, comment3]
+def test_publish_aggregated_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_config.configure_mock(COMMENT_MODE='aggregated', AGGREGATED_COMMENT_BUCKET_NAME='shared-bucket')
+    mocker.patch.object(github_proxy.bucketstate, 'S3', FakeS3())
+    requester = _mock_requester(mock_github, [])
+    state_key = 'pr/{}/{}/aggregated-comment.json'.format(PR_ID, COMMIT_ID)
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == FakeRequester.CREATED_COMMENT_ID
+
+    mock_config.configure_mock(PROJECT_NAME='OtherProject')
+    other_build = _mock_build()
+    other_build.status = 'FAILED'
+    other_build.get_logs_url.return_value = 'https://foo.com/other'
+    other_build.first_failure = {'line': 7, 'offset': 120, 'class': 'error'}
+    other_build.get_first_failure_url.return_value = 'https://foo.com/other&range=120-'
+    assert proxy.publish_pr_comment(other_build) == FakeRequester.CREATED_COMMENT_ID
+
+    assert [verb for verb, _, _ in requester.requests] == ['POST', 'PATCH']
+    assert github_proxy.bucketstate.get(state_key, 'shared-bucket')['comment_id'] == FakeRequester.CREATED_COMMENT_ID
+    comment = requester.requests[-1][2]['input']['body']
+    assert '* Commit ID: {}'.format(COMMIT_ID) in comment
+    assert ('| OtherProject | FAILED ([first failure at line 7](https://foo.com/other&range=120-)) | '
+            '[Build Logs](https://foo.com/other) (available for {} days) |\n'
+            '| {} | {} | [Build Logs]({}) (available for {} days) |').format(
+        test_constants.EXPIRATION_IN_DAYS, test_constants.PROJECT_NAME, BUILD_STATUS, LOGS_URL,
+        test_constants.EXPIRATION_IN_DAYS) in comment
+    assert github_proxy.HIDDEN_COMMENT in comment
+
+
+def test_publish_aggregated_comment_concurrent_first_comments(mocker, mock_config, mock_codebuild,
+                                                              mock_secretsmanager, mock_github):
+    mock_config.configure_mock(COMMENT_MODE='aggregated', AGGREGATED_COMMENT_BUCKET_NAME='shared-bucket')
+    mocker.patch.object(github_proxy.bucketstate, 'S3', FakeS3())
+    requester = _mock_requester(mock_github, [])
+    state_key = 'pr/{}/{}/aggregated-comment.json'.format(PR_ID, COMMIT_ID)
+
+    def concurrent_build_creates_comment():
+        def add_other_build(state):
+            state['builds']['OtherProject'] = {'build_status': 'FAILED', 'logs_url': 'url', 'expiration_in_days': 1}
+            state['comment_id'] = 77
+            return state
+        github_proxy.bucketstate.update(state_key, add_other_build, 'shared-bucket')
+
+    requester.on_create = concurrent_build_creates_comment
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == 77
+
+    assert [(verb, url.rsplit('/', 1)[1]) for verb, url, _ in requester.requests] == [
+        ('POST', 'comments'),
+        ('DELETE', str(FakeRequester.CREATED_COMMENT_ID)),
+        ('PATCH', '77'),
+    ]
+    comment = requester.requests[-1][2]['input']['body']
+    assert '| OtherProject |' in comment
+    assert '| {} |'.format(test_constants.PROJECT_NAME) in comment
+
+
+def test_publish_aggregated_comment_rerenders_on_concurrent_update(mocker, mock_config, mock_codebuild,
+                                                                   mock_secretsmanager, mock_github):
+    mock_config.configure_mock(COMMENT_MODE='aggregated', AGGREGATED_COMMENT_BUCKET_NAME='shared-bucket')
+    mocker.patch.object(github_proxy.bucketstate, 'S3', FakeS3())
+    requester = _mock_requester(mock_github, [])
+    state_key = 'pr/{}/{}/aggregated-comment.json'.format(PR_ID, COMMIT_ID)
+    github_proxy.bucketstate.put(state_key, {'commit_id': COMMIT_ID, 'builds': {}, 'comment_id': 77},
+                                 'shared-bucket')
+
+    def concurrent_build_updates_state():
+        requester.on_update = None
+
+        def add_other_build(state):
+            state['builds']['OtherProject'] = {'build_status': 'FAILED', 'logs_url': 'url', 'expiration_in_days': 1}
+            return state
+        github_proxy.bucketstate.update(state_key, add_other_build, 'shared-bucket')
+
+    requester.on_update = concurrent_build_updates_state
+
+    proxy = github_proxy.GithubProxy()
+    assert proxy.publish_pr_comment(_mock_build()) == 77
+
+    assert [verb for verb, _, _ in requester.requests] == ['PATCH', 'PATCH']
+    assert '| OtherProject |' not in requester.requests[0][2]['input']['body']
+    assert '| OtherProject |' in requester.requests[1][2]['input']['body']
+
+
+def test_delete_previous_comments(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github, mock_log):
+    mocker.patch.object(github_proxy, 'COMMENTS_PER_PAGE', 2)
+    build = _mock_build()
+    comments = [
+        {'id': 1, 'body': 'foo'},
+        {'id': 2, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 3, 'body': 'with ' + github_proxy.HIDDEN_COMMENT + ' comment'},
+    ]
+    requester = _mock_requester(mock_github, comments)
+    requester.fail_deletes = {2}
 
     proxy = github_proxy.GithubProxy()
     proxy.delete_previous_comments(build)
 
-    mock_repo.get_issue.assert_called_once_with(PR_ID)
-    mock_issue.get_comments.assert_called_once()
-    comment1.delete.assert_not_called()
-    comment2.delete.assert_called_once()
-    comment3.delete.assert_called_once()
+    comments_url = '/repos/{}/{}/issues/{}/comments'.format(GITHUB_OWNER, GITHUB_REPO, PR_ID)
+    assert requester.requests[:2] == [
+        ('GET', comments_url, {'parameters': {'per_page': 2, 'page': 1}}),
+        ('GET', comments_url, {'parameters': {'per_page': 2, 'page': 2}}),
+    ]
+    # comments are deleted concurrently, so in any order
+    assert sorted(requester.requests[2:]) == [
+        ('DELETE', '/repos/{}/{}/issues/comments/2'.format(GITHUB_OWNER, GITHUB_REPO), {}),
+        ('DELETE', '/repos/{}/{}/issues/comments/3'.format(GITHUB_OWNER, GITHUB_REPO), {}),
+    ]
     mock_log.warning.assert_called_once()
+    assert proxy.pop_request_count(build) == 4
+
+
+@pytest.mark.parametrize('error', [
+    github_proxy.RateLimitExceededException(403, {'message': 'API rate limit exceeded'}, {}),
+    ConnectionError('Connection reset by peer'),
+])
+def test_delete_previous_comments_failure(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github,
+                                          mock_log, error):
+    requester = _mock_requester(mock_github, [
+        {'id': 2, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 3, 'body': github_proxy.HIDDEN_COMMENT},
+    ])
+    requester.fail_deletes = {2}
+    requester.delete_error = error
+
+    with pytest.raises(type(error)):
+        github_proxy.GithubProxy().delete_previous_comments(_mock_build())
+
+    # the other comment is still deleted
+    assert ('DELETE', '/repos/{}/{}/issues/comments/3'.format(GITHUB_OWNER, GITHUB_REPO), {}) in requester.requests
+    mock_log.warning.assert_not_called()
+
+
+def test_rate_limit_exceeded_response(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    github_proxy.GithubProxy().publish_pr_comment(_mock_build())
+    retry = github_proxy.Github.call_args.kwargs['retry']
+    requests = []
+
+    class RateLimitedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            body = json.dumps({'message': 'API rate limit exceeded for user ID 1.'}).encode('utf-8')
+            self.send_response(403)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-RateLimit-Remaining', '0')
+            self.send_header('X-RateLimit-Reset', str(int(time.time()) + 20))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = github.Github(auth=github.Auth.Token('token'), base_url='http://127.0.0.1:{}'.format(server.server_port), retry=retry)
+        start = time.monotonic()
+        # GithubRetry would wait for the reset instead
+        with pytest.raises(github_proxy.RateLimitExceededException) as e:
+            client.requester.requestJsonAndCheck('GET', '/repos/owner/repo/issues/1/comments')
+        assert time.monotonic() - start < 5
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert requests == ['/repos/owner/repo/issues/1/comments']
+    assert e.value.headers['X-RateLimit-Remaining'] == '0'
+
+
+def test_delete_previous_comments_before_comment_id(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                    mock_github):
+    comments = [
+        {'id': 2, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 3, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 4, 'body': github_proxy.HIDDEN_COMMENT},
+    ]
+    requester = _mock_requester(mock_github, comments)
+
+    github_proxy.GithubProxy().delete_previous_comments(_mock_build(), before_comment_id=3)
+
+    assert [request[:2] for request in requester.requests if request[0] == 'DELETE'] == [
+        ('DELETE', '/repos/{}/{}/issues/comments/2'.format(GITHUB_OWNER, GITHUB_REPO)),
+    ]
+
+
+def test_delete_previous_comments_keeps_live_comment(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                     mock_github, mock_bucketstate):
+    mock_config.configure_mock(LIVE_LOGS=True)
+    mock_bucketstate.get.return_value = {'comment_id': 3}
+    requester = _mock_requester(mock_github, [
+        {'id': 2, 'body': github_proxy.HIDDEN_COMMENT},
+        {'id': 3, 'body': github_proxy.HIDDEN_COMMENT},
+    ])
+
+    github_proxy.GithubProxy().delete_previous_comments(_mock_build())
+
+    assert [request[:2] for request in requester.requests if request[0] == 'DELETE'] == [
+        ('DELETE', '/repos/{}/{}/issues/comments/2'.format(GITHUB_OWNER, GITHUB_REPO)),
+    ]
+
+
+def test_rate_limit_low(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_github.requester.requestJsonAndCheck.return_value = (_rate_limit_headers(100), {'id': COMMENT_ID})
+    proxy = github_proxy.GithubProxy()
+    assert not proxy.is_rate_limit_low()
+    assert proxy.get_rate_limit_reset_seconds() == 0
+
+    proxy.publish_pr_comment(_mock_build())
+
+    assert proxy.is_rate_limit_low()
+    assert not proxy.is_rate_limit_low(critical=True)
+    assert 0 < proxy.get_rate_limit_reset_seconds() <= 60
+
+
+def test_rate_limit_exhausted(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_github.requester.requestJsonAndCheck.side_effect = github_proxy.RateLimitExceededException(
+        403, {'message': 'API rate limit exceeded'}, _rate_limit_headers(0))
+    proxy = github_proxy.GithubProxy()
+    build = _mock_build()
+    with pytest.raises(github_proxy.RateLimitExceededException):
+        proxy.publish_pr_comment(build)
+
+    # no more requests are sent until the rate limit resets
+    with pytest.raises(github_proxy.RateLimitExceededException):
+        proxy.publish_pr_comment(build)
+
+    assert proxy.is_rate_limit_low(critical=True)
+    assert mock_github.requester.requestJsonAndCheck.call_count == 1
+    assert proxy.pop_request_count(build) == 1
+
+
+def test_rate_limit_shared(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_github.requester.requestJsonAndCheck.return_value = (_rate_limit_headers(100), {'id': COMMENT_ID})
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(_mock_build())
+
+    proxy.sync_rate_limit()
+
+    assert github_proxy.GithubProxy().is_rate_limit_low()
+
+
+def test_github_info_cached(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    build = _mock_build()
+    _mock_requester(mock_github, [])
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(build)
+    proxy.delete_previous_comments(build)
+
+    mock_codebuild.batch_get_projects.assert_called_once()
+    github_proxy.Github.assert_called_once()
+    assert proxy.get_cache_stats() == {'hits': 1, 'misses': 1}
+
+
+def test_github_info_cache_expires(mocker, mock_config, mock_codebuild, mock_secretsmanager, mock_github):
+    mock_monotonic = mocker.patch.object(ttlcache.time, 'monotonic')
+    mock_monotonic.return_value = 1000
+    build = _mock_build()
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(build)
+
+    mock_monotonic.return_value = 1061
+    proxy.publish_pr_comment(build)
+
+    assert mock_codebuild.batch_get_projects.call_count == 2
+    assert github_proxy.Github.call_count == 2
+
+
+def test_github_info_reloaded_on_bad_credentials(mocker, mock_config, mock_codebuild, mock_secretsmanager,
+                                                 mock_github):
+    mock_github.requester.requestJsonAndCheck.side_effect = [
+        github_proxy.BadCredentialsException(401, 'Bad credentials', {}),
+        ({}, {'id': 1}),
+    ]
+
+    build = _mock_build()
+    proxy = github_proxy.GithubProxy()
+    proxy.publish_pr_comment(build)
+
+    assert mock_codebuild.batch_get_projects.call_count == 2
+    assert mock_github.requester.requestJsonAndCheck.call_count == 2
+    assert proxy.pop_request_count(build) == 2
+
 
 def test_init_github_info_auth_with_secrets_manager_arn(mocker, mock_config, mock_codebuild, mock_secretsmanager):
     secret_arn = 'arn:secret'
@@ -147,3 +671,65 @@ def test_init_github_info_invalid_source_location(mocker, mock_config, mock_code
     proxy = github_proxy.GithubProxy()
     with pytest.raises(RuntimeError):
         proxy._init_github_info()
+
+
+def _mock_build():
+    build = MagicMock(status=BUILD_STATUS)
+    build.id = 'project:build-1'
+    build.get_logs_url.return_value = LOGS_URL
+    build.get_pr_id.return_value = PR_ID
+    build.commit_id = COMMIT_ID
+    build.first_failure = None
+    build.logs_copy_failed = False
+    return build
+
+
+def _rate_limit_headers(remaining):
+    return {'x-ratelimit-remaining': str(remaining), 'x-ratelimit-reset': str(int(time.time()) + 60)}
+
+
+def _expected_comment(build_status=BUILD_STATUS, first_failure=''):
+    return github_proxy.PR_COMMENT_TEMPLATE.format(
+        project_name=test_constants.PROJECT_NAME,
+        commit_id=COMMIT_ID,
+        build_status=build_status,
+        first_failure=first_failure,
+        logs_url=LOGS_URL,
+    )
+
+
+def _mock_requester(mock_github, comments):
+    requester = FakeRequester(comments)
+    mock_github.requester = requester
+    return requester
+
+
+class FakeRequester:
+    CREATED_COMMENT_ID = 100
+
+    def __init__(self, comments):
+        self.comments = comments
+        self.fail_deletes = set()
+        self.delete_error = github_proxy.GithubException(404, 'Not Found', {})
+        self.missing_comments = set()
+        self.requests = []
+        self.on_create = None
+        self.on_update = None
+
+    def requestJsonAndCheck(self, verb, url, **kwargs):
+        self.requests.append((verb, url, kwargs))
+        if verb == 'GET':
+            per_page = kwargs['parameters']['per_page']
+            first = (kwargs['parameters']['page'] - 1) * per_page
+            return {}, self.comments[first:first + per_page]
+        if verb == 'POST':
+            if self.on_create:
+                self.on_create()
+            return {}, {'id': self.CREATED_COMMENT_ID}
+        if verb == 'PATCH' and int(url.rsplit('/', 1)[1]) in self.missing_comments:
+            raise github_proxy.UnknownObjectException(404, 'Not Found', {})
+        if verb == 'PATCH' and self.on_update:
+            self.on_update()
+        if verb == 'DELETE' and int(url.rsplit('/', 1)[1]) in self.fail_deletes:
+            raise self.delete_error
+        return {}, None
@@ -0,0 +1,92 @@
+import types
+
+import htmlrender
+import test_constants
+
+LOG_KEY = 'stream/build.log'
+
+
+class FakeBucket:
+    name = 'bucket'
+
+    def __init__(self):
+        self.objects = {}
+        self.meta = types.SimpleNamespace(client=self)
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        assert Bucket == self.name
+        assert ContentType == 'text/html; charset=utf-8'
+        self.objects[Key] = Body.decode('utf-8')
+
+
+def test_get_index_key():
+    assert htmlrender.get_index_key(LOG_KEY) == 'stream/html/index.html'
+
+
+def test_render():
+    bucket = FakeBucket()
+    renderer = htmlrender.HtmlRenderer(bucket, LOG_KEY, 'Title')
+    data = [b'[Container] 2020/01/01 00:00:00 Entering phase BUILD\n<b>\xe2\x9c',
+            b'\x93</b>\n\x1b[1;31mred', b'\x1b[0m plain\n']
+    assert b''.join(renderer.tap(iter(data))) == b''.join(data)
+
+    assert set(bucket.objects) == {'stream/html/index.html', 'stream/html/page-1.html'}
+    page = bucket.objects['stream/html/page-1.html']
+    assert '<a id="L2" href="#L2" class="ln">2</a>&lt;b&gt;✓&lt;/b&gt;\n' in page
+    assert '<a id="L3" href="#L3" class="ln">3</a><span class="ansi-1 ansi-31">red</span> plain\n</pre>' in page
+    assert 'Next page' not in page
+
+    index = bucket.objects['stream/html/index.html']
+    assert '<a href="{}?key=stream%2Fhtml%2Fpage-1.html#L1">BUILD</a>'.format(
+        test_constants.BUILD_LOGS_API_ENDPOINT) in index
+    assert '?key=stream%2Fbuild.log&amp;raw=true' in index
+
+
+def test_render_pages(mocker):
+    mocker.patch.object(htmlrender, 'PAGE_SIZE', 10)
+    bucket = FakeBucket()
+    renderer = htmlrender.HtmlRenderer(bucket, LOG_KEY, 'Title')
+    renderer.feed(b'\x1b[32mgreen line\n[Container] 2020/01/01 00:00:00 Entering phase TEST\n')
+    renderer.feed(b'[Container] 2020/01/01 00:00:01 Phase complete: TEST State: FAILED\nlast')
+    renderer.finish()
+
+    assert len(bucket.objects) == 5
+    # the style of the first page carries over to the second one
+    assert '<span class="ansi-32">green line\n</span></pre>' in bucket.objects['stream/html/page-1.html']
+    assert '<pre><span class="ansi-32"><a id="L2"' in bucket.objects['stream/html/page-2.html']
+    assert 'Next page' in bucket.objects['stream/html/page-3.html']
+    assert 'Next page' not in bucket.objects['stream/html/page-4.html']
+
+    index = bucket.objects['stream/html/index.html']
+    assert 'page-2.html#L2">TEST</a> (FAILED)' in index
+    assert 'Page 4 (from line 4)' in index
+
+
+def test_render_long_line(mocker):
+    mocker.patch.object(htmlrender, 'PAGE_SIZE', 10)
+    bucket = FakeBucket()
+    renderer = htmlrender.HtmlRenderer(bucket, LOG_KEY, 'Title')
+    renderer.feed(b'a' * 15)
+    renderer.feed(b'b' * 5 + b'\nnext\n')
+    renderer.finish()
+
+    assert 'class="ln">1</a>' + 'a' * 15 + '</pre>' in bucket.objects['stream/html/page-1.html']
+    # the rest of the line is continued without a line number
+    assert '<pre>' + 'b' * 5 + '\n<a id="L2" href="#L2" class="ln">2</a>next\n</pre>' in \
+        bucket.objects['stream/html/page-2.html']
+
+
+def test_render_chunk_viewer():
+    page = htmlrender.render_chunk_viewer(LOG_KEY, 'Title', ['https://chunk-1?a=1&b=2', 'https://chunk-2</script>'])
+
+    assert '<title>Title</title>' in page
+    assert '<a href="?key=stream%2Fbuild.log&amp;tail=1000">Last 1000 lines</a>' in page
+    assert 'const URLS = ["https://chunk-1?a=1&b=2", "https://chunk-2<\\/script>"];' in page
+    assert '<li><a href="https://chunk-1?a=1&amp;b=2">Part 1</a></li>' in page
+    assert '<li><a href="https://chunk-2&lt;/script&gt;">Part 2</a></li>' in page
+
+
+def test_ansi_extended_colors():
+    converter = htmlrender._AnsiConverter()
+    assert converter.convert('\x1b[38;5;196;1mbold\x1b[2Kx') == '<span class="ansi-1">boldx'
+    assert converter.close() == '</span>'
@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import idempotency
+from fake_s3 import FakeS3
+import test_constants
+
+MARKER_KEY = (test_constants.BUCKET_NAME, 'state/events/project%3Abuild-1/FAILED.json')
+# the invocation claiming the event at 1000 has a 60 second timeout
+DEADLINE = 1060
+
+
+@pytest.fixture
+def fake_s3(mocker):
+    fake_s3 = FakeS3()
+    mocker.patch.object(idempotency.bucketstate, 'S3', fake_s3)
+    return fake_s3
+
+
+@pytest.fixture
+def mock_time(mocker):
+    mock_time = mocker.patch.object(idempotency.time, 'time')
+    mock_time.return_value = 1000
+    return mock_time
+
+
+def test_claim_first_delivery(fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    assert MARKER_KEY in fake_s3.objects
+    assert idempotency.bucketstate.get('events/project%3Abuild-1/FAILED.json') == {
+        'state': 'processing', 'claimed_at': 1000, 'expires_at': DEADLINE
+    }
+
+
+def test_claim_duplicate_processing(fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    mock_time.return_value = DEADLINE - 1
+    assert not idempotency.claim(_mock_build(), DEADLINE)
+
+
+def test_claim_duplicate_done(fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    idempotency.complete(_mock_build())
+    mock_time.return_value = 1000 + idempotency.PROCESSING_TIMEOUT_SECONDS + 1
+    assert not idempotency.claim(_mock_build(), DEADLINE)
+
+
+def test_claim_other_status(fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    assert idempotency.claim(_mock_build(status='SUCCEEDED'), DEADLINE)
+
+
+def test_claim_after_release(fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    idempotency.release(_mock_build())
+    assert MARKER_KEY not in fake_s3.objects
+    assert idempotency.claim(_mock_build(), DEADLINE)
+
+
+def test_claim_abandoned(fake_s3, mock_time):
+    # the invocation that claimed the event crashed, and Lambda retries the event a minute later
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    mock_time.return_value = 1060
+    assert idempotency.claim(_mock_build(), 1120)
+    assert idempotency.bucketstate.get('events/project%3Abuild-1/FAILED.json')['expires_at'] == 1120
+    # the marker was taken over, so another duplicate is detected again
+    assert not idempotency.claim(_mock_build(), 1120)
+
+
+def test_claim_abandoned_without_expiry(fake_s3, mock_time):
+    idempotency.bucketstate.put('events/project%3Abuild-1/FAILED.json', {'state': 'processing', 'claimed_at': 1000})
+
+    assert not idempotency.claim(_mock_build(), DEADLINE)
+    mock_time.return_value = 1000 + idempotency.PROCESSING_TIMEOUT_SECONDS
+    assert idempotency.claim(_mock_build(), DEADLINE)
+
+
+def test_get_deadline(mock_time):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 59500
+
+    assert idempotency.get_deadline(context) == 1059.5
+    assert idempotency.get_deadline(None) == 1000 + idempotency.PROCESSING_TIMEOUT_SECONDS
+
+
+def test_claim_released_concurrently(mocker, fake_s3, mock_time):
+    assert idempotency.claim(_mock_build(), DEADLINE)
+
+    # the marker is released between the failed conditional write and reading it
+    def release_and_get(key):
+        idempotency.release(_mock_build())
+        return None, None
+    mocker.patch.object(idempotency.bucketstate, 'get_with_etag', side_effect=release_and_get)
+
+    assert idempotency.claim(_mock_build(), DEADLINE)
+    assert MARKER_KEY in fake_s3.objects
+
+
+def _mock_build(status='FAILED'):
+    return MagicMock(id='project:build-1', status=status)
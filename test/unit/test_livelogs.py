@@ -0,0 +1,192 @@
+import types
+
+import botocore
+import pytest
+
+import bucketstate
+import livelogs
+
+BUILD_ID = 'arn:aws:codebuild:us-east-1:123456789012:build/project:build-1'
+LOG_KEY = 'build-1/build.log'
+CHECKPOINT_KEY = 'live/arn%3Aaws%3Acodebuild%3Aus-east-1%3A123456789012%3Abuild%2Fproject%3Abuild-1.json'
+
+
+class FakeBucket:
+    name = 'bucket'
+
+    def __init__(self):
+        self.objects = {}
+        # the bucket is only accessed through its client
+        self.meta = types.SimpleNamespace(client=self)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        assert Bucket == self.name
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        assert Bucket == self.name
+        if Key not in self.objects:
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': _Body(self.objects[Key])}
+
+    def delete_objects(self, Bucket, Delete):
+        assert Bucket == self.name
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+
+    def live_keys(self):
+        return sorted(key for key in self.objects if '/live/' in key)
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+@pytest.fixture
+def bucket():
+    return FakeBucket()
+
+
+@pytest.fixture
+def state(mocker):
+    documents = {}
+
+    def get_with_etag(key):
+        return documents.get(key, (None, None))
+
+    def put(key, document, if_match=None, if_none_match=False):
+        current_etag = documents.get(key, (None, None))[1]
+        if (if_none_match and current_etag) or (if_match and if_match != current_etag):
+            raise bucketstate.ConflictError(key)
+        etag = 'etag-{}'.format(int((current_etag or 'etag-0').split('-')[1]) + 1)
+        documents[key] = (document, etag)
+        return etag
+
+    mocker.patch.object(livelogs.bucketstate, 'get_with_etag', side_effect=get_with_etag)
+    mocker.patch.object(livelogs.bucketstate, 'put', side_effect=put)
+    return documents
+
+
+@pytest.fixture(autouse=True)
+def composed_uploads(mocker, bucket):
+    def upload_composed(bucket, key, source_keys, tail=b'', **object_args):
+        bucket.objects[key] = b''.join(bucket.objects[source_key] for source_key in source_keys) + tail
+
+    mocker.patch.object(livelogs, 'SEGMENT_SIZE', 4)
+    return mocker.patch.object(livelogs.s3upload, 'upload_composed', side_effect=upload_composed)
+
+
+def test_get_live_key():
+    assert livelogs.get_live_key(LOG_KEY) == 'build-1/live.log'
+
+
+def test_append_and_finish(bucket, state):
+    log = _FakeLog()
+
+    log.write(b'ERROR a\n')
+    assert livelogs.append(bucket, BUILD_ID, LOG_KEY, log.read_after) is True
+    assert bucket.objects['build-1/live.log'] == b'ERROR a\n'
+    assert bucket.live_keys() == ['build-1/live/segment-1', 'build-1/live/segment-2']
+
+    log.write(b'b\nERR')
+    assert livelogs.append(bucket, BUILD_ID, LOG_KEY, log.read_after) is True
+    assert bucket.objects['build-1/live.log'] == b'ERROR a\nb\nERR'
+    pending_keys = [key for key in bucket.live_keys() if '/pending-' in key]
+    assert len(pending_keys) == 1
+    assert bucket.objects[pending_keys[0]] == b'R'
+    assert log.tokens == [None, 'token-1']
+
+    log.write(b'OR c\n')
+    indexer = livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after, ContentType='text/plain')
+
+    assert bucket.objects[LOG_KEY] == b'ERROR a\nb\nERROR c\n'
+    assert [entry['line'] for entry in indexer.entries] == [1, 3]
+    assert indexer.entries[1]['offset'] == len(b'ERROR a\nb\n')
+    assert log.tokens == [None, 'token-1', 'token-2']
+    # only the finished log is left
+    assert bucket.live_keys() == []
+    assert 'build-1/live.log' not in bucket.objects
+    assert state[CHECKPOINT_KEY][0]['finished'] is True
+
+
+def test_append_after_finish(bucket, state):
+    log = _FakeLog()
+    log.write(b'a\n')
+    livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after)
+
+    assert livelogs.append(bucket, BUILD_ID, LOG_KEY, log.read_after) is False
+    assert log.tokens == [None]
+
+
+def test_finish_without_live_logs(bucket, state):
+    log = _FakeLog()
+    log.write(b'a\nb\n')
+
+    livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after)
+
+    assert bucket.objects[LOG_KEY] == b'a\nb\n'
+    assert log.tokens == [None]
+
+
+def test_finish_twice(bucket, state):
+    log = _FakeLog()
+    log.write(b'ERROR\n')
+    livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after)
+
+    indexer = livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after)
+
+    assert [entry['line'] for entry in indexer.entries] == [1]
+    assert log.tokens == [None]
+
+
+def test_append_concurrently(mocker, bucket, state):
+    log = _FakeLog()
+    log.write(b'ab')
+    mocker.patch.object(livelogs.bucketstate, 'put', side_effect=bucketstate.ConflictError(CHECKPOINT_KEY))
+
+    assert livelogs.append(bucket, BUILD_ID, LOG_KEY, log.read_after) is False
+
+    # the pending object of the losing invocation is deleted
+    assert bucket.live_keys() == []
+    assert 'build-1/live.log' not in bucket.objects
+
+
+def test_finish_retries_conflicts(mocker, bucket, state):
+    log = _FakeLog()
+    log.write(b'ab')
+    put = livelogs.bucketstate.put.side_effect
+    conflicts = [bucketstate.ConflictError(CHECKPOINT_KEY)]
+
+    def put_with_conflict(*args, **kwargs):
+        if conflicts:
+            raise conflicts.pop()
+        return put(*args, **kwargs)
+
+    livelogs.bucketstate.put.side_effect = put_with_conflict
+
+    livelogs.finish(bucket, BUILD_ID, LOG_KEY, log.read_after)
+
+    assert bucket.objects[LOG_KEY] == b'ab'
+    assert livelogs.bucketstate.put.call_count == 2
+    assert state[CHECKPOINT_KEY][0]['finished'] is True
+
+
+class _FakeLog:
+    """Log that returns the data written since the given token, like GetLogEvents."""
+
+    def __init__(self):
+        self.writes = []
+        self.tokens = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def read_after(self, token):
+        self.tokens.append(token)
+        start = int(token.split('-')[1]) if token else 0
+        for i in range(start, len(self.writes)):
+            yield self.writes[i], 'token-{}'.format(i + 1)
@@ -0,0 +1,87 @@
+import json
+
+import boto3
+from botocore.stub import Stubber
+import pytest
+
+import metrics
+import test_constants
+
+
+@pytest.fixture(autouse=True)
+def reset_current(mocker):
+    mocker.patch.object(metrics, 'CURRENT', None)
+
+
+def test_to_emf(mocker):
+    mock_perf_counter = mocker.patch.object(metrics.time, 'perf_counter')
+    mock_perf_counter.side_effect = [1.0, 1.25]
+    invocation_metrics = metrics.start()
+
+    with invocation_metrics.timer('CopyLogs'):
+        pass
+    invocation_metrics.put('LogBytes', 100, 'Bytes')
+    invocation_metrics.put('LogBytes', 200, 'Bytes')
+    invocation_metrics.increment('Builds')
+    invocation_metrics.increment('Builds')
+
+    assert invocation_metrics.to_emf(timestamp=1577836800) == {
+        '_aws': {
+            'Timestamp': 1577836800000,
+            'CloudWatchMetrics': [{
+                'Namespace': metrics.NAMESPACE,
+                'Dimensions': [['ProjectName']],
+                'Metrics': [
+                    {'Name': 'Builds', 'Unit': 'Count'},
+                    {'Name': 'CopyLogs', 'Unit': 'Milliseconds'},
+                    {'Name': 'LogBytes', 'Unit': 'Bytes'},
+                ],
+            }],
+        },
+        'ProjectName': test_constants.PROJECT_NAME,
+        'Builds': 2,
+        'CopyLogs': [250.0],
+        'LogBytes': [100, 200],
+    }
+
+
+def test_timer_records_on_exception():
+    invocation_metrics = metrics.start()
+    with pytest.raises(RuntimeError):
+        with invocation_metrics.timer('CopyLogs'):
+            raise RuntimeError('boom')
+    assert len(invocation_metrics.to_emf()['CopyLogs']) == 1
+
+
+def test_max_values_per_metric(mocker):
+    mocker.patch.object(metrics, 'MAX_VALUES_PER_METRIC', 2)
+    invocation_metrics = metrics.start()
+    for value in range(3):
+        invocation_metrics.put('LogPages', value)
+    assert invocation_metrics.to_emf()['LogPages'] == [0, 1]
+
+
+def test_emit(capsys):
+    invocation_metrics = metrics.start()
+    invocation_metrics.increment('Builds')
+    invocation_metrics.emit()
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['Builds'] == 1
+
+
+def test_instrument():
+    client = metrics.instrument(boto3.client('logs', aws_access_key_id='AKID', aws_secret_access_key='secret'))
+    stubber = Stubber(client)
+    for _ in range(3):
+        stubber.add_response('describe_log_groups', {'logGroups': []})
+
+    with stubber:
+        # calls made outside of an invocation aren't counted
+        client.describe_log_groups()
+        invocation_metrics = metrics.start()
+        client.describe_log_groups()
+        client.describe_log_groups()
+
+    assert invocation_metrics.to_emf()['AwsCalls'] == 2
@@ -1,8 +1,15 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
 import pytest
+from github import RateLimitExceededException
 
 import processbuildevents
 import test_constants
 
+COMMENT_ID = 1234
+
 
 @pytest.fixture
 def mock_build(mocker):
@@ -11,15 +18,37 @@ def mock_build(mocker):
     mock_build.project_name = test_constants.PROJECT_NAME
     mock_build.is_pr_build.return_value = True
     mock_build.status = 'SUCCEEDED'
+    mock_build.log_bytes = 100
+    mock_build.log_pages = 2
+    mock_build.log_bytes_written = 40
+    mock_build.first_failure = None
+    mock_build.logs_copy_failed = False
     return mock_build
 
 
+@pytest.fixture(autouse=True)
+def mock_idempotency(mocker):
+    mocker.patch.object(processbuildevents, 'idempotency')
+    processbuildevents.idempotency.claim.return_value = True
+    return processbuildevents.idempotency
+
+
 @pytest.fixture
 def mock_github(mocker):
     mocker.patch.object(processbuildevents, 'GITHUB')
+    processbuildevents.GITHUB.pop_request_count.return_value = 1
+    processbuildevents.GITHUB.is_rate_limit_low.return_value = False
+    processbuildevents.GITHUB.get_rate_limit_reset_seconds.return_value = 300
+    processbuildevents.GITHUB.get_cache_stats.return_value = {'hits': 0, 'misses': 0}
     return processbuildevents.GITHUB
 
 
+@pytest.fixture
+def mock_defer(mocker):
+    mocker.patch.object(processbuildevents.config, 'DEFERRED_WORK_QUEUE_URL', 'https://sqs/deferred-work')
+    return mocker.patch.object(processbuildevents.deferral, 'defer')
+
+
 def test_handler(mocker, mock_build, mock_github):
     build_event = _mock_build_event()
     processbuildevents.handler(build_event, None)
@@ -28,6 +57,91 @@ def test_handler(mocker, mock_build, mock_github):
     mock_build.copy_logs.assert_called_once()
     mock_github.publish_pr_comment.assert_called_once_with(mock_build)
     mock_github.delete_previous_comments.assert_not_called()
+    mock_github.sync_rate_limit.assert_called_once_with()
+
+
+def test_handler_metrics(mocker, mock_build, mock_github, capsys):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'new')
+    mocker.patch.object(processbuildevents.config, 'COMMENT_ON_SUCCESS', True)
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    emf = json.loads(capsys.readouterr().out)
+    assert [metric['Name'] for metric in emf['_aws']['CloudWatchMetrics'][0]['Metrics']] == [
+        'Builds', 'CopyLogs', 'CopyLogsAndComment', 'DeletePreviousComments', 'GitHubCacheHits', 'GitHubCacheMisses',
+        'GitHubRequests', 'LogBytes', 'LogBytesWritten', 'LogPages', 'PrDetection', 'PublishComment',
+    ]
+    assert emf['Builds'] == 1
+    assert emf['GitHubRequests'] == 1
+    assert emf['LogBytes'] == [100]
+    assert emf['LogBytesWritten'] == [40]
+    assert emf['LogPages'] == [2]
+
+
+def test_handler_cache_metrics(mocker, mock_build, mock_github, capsys):
+    # the cache of a warm container already served earlier invocations
+    mock_github.get_cache_stats.side_effect = [{'hits': 5, 'misses': 2}, {'hits': 8, 'misses': 3}]
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    emf = json.loads(capsys.readouterr().out)
+    assert emf['GitHubCacheHits'] == 3
+    assert emf['GitHubCacheMisses'] == 1
+
+
+def test_handler_metrics_without_bytes_written(mocker, mock_build, mock_github, capsys):
+    # live logs are appended while the build runs, so their bytes written aren't known
+    mock_build.log_bytes_written = None
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    emf = json.loads(capsys.readouterr().out)
+    assert 'LogBytesWritten' not in emf
+
+
+def test_handler_metrics_emitted_on_failure(mocker, mock_build, mock_github, capsys):
+    mock_build.copy_logs.side_effect = RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    emf = json.loads(capsys.readouterr().out)
+    assert len(emf['CopyLogs']) == 1
+    assert len(emf['RetractComment']) == 1
+
+
+def test_handler_duplicate_event(mocker, mock_build, mock_github, mock_idempotency, capsys):
+    mock_idempotency.claim.return_value = False
+    mock_idempotency.get_deadline.return_value = 1060
+    context = MagicMock()
+
+    processbuildevents.handler(_mock_build_event(), context)
+
+    # the claim expires when the invocation is stopped at the latest
+    mock_idempotency.get_deadline.assert_called_once_with(context)
+    mock_idempotency.claim.assert_called_once_with(mock_build, 1060)
+    mock_build.copy_logs.assert_not_called()
+    mock_github.publish_pr_comment.assert_not_called()
+    mock_idempotency.complete.assert_not_called()
+    assert json.loads(capsys.readouterr().out)['DuplicateEvents'] == 1
+
+
+def test_handler_event_completed(mocker, mock_build, mock_github, mock_idempotency):
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_idempotency.complete.assert_called_once_with(mock_build)
+    mock_idempotency.release.assert_not_called()
+
+
+def test_handler_event_released_on_failure(mocker, mock_build, mock_github, mock_idempotency):
+    mock_github.publish_pr_comment.side_effect = RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    mock_idempotency.release.assert_called_once_with(mock_build)
+    mock_idempotency.complete.assert_not_called()
 
 
 def test_handler_not_pr_build(mocker, mock_build, mock_github):
@@ -40,6 +154,85 @@ def test_handler_not_pr_build(mocker, mock_build, mock_github):
     mock_github.delete_previous_comments.assert_not_called()
 
 
+def test_handler_live_logs(mocker, mock_build, mock_github, mock_idempotency, capsys):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mock_build.status = 'IN_PROGRESS'
+    mock_build.append_live_logs.return_value = True
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_build.append_live_logs.assert_called_once_with()
+    mock_build.copy_logs.assert_not_called()
+    mock_github.publish_pr_comment.assert_called_once_with(mock_build)
+    mock_idempotency.complete.assert_called_once_with(mock_build)
+    emf = json.loads(capsys.readouterr().out)
+    assert len(emf['AppendLiveLogs']) == 1
+
+
+def test_handler_live_logs_link_already_posted(mocker, mock_build, mock_github, mock_idempotency):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mock_build.status = 'IN_PROGRESS'
+    mock_build.append_live_logs.return_value = True
+    mock_idempotency.claim.return_value = False
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_build.append_live_logs.assert_called_once_with()
+    mock_github.publish_pr_comment.assert_not_called()
+
+
+def test_handler_live_logs_not_appended(mocker, mock_build, mock_github, mock_idempotency):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mock_build.status = 'IN_PROGRESS'
+    mock_build.append_live_logs.return_value = False
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_idempotency.claim.assert_not_called()
+    mock_github.publish_pr_comment.assert_not_called()
+
+
+def test_handler_live_logs_rate_limit_low(mocker, mock_build, mock_github, mock_idempotency, capsys):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mock_build.status = 'IN_PROGRESS'
+    mock_build.append_live_logs.return_value = True
+    mock_github.is_rate_limit_low.return_value = True
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_build.append_live_logs.assert_called_once_with()
+    mock_idempotency.claim.assert_not_called()
+    mock_github.publish_pr_comment.assert_not_called()
+    emf = json.loads(capsys.readouterr().out)
+    assert emf['SkippedLiveLogsLinks'] == 1
+
+
+def test_handler_live_logs_rate_limit_exceeded(mocker, mock_build, mock_github, mock_idempotency, capsys):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mock_build.status = 'IN_PROGRESS'
+    mock_build.append_live_logs.return_value = True
+    mock_github.publish_pr_comment.side_effect = RateLimitExceededException(403, {}, {})
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    # the link is posted by a later event of the build instead
+    mock_idempotency.release.assert_called_once_with(mock_build)
+    mock_idempotency.complete.assert_not_called()
+    emf = json.loads(capsys.readouterr().out)
+    assert emf['SkippedLiveLogsLinks'] == 1
+
+
+def test_handler_live_logs_disabled(mocker, mock_build, mock_github, mock_idempotency):
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', False)
+    mock_build.status = 'IN_PROGRESS'
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_build.append_live_logs.assert_not_called()
+    mock_build.copy_logs.assert_not_called()
+    mock_github.publish_pr_comment.assert_not_called()
+
+
 def test_handler_delete_previous_commments(mocker, mock_build, mock_github):
     processbuildevents.config.DELETE_PREVIOUS_COMMENTS = True
 
@@ -48,6 +241,163 @@ def test_handler_delete_previous_commments(mocker, mock_build, mock_github):
 
     mock_github.delete_previous_comments.assert_called_once_with(mock_build)
 
+def test_handler_delete_previous_comments_while_copying_logs(mocker, mock_build, mock_github):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'new')
+    deleting = threading.Event()
+    mock_github.delete_previous_comments.side_effect = lambda build: deleting.set()
+
+    def copy_logs():
+        # only returns once previous comments are being deleted at the same time
+        assert deleting.wait(timeout=5)
+    mock_build.copy_logs.side_effect = copy_logs
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.publish_pr_comment.assert_called_once_with(mock_build)
+
+
+def test_handler_delete_previous_comments_failure(mocker, mock_build, mock_github):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'new')
+    mock_github.delete_previous_comments.side_effect = RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.publish_pr_comment.assert_not_called()
+
+
+def test_handler_comment_while_copying_logs(mocker, mock_build, mock_github):
+    publishing = threading.Event()
+    mock_github.publish_pr_comment.side_effect = lambda build: publishing.set() or COMMENT_ID
+
+    def copy_logs():
+        # only returns once the comment is being published at the same time
+        assert publishing.wait(timeout=5)
+    mock_build.copy_logs.side_effect = copy_logs
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.update_pr_comment.assert_not_called()
+    mock_github.retract_pr_comment.assert_not_called()
+
+
+def test_handler_comment_updated_with_first_failure(mocker, mock_build, mock_github):
+    mock_build.status = 'FAILED'
+    mock_github.publish_pr_comment.return_value = COMMENT_ID
+
+    def copy_logs():
+        mock_build.first_failure = {'line': 3, 'offset': 36, 'class': 'error'}
+    mock_build.copy_logs.side_effect = copy_logs
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.update_pr_comment.assert_called_once_with(mock_build, COMMENT_ID)
+
+
+def test_handler_comment_retracted_on_copy_failure(mocker, mock_build, mock_github, mock_idempotency):
+    mock_github.publish_pr_comment.return_value = COMMENT_ID
+    mock_build.copy_logs.side_effect = RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    assert mock_build.logs_copy_failed is True
+    mock_github.retract_pr_comment.assert_called_once_with(mock_build, COMMENT_ID)
+    mock_idempotency.release.assert_called_once_with(mock_build)
+
+
+def test_handler_comment_and_copy_failure(mocker, mock_build, mock_github):
+    mock_github.publish_pr_comment.side_effect = RuntimeError('github')
+    mock_build.copy_logs.side_effect = RuntimeError('copy')
+
+    with pytest.raises(RuntimeError, match='copy'):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.retract_pr_comment.assert_not_called()
+
+
+def test_handler_delete_deferred_when_rate_limit_low(mocker, mock_build, mock_github, mock_defer, capsys):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'new')
+    mock_build.status = 'FAILED'
+    mock_github.is_rate_limit_low.side_effect = lambda critical=False: not critical
+    mock_github.publish_pr_comment.return_value = COMMENT_ID
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.delete_previous_comments.assert_not_called()
+    mock_github.publish_pr_comment.assert_called_once_with(mock_build)
+    mock_defer.assert_called_once_with(mock_build, ['delete_previous_comments'], COMMENT_ID, 300)
+    assert json.loads(capsys.readouterr().out)['DeferredTasks'] == 1
+
+
+def test_handler_success_comment_deferred_when_rate_limit_low(mocker, mock_build, mock_github, mock_defer):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', False)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_ON_SUCCESS', True)
+    mock_github.is_rate_limit_low.side_effect = lambda critical=False: not critical
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.publish_pr_comment.assert_not_called()
+    mock_defer.assert_called_once_with(mock_build, ['publish_comment'], None, 300)
+
+
+def test_handler_comment_deferred_when_rate_limit_exhausted(mocker, mock_build, mock_github, mock_defer,
+                                                            mock_idempotency):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', False)
+    mock_build.status = 'FAILED'
+    mock_github.is_rate_limit_low.return_value = True
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_build.copy_logs.assert_called_once()
+    mock_github.publish_pr_comment.assert_not_called()
+    mock_defer.assert_called_once_with(mock_build, ['publish_comment'], None, 300)
+    mock_idempotency.complete.assert_called_once_with(mock_build)
+
+
+def test_handler_comment_deferred_when_rate_limit_exceeded(mocker, mock_build, mock_github, mock_defer):
+    mock_build.status = 'FAILED'
+    mock_github.publish_pr_comment.side_effect = RateLimitExceededException(403, {}, {})
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_defer.assert_called_once_with(mock_build, ['publish_comment'], None, 300)
+
+
+def test_handler_update_deferred_when_rate_limit_exceeded(mocker, mock_build, mock_github, mock_defer):
+    mock_build.status = 'FAILED'
+    mock_build.first_failure = {'line': 3, 'offset': 36, 'class': 'error'}
+    mock_github.publish_pr_comment.return_value = COMMENT_ID
+    mock_github.update_pr_comment.side_effect = RateLimitExceededException(403, {}, {})
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_defer.assert_called_once_with(mock_build, ['update_comment'], COMMENT_ID, 300)
+
+
+def test_handler_rate_limit_exceeded_without_deferral(mocker, mock_build, mock_github, mock_idempotency):
+    mock_github.publish_pr_comment.side_effect = RateLimitExceededException(403, {}, {})
+
+    with pytest.raises(RateLimitExceededException):
+        processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.is_rate_limit_low.assert_not_called()
+    mock_idempotency.release.assert_called_once_with(mock_build)
+
+
+def test_handler_sticky_comment_no_delete(mocker, mock_build, mock_github):
+    mocker.patch.object(processbuildevents.config, 'DELETE_PREVIOUS_COMMENTS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'sticky')
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.delete_previous_comments.assert_not_called()
+    mock_github.publish_pr_comment.assert_called_once_with(mock_build)
+
+
 def test_handler_successful_pr_build_no_comment(mocker, mock_build, mock_github):
     processbuildevents.config.COMMENT_ON_SUCCESS = False
 
@@ -55,6 +405,30 @@ def test_handler_successful_pr_build_no_comment(mocker, mock_build, mock_github)
     processbuildevents.handler(build_event, None)
 
     mock_github.publish_pr_comment.assert_not_called()
+    mock_github.delete_live_comment.assert_not_called()
+
+
+def test_handler_successful_pr_build_no_comment_live_logs(mocker, mock_build, mock_github):
+    mocker.patch.object(processbuildevents.config, 'COMMENT_ON_SUCCESS', False)
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'new')
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.publish_pr_comment.assert_not_called()
+    mock_github.delete_live_comment.assert_called_once_with(mock_build)
+
+
+def test_handler_successful_pr_build_no_comment_live_logs_sticky(mocker, mock_build, mock_github):
+    mocker.patch.object(processbuildevents.config, 'COMMENT_ON_SUCCESS', False)
+    mocker.patch.object(processbuildevents.config, 'LIVE_LOGS', True)
+    mocker.patch.object(processbuildevents.config, 'COMMENT_MODE', 'sticky')
+
+    processbuildevents.handler(_mock_build_event(), None)
+
+    mock_github.publish_pr_comment.assert_called_once_with(mock_build)
+    mock_github.delete_live_comment.assert_not_called()
+
 
 def test_handler_failure_pr_build_comment(mocker, mock_build, mock_github):
     processbuildevents.config.COMMENT_ON_SUCCESS = False
@@ -66,9 +440,102 @@ def test_handler_failure_pr_build_comment(mocker, mock_build, mock_github):
     mock_github.publish_pr_comment.assert_called_once_with(mock_build)
 
 
-def _mock_build_event():
+def test_handler_sqs_batch(mocker, mock_github):
+    mocker.patch.object(processbuildevents, 'Build', side_effect=_mock_build_from_event)
+    mock_load = mocker.patch.object(processbuildevents, 'load_build_details')
+    mock_github.publish_pr_comment.side_effect = \
+        lambda build: _raise(RuntimeError('boom')) if build.id == 'bad-build' else None
+
+    response = processbuildevents.handler(_mock_sqs_event({
+        'msg-1': json.dumps(_mock_build_event('build-1')),
+        'msg-2': json.dumps(_mock_build_event('bad-build')),
+        'msg-3': 'not json',
+        'msg-4': json.dumps(_mock_build_event('build-2')),
+    }), None)
+
+    assert response == {
+        'batchItemFailures': [
+            {'itemIdentifier': 'msg-3'},
+            {'itemIdentifier': 'msg-2'},
+        ]
+    }
+    loaded_builds = mock_load.call_args.args[0]
+    assert [build.id for build in loaded_builds] == ['build-1', 'bad-build', 'build-2']
+    for build in loaded_builds:
+        build.copy_logs.assert_called_once()
+    assert mock_github.publish_pr_comment.call_count == 3
+    assert processbuildevents.metrics.CURRENT.to_emf()['Builds'] == 3
+
+
+def test_handler_sqs_deferred_work(mocker, mock_github, mock_defer, mock_idempotency):
+    mocker.patch.object(processbuildevents.deferral, 'Build', side_effect=_mock_build_from_event)
+    mocker.patch.object(processbuildevents, 'load_build_details')
+    mock_github.publish_pr_comment.return_value = COMMENT_ID
+
+    response = processbuildevents.handler(_mock_sqs_event({
+        'msg-1': json.dumps(_mock_deferred_message(['publish_comment', 'delete_previous_comments'])),
+    }), None)
+
+    assert response == {'batchItemFailures': []}
+    build = mock_github.publish_pr_comment.call_args.args[0]
+    assert build.first_failure == {'line': 3}
+    build.copy_logs.assert_not_called()
+    mock_github.delete_previous_comments.assert_called_once_with(build, COMMENT_ID)
+    mock_defer.assert_not_called()
+    mock_idempotency.claim.assert_not_called()
+
+
+def test_handler_sqs_deferred_work_deferred_again(mocker, mock_github, mock_defer):
+    mocker.patch.object(processbuildevents.deferral, 'Build', side_effect=_mock_build_from_event)
+    mocker.patch.object(processbuildevents, 'load_build_details')
+    mock_github.is_rate_limit_low.side_effect = lambda critical=False: not critical
+
+    processbuildevents.handler(_mock_sqs_event({
+        'msg-1': json.dumps(_mock_deferred_message(['update_comment', 'delete_previous_comments'], COMMENT_ID)),
+    }), None)
+
+    build = mock_github.update_pr_comment.call_args.args[0]
+    mock_github.update_pr_comment.assert_called_once_with(build, COMMENT_ID)
+    mock_github.delete_previous_comments.assert_not_called()
+    mock_defer.assert_called_once_with(build, ['delete_previous_comments'], COMMENT_ID, 300)
+
+
+def test_handler_sqs_batch_no_valid_events(mocker, mock_github):
+    mock_load = mocker.patch.object(processbuildevents, 'load_build_details')
+
+    response = processbuildevents.handler(_mock_sqs_event({'msg-1': '{}'}), None)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'msg-1'}]}
+    mock_load.assert_not_called()
+
+
+def _mock_build_from_event(build_event):
+    mock_build = MagicMock(id=build_event['detail']['build-id'], status='FAILED', log_bytes=100, log_pages=2,
+                           log_bytes_written=40)
+    mock_build.is_pr_build.return_value = True
+    return mock_build
+
+
+def _mock_deferred_message(tasks, comment_id=None):
+    return {
+        'deferred': {'tasks': tasks, 'comment_id': comment_id, 'first_failure': {'line': 3}},
+        'build_event': _mock_build_event('build-1'),
+    }
+
+
+def _mock_sqs_event(message_bodies):
+    return {
+        'Records': [{'messageId': message_id, 'body': body} for message_id, body in message_bodies.items()]
+    }
+
+
+def _raise(e):
+    raise e
+
+
+def _mock_build_event(build_id='some-build'):
     return {
         'detail': {
-            'build-id': 'some-build'
+            'build-id': build_id
         }
     }
@@ -0,0 +1,113 @@
+import pytest
+
+from fake_s3 import FakeS3
+import ratelimit
+import test_constants
+
+STATE_KEY = (test_constants.BUCKET_NAME, 'state/github/rate-limit.json')
+
+
+@pytest.fixture
+def fake_s3(mocker):
+    fake_s3 = FakeS3()
+    mocker.patch.object(ratelimit.bucketstate, 'S3', fake_s3)
+    return fake_s3
+
+
+@pytest.fixture
+def mock_time(mocker):
+    mock_time = mocker.patch.object(ratelimit.time, 'time')
+    mock_time.return_value = 1000
+    return mock_time
+
+
+@pytest.fixture
+def mock_monotonic(mocker):
+    mock_monotonic = mocker.patch.object(ratelimit.time, 'monotonic')
+    mock_monotonic.return_value = 1000
+    return mock_monotonic
+
+
+def test_record(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    assert tracker.get_remaining() is None
+    assert tracker.get_seconds_until_reset() == 0
+
+    tracker.record({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': '1060'})
+    tracker.record({'X-RateLimit-Remaining': '9', 'X-RateLimit-Reset': '1060'})
+    # responses can arrive out of order, the budget only shrinks within a window
+    tracker.record({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': '1060'})
+    tracker.record({'content-type': 'application/json'})
+
+    assert tracker.get_remaining() == 9
+    assert tracker.get_seconds_until_reset() == 60
+
+
+def test_record_new_window(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    tracker.record({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '1060'})
+    tracker.record({'x-ratelimit-remaining': '4999', 'x-ratelimit-reset': '4600'})
+
+    assert tracker.get_remaining() == 4999
+
+
+def test_budget_reset(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    tracker.record({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '1060'})
+
+    mock_time.return_value = 1060
+    assert tracker.get_remaining() is None
+    assert tracker.get_seconds_until_reset() == 0
+
+
+def test_sync_shares_budget(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    tracker.record({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': '1060'})
+    tracker.sync(force=True)
+
+    other_tracker = ratelimit.RateLimitTracker()
+    assert other_tracker.get_remaining() == 10
+    assert ratelimit.bucketstate.get('github/rate-limit.json') == {'remaining': 10, 'reset': 1060}
+
+
+def test_sync_merges_budget(fake_s3, mock_time, mock_monotonic):
+    ratelimit.bucketstate.put('github/rate-limit.json', {'remaining': 5, 'reset': 1060})
+    tracker = ratelimit.RateLimitTracker()
+    tracker.record({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': '1060'})
+
+    tracker.sync(force=True)
+
+    assert tracker.get_remaining() == 5
+    # the shared budget didn't change, so it isn't written again
+    assert fake_s3.put_count == 1
+
+
+def test_sync_interval(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    assert tracker.get_remaining() is None
+    assert fake_s3.get_count == 0
+
+    ratelimit.bucketstate.put('github/rate-limit.json', {'remaining': 5, 'reset': 1060})
+    assert tracker.get_remaining() is None
+
+    mock_monotonic.return_value = 1000 + ratelimit.SYNC_INTERVAL_SECONDS
+    assert tracker.get_remaining() == 5
+    assert fake_s3.get_count == 1
+
+
+def test_sync_without_changes(fake_s3, mock_time, mock_monotonic):
+    tracker = ratelimit.RateLimitTracker()
+    tracker.sync()
+
+    tracker.sync(force=True)
+
+    assert STATE_KEY not in fake_s3.objects
+
+
+def test_sync_failure(mocker, mock_time, mock_monotonic):
+    mock_s3 = mocker.patch.object(ratelimit.bucketstate, 'S3')
+    mock_s3.get_object.side_effect = RuntimeError('boom')
+    tracker = ratelimit.RateLimitTracker()
+    tracker.record({'x-ratelimit-remaining': '10', 'x-ratelimit-reset': '1060'})
+
+    assert tracker.get_remaining() == 10
@@ -4,6 +4,19 @@ import botocore
 
 import s3link
 import test_constants
+import ttlcache
+
+
+@pytest.fixture(autouse=True)
+def clear_url_cache():
+    s3link.URL_CACHE.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def mock_credentials(mocker):
+    mocker.patch.object(s3link, 'CREDENTIALS', None)
+    mocker.patch.object(s3link.sigv4, 'get_environment_credentials', return_value=None)
+    return s3link.sigv4.get_environment_credentials
 
 
 @pytest.fixture
@@ -12,20 +25,14 @@ def mock_s3(mocker):
     return s3link.S3
 
 
-@pytest.fixture
-def mock_bucket(mocker):
-    mocker.patch.object(s3link, 'BUCKET')
-    return s3link.BUCKET
-
-
-def test_get_presigned_url_none_key(mock_s3, mock_bucket):
+def test_get_presigned_url_none_key(mock_s3):
     assert s3link.get_presigned_url(None) is None
-    mock_bucket.Object.assert_not_called()
+    mock_s3.head_object.assert_not_called()
     mock_s3.generate_presigned_url.assert_not_called()
 
 
-def test_get_presigned_url_key_not_found(mock_s3, mock_bucket):
-    mock_bucket.Object.return_value.load.side_effect = botocore.exceptions.ClientError(
+def test_get_presigned_url_key_not_found(mock_s3):
+    mock_s3.head_object.side_effect = botocore.exceptions.ClientError(
         {
             'Error': {
                 'Code': '404'
@@ -34,12 +41,12 @@ def test_get_presigned_url_key_not_found(mock_s3, mock_bucket):
     )
 
     assert s3link.get_presigned_url('foo') is None
-    mock_bucket.Object.assert_called_with('foo')
+    mock_s3.head_object.assert_called_with(Bucket=test_constants.BUCKET_NAME, Key='foo')
     mock_s3.generate_presigned_url.assert_not_called()
 
 
-def test_get_presigned_url_other_exception(mock_s3, mock_bucket):
-    mock_bucket.Object.return_value.load.side_effect = botocore.exceptions.ClientError(
+def test_get_presigned_url_other_exception(mock_s3):
+    mock_s3.head_object.side_effect = botocore.exceptions.ClientError(
         {
             'Error': {
                 'Code': 'boom!'
@@ -50,17 +57,16 @@ def test_get_presigned_url_other_exception(mock_s3, mock_bucket):
     with pytest.raises(botocore.exceptions.ClientError):
         s3link.get_presigned_url('foo')
 
-    mock_bucket.Object.assert_called_with('foo')
+    mock_s3.head_object.assert_called_with(Bucket=test_constants.BUCKET_NAME, Key='foo')
     mock_s3.generate_presigned_url.assert_not_called()
 
 
-def test_get_presigned_url_key_exists(mock_s3, mock_bucket):
+def test_get_presigned_url_key_exists(mock_s3):
     mock_s3.generate_presigned_url.return_value = 'presigned-url'
 
     assert s3link.get_presigned_url('foo') == 'presigned-url'
 
-    mock_bucket.Object.assert_called_with('foo')
-    mock_bucket.Object.return_value.load.assert_called_with()
+    mock_s3.head_object.assert_called_with(Bucket=test_constants.BUCKET_NAME, Key='foo')
     mock_s3.generate_presigned_url.assert_called_with(
         ClientMethod='get_object',
         ExpiresIn=600,
@@ -69,3 +75,82 @@ def test_get_presigned_url_key_exists(mock_s3, mock_bucket):
             'Key': 'foo'
         }
     )
+
+
+def test_get_presigned_url_local_signer(mocker, mock_s3, mock_credentials):
+    mocker.patch.object(s3link.config, 'BUCKET_NAME', 'test-bucket')
+    mock_credentials.return_value = s3link.sigv4.Credentials('AKID', 'secret', None)
+
+    url = s3link.get_presigned_url('foo/build.log')
+
+    assert url.startswith('https://test-bucket.s3.amazonaws.com/foo/build.log?X-Amz-Algorithm=AWS4-HMAC-SHA256&')
+    mock_s3.generate_presigned_url.assert_not_called()
+
+
+def test_get_presigned_url_local_signer_unsupported_bucket(mocker, mock_s3, mock_credentials):
+    mock_credentials.return_value = s3link.sigv4.Credentials('AKID', 'secret', None)
+    mock_s3.generate_presigned_url.return_value = 'presigned-url'
+
+    # test_constants.BUCKET_NAME isn't a valid virtual-hosted style bucket name
+    assert s3link.get_presigned_url('foo') == 'presigned-url'
+
+
+def test_get_presigned_url_local_signer_unsupported_region(mocker, mock_s3, mock_credentials):
+    mocker.patch.object(s3link.config, 'BUCKET_NAME', 'test-bucket')
+    mocker.patch.object(s3link.config, 'REGION', 'us-iso-east-1')
+    mock_credentials.return_value = s3link.sigv4.Credentials('AKID', 'secret', None)
+    mock_s3.generate_presigned_url.return_value = 'presigned-url'
+
+    assert s3link.get_presigned_url('foo') == 'presigned-url'
+
+
+def test_get_presigned_url_cached(mocker, mock_s3):
+    mock_monotonic = mocker.patch.object(ttlcache.time, 'monotonic')
+    mock_monotonic.return_value = 1000
+    mock_s3.generate_presigned_url.side_effect = ['url-1', 'url-2']
+
+    assert s3link.get_presigned_url('foo') == 'url-1'
+    mock_monotonic.return_value = 1299
+    assert s3link.get_presigned_url('foo') == 'url-1'
+    assert mock_s3.head_object.call_count == 1
+
+    mock_monotonic.return_value = 1300
+    assert s3link.get_presigned_url('foo') == 'url-2'
+    assert mock_s3.head_object.call_count == 2
+
+
+def test_get_presigned_url_not_found_cached(mocker, mock_s3):
+    mock_monotonic = mocker.patch.object(ttlcache.time, 'monotonic')
+    mock_monotonic.return_value = 1000
+    mock_s3.head_object.side_effect = [
+        botocore.exceptions.ClientError({'Error': {'Code': '404'}}, None),
+        None,
+    ]
+    mock_s3.generate_presigned_url.return_value = 'presigned-url'
+
+    assert s3link.get_presigned_url('foo') is None
+    mock_monotonic.return_value = 1029
+    assert s3link.get_presigned_url('foo') is None
+    assert mock_s3.head_object.call_count == 1
+
+    mock_monotonic.return_value = 1030
+    assert s3link.get_presigned_url('foo') == 'presigned-url'
+    assert mock_s3.head_object.call_count == 2
+
+
+def test_get_presigned_urls(mock_s3):
+    mock_s3.generate_presigned_url.side_effect = ['url-1', 'url-2']
+
+    assert s3link.get_presigned_urls(['foo', 'bar']) == ['url-1', 'url-2']
+
+    mock_s3.head_object.assert_not_called()
+    assert mock_s3.generate_presigned_url.call_args.kwargs['Params']['Key'] == 'bar'
+
+
+def test_get_s3_lazy(mocker):
+    mocker.patch.object(s3link, 'S3', None)
+    mock_client = mocker.patch.object(s3link.boto3, 'client')
+
+    assert s3link._get_s3() is mock_client.return_value
+    assert s3link._get_s3() is mock_client.return_value
+    mock_client.assert_called_once()
@@ -0,0 +1,140 @@
+import gzip
+
+import botocore
+import pytest
+
+from fake_s3 import FakeBucket, FakeS3
+import s3read
+import test_constants
+
+LOG = ''.join('line {}\n'.format(i) for i in range(1, 1001)).encode('utf-8')
+
+
+@pytest.fixture
+def fake_s3(mocker):
+    fake_s3 = FakeS3()
+    mocker.patch.object(s3read, 'S3', fake_s3)
+    mocker.patch.object(s3read, 'TAIL_BLOCK_SIZE', 64)
+    mocker.patch.object(s3read, 'STREAM_BLOCK_SIZE', 64)
+    fake_s3.put_object(Bucket=test_constants.BUCKET_NAME, Key='plain.log', Body=LOG)
+    fake_s3.put_object(Bucket=test_constants.BUCKET_NAME, Key='compressed.log', Body=gzip.compress(LOG),
+                       ContentEncoding='gzip')
+    return fake_s3
+
+
+@pytest.fixture(params=[False, True], ids=['plain', 'compressed'])
+def chunked_manifest(request, fake_s3, mocker):
+    mocker.patch.object(s3read.dedup, 'MIN_CHUNK_SIZE', 100)
+    mocker.patch.object(s3read.dedup, 'MAX_CHUNK_SIZE', 1000)
+    mocker.patch.object(s3read.dedup, 'BOUNDARY_BITS', 2)
+    mocker.patch.object(s3read.dedup, 'BOUNDARY_MASK', 3)
+    bucket = FakeBucket(fake_s3, test_constants.BUCKET_NAME)
+    s3read.dedup.upload(bucket, 'chunked/build.log', 'commit', [LOG], compress=request.param)
+    manifest = s3read.read_manifest('chunked/build.log')
+    assert len(manifest['chunks']) > 3
+    fake_s3.get_count = 0
+    return manifest
+
+
+@pytest.mark.parametrize('key', ['plain.log', 'compressed.log'])
+def test_read_tail(fake_s3, key):
+    assert s3read.read_tail(key, 3) == 'line 998\nline 999\nline 1000\n'
+
+
+def test_read_tail_plain_reads_from_end(fake_s3):
+    s3read.read_tail('plain.log', 3)
+    assert fake_s3.get_count == 1
+
+
+@pytest.mark.parametrize('key', ['plain.log', 'compressed.log'])
+def test_read_tail_more_lines_than_log(fake_s3, key):
+    assert s3read.read_tail(key, 5000) == LOG.decode('utf-8')
+
+
+@pytest.mark.parametrize('key', ['plain.log', 'compressed.log'])
+def test_read_tail_no_trailing_newline(fake_s3, key):
+    body = b'first\nsecond\nthird'
+    fake_s3.put_object(Bucket=test_constants.BUCKET_NAME, Key=key,
+                       Body=gzip.compress(body) if key == 'compressed.log' else body,
+                       **({'ContentEncoding': 'gzip'} if key == 'compressed.log' else {}))
+
+    assert s3read.read_tail(key, 2) == 'second\nthird'
+
+
+def test_read_tail_limited(fake_s3, mocker):
+    mocker.patch.object(s3read, 'MAX_READ_BYTES', 100)
+    assert s3read.read_tail('plain.log', 1000) == LOG[-100:].decode('utf-8')
+
+
+def test_read_tail_not_found(fake_s3):
+    assert s3read.read_tail('missing.log', 10) is None
+
+
+@pytest.mark.parametrize('key, size', [('plain.log', len(LOG)), ('compressed.log', None)])
+def test_read_range(fake_s3, key, size):
+    assert s3read.read_range(key, 100, 149) == (LOG[100:150].decode('utf-8'), 100, 149, size)
+
+
+@pytest.mark.parametrize('key', ['plain.log', 'compressed.log'])
+def test_read_range_open_ended(fake_s3, mocker, key):
+    mocker.patch.object(s3read, 'MAX_READ_BYTES', 1000)
+
+    content, start, end, _ = s3read.read_range(key, len(LOG) - 10)
+
+    assert content == LOG[-10:].decode('utf-8')
+    assert (start, end) == (len(LOG) - 10, len(LOG) - 1)
+    assert s3read.read_range(key, 0)[2] == 999
+
+
+@pytest.mark.parametrize('key', ['plain.log', 'compressed.log'])
+def test_read_range_past_end(fake_s3, key):
+    content, start, end, _ = s3read.read_range(key, len(LOG) + 10, len(LOG) + 20)
+
+    assert content == ''
+    assert end < start
+
+
+def test_read_range_not_found(fake_s3):
+    assert s3read.read_range('missing.log', 0, 10) is None
+
+
+def test_read_manifest_not_found(fake_s3):
+    assert s3read.read_manifest('plain.log') is None
+
+
+def test_read_chunked_tail(fake_s3, chunked_manifest):
+    assert s3read.read_chunked_tail(chunked_manifest, 3) == 'line 998\nline 999\nline 1000\n'
+    # only the last chunks are read
+    assert fake_s3.get_count < len(chunked_manifest['chunks'])
+
+
+def test_read_chunked_tail_more_lines_than_log(fake_s3, chunked_manifest):
+    assert s3read.read_chunked_tail(chunked_manifest, 5000) == LOG.decode('utf-8')
+
+
+def test_read_chunked_range(fake_s3, chunked_manifest):
+    assert s3read.read_chunked_range(chunked_manifest, 100, 2999) == (LOG[100:3000].decode('utf-8'), 100, 2999,
+                                                                      len(LOG))
+
+
+def test_read_chunked_range_open_ended(fake_s3, chunked_manifest, mocker):
+    mocker.patch.object(s3read, 'MAX_READ_BYTES', 1000)
+
+    assert s3read.read_chunked_range(chunked_manifest, len(LOG) - 10) == (LOG[-10:].decode('utf-8'), len(LOG) - 10,
+                                                                          len(LOG) - 1, len(LOG))
+    assert s3read.read_chunked_range(chunked_manifest, 0)[2] == 999
+
+
+def test_read_chunked_range_past_end(fake_s3, chunked_manifest):
+    content, start, end, _ = s3read.read_chunked_range(chunked_manifest, len(LOG) + 10)
+
+    assert content == ''
+    assert end < start
+
+
+def test_head_other_error(mocker):
+    mock_s3 = mocker.patch.object(s3read, 'S3')
+    mock_s3.head_object.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'boom!'}}, 'HeadObject')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        s3read.read_tail('plain.log', 10)
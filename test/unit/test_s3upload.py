@@ -0,0 +1,124 @@
+import gzip
+import pytest
+from unittest.mock import MagicMock, call
+
+import s3upload
+
+BUCKET_NAME = 'bucket'
+KEY = 'some/key'
+UPLOAD_ID = 'upload-1'
+
+
+@pytest.fixture
+def mock_bucket():
+    bucket = MagicMock()
+    bucket.name = BUCKET_NAME
+    client = bucket.meta.client
+    client.create_multipart_upload.return_value = {'UploadId': UPLOAD_ID}
+    client.upload_part.side_effect = lambda Body, **kwargs: {'ETag': 'etag-' + Body.decode()}
+    return bucket
+
+
+def test_rechunk():
+    assert list(s3upload.rechunk([b'ab', b'cdefg', b'', b'h'], 3)) == [b'abc', b'def', b'gh']
+
+
+def test_rechunk_exact_multiple():
+    assert list(s3upload.rechunk([b'abcd'], 2)) == [b'ab', b'cd']
+
+
+def test_rechunk_empty():
+    assert list(s3upload.rechunk([], 2)) == []
+
+
+def test_upload_stream_single_chunk(mock_bucket):
+    assert s3upload.upload_stream(mock_bucket, KEY, [b'abc'], ContentType='text/plain') == 3
+
+    client = mock_bucket.meta.client
+    client.put_object.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, Body=b'abc', ContentType='text/plain')
+    client.create_multipart_upload.assert_not_called()
+
+
+def test_upload_stream_empty(mock_bucket):
+    assert s3upload.upload_stream(mock_bucket, KEY, []) == 0
+
+    mock_bucket.meta.client.put_object.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, Body=b'')
+
+
+def test_upload_stream_multipart(mock_bucket):
+    assert s3upload.upload_stream(mock_bucket, KEY, iter([b'a', b'b', b'c']), ContentType='text/plain') == 3
+
+    client = mock_bucket.meta.client
+    client.put_object.assert_not_called()
+    client.create_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, ContentType='text/plain')
+    assert client.upload_part.call_args_list == [
+        call(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID, PartNumber=number, Body=body)
+        for number, body in [(1, b'a'), (2, b'b'), (3, b'c')]
+    ]
+    parts = [
+        {'PartNumber': 1, 'ETag': 'etag-a'},
+        {'PartNumber': 2, 'ETag': 'etag-b'},
+        {'PartNumber': 3, 'ETag': 'etag-c'},
+    ]
+    client.complete_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID,
+                                                             MultipartUpload={'Parts': parts})
+    client.abort_multipart_upload.assert_not_called()
+
+
+def test_upload_stream_multipart_failure_aborts(mock_bucket):
+    def chunks():
+        yield b'a'
+        yield b'b'
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        s3upload.upload_stream(mock_bucket, KEY, chunks())
+
+    client = mock_bucket.meta.client
+    client.abort_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID)
+    client.complete_multipart_upload.assert_not_called()
+
+
+def test_upload_composed(mock_bucket):
+    client = mock_bucket.meta.client
+    client.upload_part_copy.side_effect = [
+        {'CopyPartResult': {'ETag': 'etag-1'}},
+        {'CopyPartResult': {'ETag': 'etag-2'}},
+    ]
+
+    assert s3upload.upload_composed(mock_bucket, KEY, ['s1', 's2'], b'tail', ContentType='text/plain') == 3
+
+    client.create_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, ContentType='text/plain')
+    assert client.upload_part_copy.call_args_list == [
+        call(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID, PartNumber=1,
+             CopySource={'Bucket': BUCKET_NAME, 'Key': 's1'}),
+        call(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID, PartNumber=2,
+             CopySource={'Bucket': BUCKET_NAME, 'Key': 's2'}),
+    ]
+    client.upload_part.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID, PartNumber=3,
+                                               Body=b'tail')
+    parts = [
+        {'PartNumber': 1, 'ETag': 'etag-1'},
+        {'PartNumber': 2, 'ETag': 'etag-2'},
+        {'PartNumber': 3, 'ETag': 'etag-tail'},
+    ]
+    client.complete_multipart_upload.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, UploadId=UPLOAD_ID,
+                                                             MultipartUpload={'Parts': parts})
+
+
+def test_upload_composed_tail_only(mock_bucket):
+    assert s3upload.upload_composed(mock_bucket, KEY, [], b'tail') == 1
+
+    mock_bucket.meta.client.put_object.assert_called_once_with(Bucket=BUCKET_NAME, Key=KEY, Body=b'tail')
+    mock_bucket.meta.client.create_multipart_upload.assert_not_called()
+
+
+def test_gzip_stream():
+    data = [b'foo\n' * 1000, b'', b'bar\n' * 1000]
+    compressed = b''.join(s3upload.gzip_stream(data))
+    assert gzip.decompress(compressed) == b''.join(data)
+    assert len(compressed) < len(b''.join(data))
+
+
+def test_gzip_stream_empty():
+    assert gzip.decompress(b''.join(s3upload.gzip_stream([]))) == b''
@@ -0,0 +1,88 @@
+import datetime
+from urllib.parse import quote_plus, unquote_plus
+
+import boto3
+from botocore.client import Config
+import pytest
+
+import sigv4
+
+NOW = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+BUCKET_NAME = 'build-logs-bucket-1a2b3c'
+
+# keys as getbuildlogs sees them after unquote_plus of the key query parameter
+KEYS = [unquote_plus(quote_plus(key)) for key in [
+    'a1b2c3d4-e5f6/build.log',
+    'a1b2c3d4-e5f6/html/page-12.html',
+    'with space/build.log',
+    'plus+sign/build.log',
+    'percent%2Fescaped/build.log',
+    "special!'()*&$@=;:,?#[]/build.log",
+    'tilde~dash-under_score.dot/build.log',
+    'unicode-ü-✓/build.log',
+    '/leading/double//slashes/',
+]]
+
+
+@pytest.fixture
+def frozen_botocore_time(mocker):
+    mocker.patch('botocore.auth.get_current_datetime', return_value=NOW.replace(tzinfo=None))
+
+
+@pytest.mark.parametrize('key', KEYS)
+@pytest.mark.parametrize('region, endpoint_url', [
+    ('us-east-1', None),
+    ('eu-west-1', 'https://s3.eu-west-1.amazonaws.com'),
+    ('ap-southeast-5', 'https://s3.ap-southeast-5.amazonaws.com'),
+    # boto3 already uses the regional endpoint outside of the aws partition
+    ('cn-north-1', None),
+    ('us-gov-west-1', None),
+])
+@pytest.mark.parametrize('token', [None, 'session/token+=='])
+def test_presign_s3_get_url_matches_boto3(frozen_botocore_time, key, region, endpoint_url, token):
+    credentials = sigv4.Credentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY', token)
+    s3 = boto3.client('s3', region_name=region, endpoint_url=endpoint_url,
+                      config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'}),
+                      aws_access_key_id=credentials.access_key, aws_secret_access_key=credentials.secret_key,
+                      aws_session_token=token)
+
+    expected = s3.generate_presigned_url(ClientMethod='get_object', ExpiresIn=600,
+                                         Params={'Bucket': BUCKET_NAME, 'Key': key})
+
+    assert sigv4.presign_s3_get_url(BUCKET_NAME, key, 600, region, credentials, now=NOW) == expected
+
+
+@pytest.mark.parametrize('bucket', ['Upper-Case', 'with.dots', 'under_score', 'ab'])
+def test_presign_s3_get_url_unsupported_bucket(bucket):
+    credentials = sigv4.Credentials('AKID', 'secret', None)
+    assert sigv4.presign_s3_get_url(bucket, 'key', 600, 'us-east-1', credentials, now=NOW) is None
+
+
+@pytest.mark.parametrize('region, host', [
+    ('cn-north-1', BUCKET_NAME + '.s3.cn-north-1.amazonaws.com.cn'),
+    ('us-gov-west-1', BUCKET_NAME + '.s3.us-gov-west-1.amazonaws.com'),
+])
+def test_presign_s3_get_url_partition(region, host):
+    credentials = sigv4.Credentials('AKID', 'secret', None)
+    url = sigv4.presign_s3_get_url(BUCKET_NAME, 'key', 600, region, credentials, now=NOW)
+    assert url.startswith('https://{}/key?'.format(host))
+    assert '%2F{}%2Fs3%2Faws4_request'.format(region) in url
+
+
+@pytest.mark.parametrize('region', ['us-iso-east-1', 'us-isob-east-1', 'eu-isoe-west-1', 'eusc-de-east-1', ''])
+def test_presign_s3_get_url_unsupported_region(region):
+    credentials = sigv4.Credentials('AKID', 'secret', None)
+    assert sigv4.presign_s3_get_url(BUCKET_NAME, 'key', 600, region, credentials, now=NOW) is None
+
+
+def test_get_environment_credentials(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'AKID')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+    monkeypatch.delenv('AWS_SESSION_TOKEN', raising=False)
+    assert sigv4.get_environment_credentials() == sigv4.Credentials('AKID', 'secret', None)
+
+    monkeypatch.setenv('AWS_SESSION_TOKEN', 'token')
+    assert sigv4.get_environment_credentials() == sigv4.Credentials('AKID', 'secret', 'token')
+
+    monkeypatch.delenv('AWS_SECRET_ACCESS_KEY')
+    assert sigv4.get_environment_credentials() is None
@@ -0,0 +1,75 @@
+import pytest
+
+import ttlcache
+
+
+@pytest.fixture
+def mock_monotonic(mocker):
+    mock_monotonic = mocker.patch.object(ttlcache.time, 'monotonic')
+    mock_monotonic.return_value = 1000
+    return mock_monotonic
+
+
+def test_get_put(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10)
+    assert cache.get('foo') is None
+    cache.put('foo', 'bar')
+    assert cache.get('foo') == 'bar'
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_expiry(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10)
+    cache.put('foo', 'bar')
+    cache.put('short', 'lived', ttl=1)
+
+    mock_monotonic.return_value = 1001
+    assert cache.get('short', 'expired') == 'expired'
+    assert cache.get('foo') == 'bar'
+
+    mock_monotonic.return_value = 1010
+    assert cache.get('foo') is None
+
+
+def test_lru_eviction(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10, maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_get_or_load(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load('foo', loader) == 1
+    assert cache.get_or_load('foo', loader) == 1
+    assert len(loads) == 1
+
+
+def test_get_or_load_caches_falsy_values(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10)
+    cache.get_or_load('foo', lambda: None)
+    assert cache.get_or_load('foo', lambda: 'reloaded') is None
+
+
+def test_invalidate(mock_monotonic):
+    cache = ttlcache.TTLCache(ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+    cache.invalidate()
+    assert cache.get('b') is None